@@ -0,0 +1,218 @@
+# -*- coding: utf-8-*-
+"""
+The process-wide audio backend.
+
+There is a single AudioBackend per process. It owns the PyAudio instance
+(initializing PortAudio, and with it ALSA/JACK, only once), hands out the
+shared capture streams and output streams, and holds the DeviceArbiter
+that decides who may use the handset: listening, speaking and cue beeps
+all have to claim it with a priority before touching the audio devices.
+"""
+import contextlib
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+try:
+    import pyaudio
+except ImportError:
+    pass
+
+import capture
+
+# Priorities for DeviceArbiter claims; when the device is released, the
+# highest priority waiter gets it next
+BACKGROUND = 0
+SPEAK = 1
+LISTEN = 2
+
+
+class DeviceArbiter(object):
+    """
+    A reentrant lock whose waiters are served in order of priority (and in
+    order of arrival within the same priority).
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._counter = itertools.count()
+        self._owner = None
+        self._count = 0
+        self.name = None
+        self.priority = None
+
+    def acquire(self, priority, name=None, timeout=None):
+        """
+        Claims the device. A thread that already holds the claim gets it
+        again right away and has to release it once more.
+
+        Arguments:
+            priority -- one of BACKGROUND, SPEAK or LISTEN (or any number;
+                        higher is served first)
+            name -- (optional) what the device is used for, for diagnostics
+            timeout -- (optional) seconds to wait at most (Default: forever)
+
+        Returns:
+            True if the claim was granted, False on timeout
+        """
+        me = threading.current_thread().ident
+        with self._cond:
+            if self._owner == me:
+                self._count += 1
+                return True
+            entry = (-priority, next(self._counter), me)
+            heapq.heappush(self._waiting, entry)
+            deadline = None
+            if timeout is not None:
+                deadline = time.time() + timeout
+            while self._owner is not None or self._waiting[0] is not entry:
+                if deadline is None:
+                    self._cond.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self._waiting.remove(entry)
+                    heapq.heapify(self._waiting)
+                    # the next waiter may be able to go now
+                    self._cond.notify_all()
+                    return False
+                self._cond.wait(remaining)
+            heapq.heappop(self._waiting)
+            self._owner = me
+            self._count = 1
+            self.name = name
+            self.priority = priority
+            return True
+
+    def release(self):
+        """
+        Releases the claim of the current thread.
+
+        Raises:
+            RuntimeError if the current thread doesn't hold the claim
+        """
+        with self._cond:
+            if self._owner != threading.current_thread().ident:
+                raise RuntimeError("cannot release a claim not held")
+            self._count -= 1
+            if not self._count:
+                self._owner = None
+                self.name = None
+                self.priority = None
+                self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def claim(self, priority, name=None):
+        """
+        Context manager version of acquire() and release().
+        """
+        self.acquire(priority, name)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @property
+    def waiting(self):
+        """
+        The number of threads waiting for the device.
+        """
+        with self._cond:
+            return len(self._waiting)
+
+
+class AudioBackend(object):
+    """
+    Owns everything about the audio devices that should exist only once
+    per process. Use AudioBackend.get_instance() to get it.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def __init__(self):
+        self._logger = logging.getLogger(__name__)
+        self._audio = None
+        self._audio_lock = threading.Lock()
+        self._streams = {}
+        self._streams_lock = threading.Lock()
+        self.arbiter = DeviceArbiter()
+
+    @property
+    def pyaudio(self):
+        """
+        The PyAudio instance, initialized on first use.
+        """
+        with self._audio_lock:
+            if self._audio is None:
+                self._logger.info("Initializing PyAudio. ALSA/Jack error " +
+                                  "messages that pop up during this " +
+                                  "process are normal and can usually be " +
+                                  "safely ignored.")
+                self._audio = pyaudio.PyAudio()
+                self._logger.info("Initialization of PyAudio completed.")
+            return self._audio
+
+    def capture_stream(self, device, rate, process=False, source=None,
+                       **kwargs):
+        """
+        Returns the shared capture stream for the given device and rate (or
+        audio source), opening it if necessary. See capture.CaptureStream
+        for the other arguments.
+        """
+        key = (device, rate, source)
+        with self._streams_lock:
+            if key not in self._streams:
+                # a capture worker process initializes its own PyAudio, and
+                # other sources don't need it at all
+                audio = None
+                if not process and source is None:
+                    audio = self.pyaudio
+                self._streams[key] = capture.CaptureStream(
+                    device, rate, audio=audio, process=process,
+                    source=source, **kwargs)
+            return self._streams[key]
+
+    def open_output(self, device, rate, width=2, channels=1, **kwargs):
+        """
+        Opens an output stream on the shared PyAudio instance. The caller
+        owns the stream and has to close it.
+
+        Arguments:
+            device -- the PyAudio output device index
+            rate -- the sample rate in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+            channels -- (optional) the number of channels (Default: 1)
+            kwargs -- passed on to PyAudio.open()
+        """
+        audio = self.pyaudio
+        return audio.open(format=audio.get_format_from_width(width),
+                          channels=channels,
+                          rate=rate,
+                          output=True,
+                          output_device_index=device,
+                          **kwargs)
+
+    def close(self):
+        """
+        Closes all capture streams and terminates PyAudio.
+        """
+        with self._streams_lock:
+            streams = self._streams.values()
+            self._streams = {}
+        for stream in streams:
+            stream.close()
+        with self._audio_lock:
+            if self._audio is not None:
+                self._audio.terminate()
+                self._audio = None
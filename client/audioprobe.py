@@ -0,0 +1,224 @@
+# -*- coding: utf-8-*-
+"""
+Audio device capability probing.
+
+Finds out which sample rates and formats the configured devices support
+(and their latencies), so Mic can capture at a rate that needs little or
+no resampling and the speaker can play files without format conversion.
+Probing every combination takes a while on some sound cards, so the
+results are cached in the config dir, keyed by the identity of the device
+(host API, name and channel counts, since device indices can change
+between boots).
+"""
+import logging
+import os
+
+import yaml
+
+try:
+    import pyaudio
+except ImportError:
+    pass
+
+import jasperpath
+
+CACHE_FILE = 'audio_devices.yml'
+
+# the version of what probe() returns; cached results of another one are
+# probed again
+PROBE_VERSION = 2
+
+# rates tried when probing, in Hz
+RATES = (8000, 11025, 16000, 22050, 32000, 44100, 48000)
+
+# formats tried when probing, as (name, sample width in bytes)
+FORMATS = (('int16', 2), ('int32', 4), ('float32', 4))
+
+
+def _pyaudio_format(name):
+    return {'int16': pyaudio.paInt16,
+            'int32': pyaudio.paInt32,
+            'float32': pyaudio.paFloat32}[name]
+
+
+def device_identity(audio, index):
+    """
+    Returns:
+        A string identifying the device with the given PyAudio index,
+        independent of the index itself
+    """
+    info = audio.get_device_info_by_index(index)
+    host_api = audio.get_host_api_info_by_index(info['hostApi'])['name']
+    return '%s/%s/%d/%d' % (host_api, info['name'],
+                            info['maxInputChannels'],
+                            info['maxOutputChannels'])
+
+
+def find_alsa_device(audio, card):
+    """
+    Returns:
+        The PyAudio index of the ALSA device hw:card,0 (which is what the
+        speaker plays to), or None if there is no such device
+    """
+    name = '(hw:%d,0)' % card
+    for index in range(audio.get_device_count()):
+        if name in audio.get_device_info_by_index(index)['name']:
+            return index
+    return None
+
+
+def _supported(audio, index, direction, rate, channels, fmt):
+    kwargs = {'%s_device' % direction: index,
+              '%s_channels' % direction: channels,
+              '%s_format' % direction: _pyaudio_format(fmt)}
+    try:
+        return bool(audio.is_format_supported(rate, **kwargs))
+    except ValueError:
+        return False
+
+
+def probe(audio, index):
+    """
+    Probes a device.
+
+    Arguments:
+        audio -- a PyAudio instance
+        index -- the PyAudio device index
+
+    Returns:
+        A dict with the device name and, for input and output (if the
+        device has channels in that direction), the rates and formats
+        supported with any of its channel counts (many hw: devices only
+        play stereo), the channel counts supported at its default rate (or
+        the highest rate it supports instead) and the default latencies in
+        seconds
+    """
+    info = audio.get_device_info_by_index(index)
+    result = {'name': info['name'],
+              'default_rate': int(info['defaultSampleRate']),
+              'version': PROBE_VERSION}
+    for direction in ('input', 'output'):
+        max_channels = int(info['max%sChannels' % direction.title()])
+        if not max_channels:
+            continue
+        channels = [c for c in (1, 2) if c <= max_channels]
+
+        def supported(rate, fmt):
+            return any(_supported(audio, index, direction, rate, c, fmt)
+                       for c in channels)
+
+        rates = [rate for rate in RATES if supported(rate, 'int16')]
+        rate = int(info['defaultSampleRate'])
+        if rates and rate not in rates:
+            rate = rates[-1]
+        formats = [fmt for fmt, width in FORMATS if supported(rate, fmt)]
+        channels = [c for c in channels
+                    if _supported(audio, index, direction, rate, c,
+                                  'int16')]
+        result[direction] = {
+            'rates': rates,
+            'formats': formats,
+            'channels': channels,
+            'latency': [float(info['defaultLow%sLatency' %
+                                   direction.title()]),
+                        float(info['defaultHigh%sLatency' %
+                                   direction.title()])]}
+    return result
+
+
+def _load_cache(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+def get_capabilities(index, audio=None, refresh=False, cache_path=None):
+    """
+    Returns the capabilities of a device (see probe()), from the cache if
+    the device has been probed before.
+
+    Arguments:
+        index -- the PyAudio device index
+        audio -- (optional) the PyAudio instance to use; without it a
+                 temporary one is created (and terminated again)
+        refresh -- (optional) probe even if the device is in the cache
+        cache_path -- (optional) the cache file (Default: audio_devices.yml
+                      in the config dir)
+    """
+    logger = logging.getLogger(__name__)
+    if cache_path is None:
+        cache_path = jasperpath.config(CACHE_FILE)
+    own_audio = audio is None
+    if own_audio:
+        audio = pyaudio.PyAudio()
+    try:
+        identity = device_identity(audio, index)
+        cache = _load_cache(cache_path)
+        if (identity in cache and not refresh and
+                cache[identity].get('version') == PROBE_VERSION):
+            return cache[identity]
+        logger.info("Probing audio device %d (%s)", index, identity)
+        cache[identity] = probe(audio, index)
+    finally:
+        if own_audio:
+            audio.terminate()
+    try:
+        with open(cache_path, 'w') as f:
+            yaml.safe_dump(cache, f, default_flow_style=False)
+    except IOError:
+        logger.warning("Could not write audio device cache '%s'",
+                       cache_path, exc_info=True)
+    return cache[identity]
+
+
+def choose_capture_rate(capabilities, target_rate):
+    """
+    Picks the capture rate that needs the cheapest conversion to
+    target_rate: target_rate itself if the device supports it, else the
+    lowest supported integer multiple of it, else the lowest supported rate
+    above it, else the device's default rate.
+    """
+    rates = sorted(capabilities.get('input', {}).get('rates', []))
+    if target_rate in rates:
+        return target_rate
+    for candidates in ([r for r in rates if r % target_rate == 0],
+                       [r for r in rates if r > target_rate]):
+        if candidates:
+            return candidates[0]
+    return capabilities['default_rate']
+
+
+def supports_playback(capabilities, rate, width, channels):
+    """
+    Returns:
+        True if the device plays audio in this format without conversion
+    """
+    output = capabilities.get('output')
+    if not output:
+        return False
+    fmt = {2: 'int16', 4: 'int32'}.get(width)
+    return (rate in output['rates'] and fmt in output['formats'] and
+            channels in output['channels'])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Audio device probe')
+    parser.add_argument('--refresh', action='store_true',
+                        help='probe again even if the device is cached')
+    args = parser.parse_args()
+
+    audio = pyaudio.PyAudio()
+    for index in range(audio.get_device_count()):
+        caps = get_capabilities(index, audio=audio, refresh=args.refresh)
+        print("%d: %s" % (index, caps['name']))
+        for direction in ('input', 'output'):
+            if direction in caps:
+                d = caps[direction]
+                print("    %-6s rates %s, formats %s, channels %s, "
+                      "latency %.1f-%.1f ms" %
+                      (direction, d['rates'], d['formats'], d['channels'],
+                       1000 * d['latency'][0], 1000 * d['latency'][1]))
+    audio.terminate()
@@ -0,0 +1,403 @@
+# -*- coding: utf-8-*-
+"""
+Audio sources for the capture stream.
+
+A CaptureStream records from an AudioSource. Normally that is the
+PyAudioSource for the configured mic, but Mic can just as well be driven by
+replayed WAV files or synthetic audio, which makes it possible to
+benchmark and regression-test passive and active listening, the noise
+floor tracking and the STT path on a machine without a sound card.
+
+Replayed and synthetic audio is produced either in real time or, with
+realtime=False, as fast as the readers of the capture stream consume it.
+
+Run this file with a WAV file or a directory of them to benchmark Mic on
+it (see the bottom of this file).
+"""
+import audioop
+import glob
+import logging
+import os
+import threading
+import time
+import wave
+
+import numpy as np
+
+try:
+    import pyaudio
+except ImportError:
+    pass
+
+import resampler
+
+
+class AudioSource(object):
+    """
+    Base class of all audio sources. A source produces 16 bit mono PCM
+    data at a fixed rate and passes it to a callback, block by block.
+    """
+
+    def __init__(self, rate, chunk=1024):
+        """
+        Arguments:
+            rate -- the sample rate in Hz
+            chunk -- (optional) frames per block (Default: 1024)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.rate = rate
+        self.chunk = chunk
+
+    def start(self, callback, buffer):
+        """
+        Starts producing audio.
+
+        Arguments:
+            callback -- called with every block of audio and the number of
+                        frames lost before it (if the source knows)
+            buffer -- the RingBuffer the audio ends up in, for sources
+                      that pace themselves by its readers
+        """
+        raise NotImplementedError
+
+    def stop(self):
+        """
+        Stops producing audio.
+        """
+        raise NotImplementedError
+
+    @property
+    def active(self):
+        """
+        Whether the source is still producing audio.
+        """
+        raise NotImplementedError
+
+
+class _LossCounter(object):
+    """
+    Counts the frames an input stream callback missed, from the ADC
+    timestamps of the callbacks or, where the host API doesn't provide
+    them, from the overflow flag.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._expected = None
+
+    def __call__(self, frame_count, time_info, status):
+        adc_time = time_info.get('input_buffer_adc_time', 0) \
+            if time_info else 0
+        lost = 0
+        if adc_time:
+            if self._expected is not None:
+                gap = int(round((adc_time - self._expected) * self.rate))
+                if gap > frame_count // 2:
+                    lost = gap
+            self._expected = adc_time + frame_count / float(self.rate)
+        elif status & pyaudio.paInputOverflow:
+            lost = frame_count
+        return lost
+
+
+class PyAudioSource(AudioSource):
+    """
+    Records from a PyAudio input device.
+    """
+
+    def __init__(self, device, rate, chunk=1024, audio=None):
+        """
+        Arguments:
+            device -- the PyAudio input device index
+            rate -- the sample rate in Hz
+            chunk -- (optional) frames per PyAudio callback (Default: 1024)
+            audio -- (optional) the PyAudio instance to use; without it,
+                     the source initializes (and terminates) its own
+        """
+        super(PyAudioSource, self).__init__(rate, chunk)
+        self.device = device
+        self._audio = audio
+        self._stream = None
+
+    def start(self, callback, buffer):
+        self._own_audio = self._audio is None
+        if self._own_audio:
+            self._logger.info("Initializing PyAudio. ALSA/Jack error " +
+                              "messages that pop up during this process " +
+                              "are normal and can usually be safely " +
+                              "ignored.")
+            self._audio = pyaudio.PyAudio()
+            self._logger.info("Initialization of PyAudio completed.")
+        count_lost = _LossCounter(self.rate)
+
+        def stream_callback(in_data, frame_count, time_info, status):
+            callback(in_data, count_lost(frame_count, time_info, status))
+            return (None, pyaudio.paContinue)
+
+        self._logger.info("Opening capture stream on device %r at %d Hz",
+                          self.device, self.rate)
+        self._stream = self._audio.open(format=pyaudio.paInt16,
+                                        channels=1,
+                                        rate=self.rate,
+                                        input=True,
+                                        input_device_index=self.device,
+                                        frames_per_buffer=self.chunk,
+                                        stream_callback=stream_callback)
+        self._stream.start_stream()
+
+    def stop(self):
+        self._stream.stop_stream()
+        self._stream.close()
+        if self._own_audio:
+            self._audio.terminate()
+            self._audio = None
+
+    @property
+    def active(self):
+        return self._stream is not None and self._stream.is_active()
+
+
+class ReplaySource(AudioSource):
+    """
+    Base class of sources that generate their audio on a thread, either in
+    real time or as fast as it is read.
+    """
+
+    def __init__(self, rate, chunk=1024, realtime=True, lead=1.0):
+        """
+        Arguments:
+            rate -- the sample rate in Hz
+            chunk -- (optional) frames per block (Default: 1024)
+            realtime -- (optional) produce audio in real time; if False,
+                        audio is produced as fast as the readers of the
+                        capture stream ask for it (Default: True)
+            lead -- (optional) when not in real time, stay this many
+                    seconds ahead of the readers, like a live mic would
+                    while nobody listens (Default: 1)
+        """
+        super(ReplaySource, self).__init__(rate, chunk)
+        self.realtime = realtime
+        self.lead = lead
+        self.position = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _generate(self, frames):
+        """
+        Returns:
+            The next frames frames of audio, as a NumPy int16 array
+        """
+        raise NotImplementedError
+
+    def start(self, callback, buffer):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run,
+                                        args=(callback, buffer),
+                                        name='audio replay')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, callback, buffer):
+        start = time.time()
+        produced = 0
+        ahead = int(self.lead * self.rate)
+        while not self._stop.is_set():
+            if self.realtime:
+                delay = start + produced / float(self.rate) - time.time()
+                if delay > 0:
+                    self._stop.wait(delay)
+                    continue
+            elif not buffer.wait_for_demand(ahead, timeout=0.1):
+                continue
+            data = self._generate(self.chunk)
+            self.position += len(data)
+            produced += len(data)
+            callback(data.astype('<i2').tostring(), 0)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @property
+    def active(self):
+        return self._thread is not None and self._thread.is_alive()
+
+
+class WavSource(ReplaySource):
+    """
+    Replays a WAV file or all WAV files in a directory (in alphabetical
+    order), followed by silence.
+    """
+
+    def __init__(self, path, rate=None, chunk=1024, realtime=True, gap=0):
+        """
+        Arguments:
+            path -- a WAV file or a directory of WAV files
+            rate -- (optional) the sample rate to replay at; files at other
+                    rates are resampled (Default: the rate of the first
+                    file)
+            chunk -- (optional) frames per block (Default: 1024)
+            realtime -- (optional) see ReplaySource (Default: True)
+            gap -- (optional) seconds of silence inserted after every file
+                   (Default: 0)
+        """
+        if os.path.isdir(path):
+            paths = sorted(glob.glob(os.path.join(path, '*.wav')))
+        else:
+            paths = [path]
+        if not paths:
+            raise ValueError("No WAV files in '%s'" % path)
+        parts = []
+        # (path, first frame, end frame) of every file
+        self.files = []
+        length = 0
+        for filename in paths:
+            file_rate, data = self._load(filename)
+            if rate is None:
+                rate = file_rate
+            data = resampler.resample(data, file_rate, rate)
+            samples = np.frombuffer(data, dtype='<i2')
+            self.files.append((filename, length, length + len(samples)))
+            parts.extend([samples, np.zeros(int(gap * rate), np.int16)])
+            length += len(samples) + int(gap * rate)
+        super(WavSource, self).__init__(rate, chunk, realtime)
+        self._samples = np.concatenate(parts)
+        self.finished = threading.Event()
+
+    @staticmethod
+    def _load(filename):
+        wav = wave.open(filename, 'rb')
+        try:
+            width = wav.getsampwidth()
+            channels = wav.getnchannels()
+            data = wav.readframes(wav.getnframes())
+            rate = wav.getframerate()
+        finally:
+            wav.close()
+        if width != 2:
+            data = audioop.lin2lin(data, width, 2)
+        if channels == 2:
+            data = audioop.tomono(data, 2, 0.5, 0.5)
+        elif channels != 1:
+            raise ValueError("'%s' has %d channels" % (filename, channels))
+        return rate, data
+
+    def _generate(self, frames):
+        data = self._samples[self.position:self.position + frames]
+        if len(data) < frames:
+            self.finished.set()
+            data = np.concatenate((data, np.zeros(frames - len(data),
+                                                  np.int16)))
+        return data
+
+
+class SyntheticSource(ReplaySource):
+    """
+    Generates audio with a function, by default white noise.
+    """
+
+    def __init__(self, rate, chunk=1024, realtime=True, func=None,
+                 noise=30, seed=0):
+        """
+        Arguments:
+            rate -- the sample rate in Hz
+            chunk -- (optional) frames per block (Default: 1024)
+            realtime -- (optional) see ReplaySource (Default: True)
+            func -- (optional) called with the number of frames and the
+                    position of the first one, returns the samples (a
+                    sequence of numbers) to add to the noise
+            noise -- (optional) the rms of the white noise (Default: 30)
+            seed -- (optional) seed of the noise generator (Default: 0)
+        """
+        super(SyntheticSource, self).__init__(rate, chunk, realtime)
+        self.func = func
+        self.noise = noise
+        self._random = np.random.RandomState(seed)
+
+    def _generate(self, frames):
+        samples = self._random.normal(0, self.noise, frames)
+        if self.func is not None:
+            samples += self.func(frames, self.position)
+        return np.clip(np.round(samples), -32768, 32767)
+
+
+def from_config(config, rate, chunk=1024):
+    """
+    Creates the source described by the 'source' entry of the 'capture'
+    section of profile.yml, e.g.
+
+        source:
+          type: wav
+          path: /home/pi/recordings
+          realtime: false
+
+    Arguments:
+        config -- the source configuration (a dict)
+        rate -- the sample rate in Hz (WAV replay resamples to it)
+        chunk -- (optional) frames per block (Default: 1024)
+
+    Returns:
+        The source, or None if the configured source is the mic itself
+        (type 'pyaudio')
+    """
+    if config.get('type', 'pyaudio') == 'pyaudio':
+        return None
+    realtime = config.get('realtime', True)
+    if config['type'] == 'wav':
+        return WavSource(os.path.expanduser(config['path']), rate, chunk,
+                         realtime=realtime, gap=config.get('gap', 0))
+    if config['type'] == 'synthetic':
+        return SyntheticSource(rate, chunk, realtime=realtime,
+                               noise=config.get('noise', 30))
+    raise ValueError("Unknown audio source type '%s'" % config['type'])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import local_phone
+    import mic
+    import phone
+    import stt
+    import tts
+
+    parser = argparse.ArgumentParser(
+        description='Replays WAV files through Mic.activeListenToAllOptions ' +
+        'and reports the transcriptions and timings')
+    parser.add_argument('path', help='a WAV file or a directory of them')
+    parser.add_argument('--stt', default='sphinx',
+                        help='the slug of the STT engine to use')
+    parser.add_argument('--rate', type=int, default=None,
+                        help='the capture rate (Default: the file rate)')
+    parser.add_argument('--gap', type=float, default=1.5,
+                        help='seconds of silence after every file')
+    parser.add_argument('--realtime', action='store_true',
+                        help='replay in real time instead of as fast as ' +
+                        'possible')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    # there is no handset to go on hook
+    phone.get_phone = local_phone.Phone.get_phone
+
+    source = WavSource(args.path, rate=args.rate, realtime=args.realtime,
+                       gap=args.gap)
+    engine_class = stt.get_engine_by_slug(args.stt)
+    m = mic.Mic(tts.DummyTTS(), engine_class.get_passive_instance(),
+                engine_class.get_active_instance(), source=source)
+
+    times = []
+    while not source.finished.is_set():
+        start = time.time()
+        position = source.position
+        candidates = m.activeListenToAllOptions()
+        elapsed = time.time() - start
+        times.append(elapsed)
+        print("%7.2f s: %s (%.3f s)" % (float(position) / source.rate,
+                                        candidates, elapsed))
+    print("%d utterances, %.3f s per utterance on average" %
+          (len(times), sum(times) / len(times)))
+    print("noise floor history: %s" %
+          ', '.join('%.1f' % e for t, e in m.noise_floor.history))
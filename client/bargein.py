@@ -0,0 +1,402 @@
+# -*- coding: utf-8-*-
+"""
+Barge-in: letting the caller interrupt Jasper while it is talking.
+
+The capture stream keeps running while the speaker plays, so the mic hears
+both the caller and the earpiece leaking into it. The BargeInDetector
+knows what is being played: it compares the level of every captured frame
+with the level of the played audio around that time, scaled by the echo
+gain (how loud the earpiece comes back through the mic, learned while
+nobody else talks). A run of frames that are clearly louder than both the
+echo and the background noise is the caller talking.
+
+BargeIn ties a detector to a capture stream and a speaker: it stops the
+playback as soon as the caller starts talking and remembers where in the
+capture stream that was, so the next activeListen() starts right there
+instead of beeping and waiting. It also counts how often it triggered
+without the caller having said anything (the next activeListen() heard
+nothing), i.e. how often the speaker's own voice set it off.
+
+Run this file with a directory of WAV files of the speaker's voice to
+measure the false trigger rate and detection latency offline (see the
+bottom of this file).
+"""
+import audioop
+import contextlib
+import logging
+import threading
+import wave
+
+import numpy as np
+
+
+def load_reference(filename):
+    """
+    Returns:
+        A tuple of the sample rate and the samples (as a NumPy int16 array)
+        of a WAV file, mixed down to mono
+    """
+    wav = wave.open(str(filename), 'rb')
+    try:
+        width = wav.getsampwidth()
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        data = wav.readframes(wav.getnframes())
+    finally:
+        wav.close()
+    if width != 2:
+        data = audioop.lin2lin(data, width, 2)
+    if channels == 2:
+        data = audioop.tomono(data, 2, 0.5, 0.5)
+    return rate, np.frombuffer(data, dtype='<i2')
+
+
+class BargeInDetector(object):
+    """
+    Detects speech in captured audio that is not the echo of a known,
+    playing signal, from the start of the playback until its echo has
+    died down.
+    """
+
+    def __init__(self, rate, frame_ms=10, margin_db=10.0, min_speech_ms=60,
+                 max_delay_ms=300, echo_gain=1.0, adaptation=0.05):
+        """
+        Arguments:
+            rate -- the capture sample rate in Hz
+            frame_ms -- (optional) the frame length in milliseconds
+                        (Default: 10)
+            margin_db -- (optional) how much louder than the expected echo
+                         a frame has to be to count as caller speech
+                         (Default: 10)
+            min_speech_ms -- (optional) milliseconds of consecutive caller
+                             speech that trigger (Default: 60)
+            max_delay_ms -- (optional) the longest delay between starting
+                            the playback and hearing it in the capture
+                            stream (Default: 300)
+            echo_gain -- (optional) the initial estimate of the level of
+                         the echo relative to the played audio (Default: 1)
+            adaptation -- (optional) how fast the echo gain rises to the
+                          measured echo, per frame; it falls ten times more
+                          slowly (Default: 0.05)
+        """
+        self.rate = rate
+        self.frame_ms = frame_ms
+        self.frame_length = int(rate * frame_ms / 1000)
+        self.margin = 10 ** (margin_db / 20.0)
+        self.min_speech_frames = max(1, int(min_speech_ms / frame_ms))
+        self.delay_frames = int(max_delay_ms / frame_ms)
+        self.echo_gain = echo_gain
+        self.adaptation = adaptation
+        # the rms below which everything is background noise
+        self.noise_rms = 0
+        # (capture position of the playback start, envelope of the played
+        # audio per frame)
+        self._reference = None
+        self._run = 0
+
+    def start(self, samples, rate, position):
+        """
+        Tells the detector that playback of samples (at rate Hz) starts at
+        the absolute capture position position.
+        """
+        n = int(rate * self.frame_ms / 1000)
+        count = len(samples) // n
+        frames = np.asarray(samples[:count * n], dtype=np.float64)
+        rms = np.sqrt((frames.reshape(count, n) ** 2).mean(axis=1))
+        # the echo arrives up to delay_frames later, so every frame may
+        # hear the loudest played frame of that window
+        envelope = np.zeros(count + self.delay_frames)
+        for shift in range(self.delay_frames + 1):
+            np.maximum(envelope[shift:shift + count], rms,
+                       out=envelope[shift:shift + count])
+        self._reference = (position, envelope)
+        self._run = 0
+
+    def _echo(self, position, count):
+        """
+        Returns:
+            The envelope of the played audio for count frames from position,
+            NaN where nothing can be heard of the playback
+        """
+        echo = np.empty(count)
+        echo.fill(np.nan)
+        if self._reference is None:
+            return echo
+        start, envelope = self._reference
+        first = (position - start) // self.frame_length
+        begin = max(first, 0)
+        end = min(first + count, len(envelope))
+        if begin < end:
+            echo[begin - first:end - first] = envelope[begin:end]
+        return echo
+
+    def feed(self, data, position):
+        """
+        Processes a block of captured audio. Partial frames at the end of
+        the block are ignored, so read whole frames.
+
+        Arguments:
+            data -- a byte string of 16 bit little-endian PCM data
+            position -- the absolute capture position of its first sample
+
+        Returns:
+            The absolute capture position where the caller started talking,
+            or None if the caller hasn't (yet)
+        """
+        samples = np.frombuffer(data, dtype='<i2')
+        count = len(samples) // self.frame_length
+        if not count:
+            return None
+        frames = samples[:count * self.frame_length].reshape(
+            count, self.frame_length).astype(np.float64)
+        levels = np.sqrt((frames ** 2).mean(axis=1))
+        echo = self._echo(position, count)
+        for i, (level, played) in enumerate(zip(levels.tolist(),
+                                                echo.tolist())):
+            if played != played:
+                # only listen for the caller while something plays
+                self._run = 0
+                continue
+            expected = self.echo_gain * played * self.margin
+            if level > max(self.noise_rms, expected):
+                self._run += 1
+                if self._run >= self.min_speech_frames:
+                    self._run = 0
+                    return position + (i + 1 - self.min_speech_frames) * \
+                        self.frame_length
+                continue
+            self._run = 0
+            if played > self.noise_rms and played > 0:
+                # only the echo (and noise) can be heard, learn its level;
+                # the envelope is the loudest played frame of the delay
+                # window, so quiet frames say little and the gain falls
+                # much more slowly than it rises
+                ratio = level / played
+                rate = self.adaptation
+                if ratio < self.echo_gain:
+                    rate /= 10
+                self.echo_gain += rate * (ratio - self.echo_gain)
+        return None
+
+
+class BargeIn(object):
+    """
+    Watches the capture stream while a speaker plays and interrupts it when
+    the caller talks. A speaker reports its playbacks to the BargeIn set
+    as its playback_monitor (see tts.AbstractTTSEngine.play()).
+    """
+
+    def __init__(self, capture, detector):
+        """
+        Arguments:
+            capture -- the capture.CaptureStream to watch
+            detector -- the BargeInDetector deciding when the caller talks
+        """
+        self._logger = logging.getLogger(__name__)
+        self.capture = capture
+        self.detector = detector
+        self._lock = threading.Lock()
+        # capture position where the caller started talking, until the
+        # next activeListen() takes it
+        self._pending = None
+        self._stop = threading.Event()
+        # statistics
+        self.playbacks = 0
+        self.triggers = 0
+        self.false_triggers = 0
+
+    @property
+    def interrupted(self):
+        """
+        Whether the caller has interrupted the speaker and nobody listened
+        yet. The speaker stops playing and doesn't start anything new while
+        this is True.
+        """
+        with self._lock:
+            if (self._pending is not None and
+               self._pending < self.capture.buffer.oldest):
+                # too old to be listened to anymore, forget about it
+                self._logger.debug('Dropping stale barge-in')
+                self._pending = None
+            return self._pending is not None
+
+    def started(self, filename):
+        """
+        Called by the speaker right before it starts playing a WAV file.
+        """
+        try:
+            rate, samples = load_reference(filename)
+        except (wave.Error, EOFError, IOError):
+            self._logger.warning("Can't watch the playback of '%s'",
+                                 filename, exc_info=True)
+            return
+        self.playbacks += 1
+        self.detector.start(samples, rate, self.capture.buffer.position)
+
+    def stopped(self):
+        """
+        Called by the speaker when a playback has ended.
+        """
+        pass
+
+    @contextlib.contextmanager
+    def monitoring(self, speaker, noise_rms=0):
+        """
+        Watches the capture stream for the caller while the block runs,
+        e.g. around speaker.say().
+
+        Arguments:
+            speaker -- the TTS engine to report its playbacks and to stop
+            noise_rms -- (optional) the rms of the background noise
+        """
+        self.detector.noise_rms = noise_rms
+        reader = self.capture.reader()
+        self._stop.clear()
+        thread = threading.Thread(target=self._watch, args=(reader,),
+                                  name='barge-in')
+        thread.daemon = True
+        speaker.playback_monitor = self
+        thread.start()
+        try:
+            yield
+        finally:
+            speaker.playback_monitor = None
+            self._stop.set()
+            thread.join(1)
+
+    def _watch(self, reader):
+        # a few frames at a time keep the detection latency low
+        block = 4 * self.detector.frame_length
+        while not self._stop.is_set():
+            position = reader.position
+            try:
+                data = reader.read(block)
+            except IOError:
+                continue
+            onset = self.detector.feed(data, position)
+            if onset is not None:
+                with self._lock:
+                    self._pending = onset
+                self.triggers += 1
+                self._logger.info('Caller barged in')
+                return
+
+    def take(self):
+        """
+        Returns:
+            The capture position where the caller started talking over the
+            speaker (resetting it), or None if the caller didn't
+        """
+        if not self.interrupted:
+            return None
+        with self._lock:
+            onset, self._pending = self._pending, None
+        return onset
+
+    def record(self, heard):
+        """
+        Records whether the activeListen() after a barge-in heard anything,
+        and logs the statistics. Triggers after which the caller said
+        nothing are counted as false triggers.
+        """
+        if not heard:
+            self.false_triggers += 1
+        self._logger.info(self.report())
+
+    def report(self):
+        """
+        Returns:
+            A summary of the barge-in statistics
+        """
+        rate = 0.0
+        if self.playbacks:
+            rate = 100.0 * self.false_triggers / self.playbacks
+        return ('Barge-in: %d playbacks, %d interrupted, %d false triggers ' +
+                '(%.1f%% of the playbacks)') % (self.playbacks, self.triggers,
+                                                self.false_triggers, rate)
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import os
+
+    parser = argparse.ArgumentParser(
+        description='Offline barge-in evaluation: feeds the echo of every ' +
+        'WAV file (and optionally a caller talking over it) through the ' +
+        'detector, as the mic would hear it')
+    parser.add_argument('voice', help='directory of WAV files of the ' +
+                        'speaker, e.g. recorded TTS output')
+    parser.add_argument('--caller', help='a WAV file of a caller, mixed in ' +
+                        'halfway through every file')
+    parser.add_argument('--rate', type=int, default=16000)
+    parser.add_argument('--echo-gain', type=float, default=0.3,
+                        help='level of the simulated echo')
+    parser.add_argument('--delay-ms', type=int, default=150,
+                        help='delay of the simulated echo')
+    parser.add_argument('--noise', type=float, default=30,
+                        help='rms of the simulated background noise')
+    parser.add_argument('--margin-db', type=float, default=10.0)
+    parser.add_argument('--block', type=int, default=160)
+    args = parser.parse_args()
+
+    import resampler
+
+    def at_rate(rate, samples):
+        data = resampler.resample(samples.astype('<i2').tostring(), rate,
+                                  args.rate)
+        return np.frombuffer(data, dtype='<i2').astype(np.float64)
+
+    caller = None
+    if args.caller:
+        caller = at_rate(*load_reference(args.caller))
+    files = sorted(glob.glob(os.path.join(args.voice, '*.wav')))
+    if not files:
+        parser.error("no WAV files in %s" % args.voice)
+
+    detector = BargeInDetector(args.rate, margin_db=args.margin_db)
+    rng = np.random.RandomState(0)
+    false_triggers = 0
+    latencies = []
+    misses = 0
+    for path in files:
+        rate, samples = load_reference(path)
+        voice = at_rate(rate, samples)
+        delay = int(args.delay_ms * args.rate / 1000)
+        mic = np.zeros(len(voice) + delay + args.rate)
+        mic[delay:delay + len(voice)] += args.echo_gain * voice
+        onset = None
+        if caller is not None:
+            onset = len(voice) // 2
+            end = min(len(mic), onset + len(caller))
+            mic[onset:end] += caller[:end - onset]
+        mic += rng.normal(0, args.noise, len(mic))
+        data = np.clip(np.round(mic), -32768, 32767).astype('<i2').tostring()
+
+        detector.noise_rms = 3 * args.noise
+        detector.start(samples, rate, 0)
+        detected = None
+        for offset in range(0, len(mic), args.block):
+            detected = detector.feed(data[offset * 2:
+                                          (offset + args.block) * 2], offset)
+            if detected is not None:
+                # when the caller is heard, at the end of that block
+                heard = offset + args.block
+                break
+        if detected is None:
+            if onset is not None:
+                misses += 1
+        elif onset is None or detected < onset:
+            false_triggers += 1
+        else:
+            latencies.append(1000.0 * (heard - onset) / args.rate)
+
+    print("%d files, echo gain learned %.3f" % (len(files),
+                                                detector.echo_gain))
+    print("false triggers %d (%.1f%%)" % (false_triggers,
+                                          100.0 * false_triggers / len(files)))
+    if caller is not None:
+        print("missed %d" % misses)
+        if latencies:
+            print("detection latency median %.0f ms, max %.0f ms" %
+                  (np.median(latencies), max(latencies)))
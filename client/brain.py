@@ -1,8 +1,9 @@
 # -*- coding: utf-8-*-
 import logging
 import pkgutil
+import threading
 import jasperpath
-import client.mic
+import modulecache
 import phone
 
 
@@ -25,9 +26,55 @@ class Brain(object):
         self.profile = profile
         self.active_stt_engine = active_stt_engine
         self.modules = self.get_modules()
-        self.module_mics = dict()
         self._logger = logging.getLogger(__name__)
         self._echo = echo
+        self.module_mics = self._get_module_cache()
+
+    def _get_module_cache(self):
+        """
+        Returns:
+            The cache of the Mics of modules with INSTANCE_WORDS, limited
+            as configured in the 'module_cache' section of the profile, and
+            starts prewarming it with the modules configured there
+        """
+        max_entries = 8
+        max_bytes = None
+        prewarm = []
+        if 'module_cache' in self.profile:
+            config = self.profile['module_cache']
+            if 'max_entries' in config:
+                max_entries = config['max_entries']
+            if 'max_mb' in config:
+                max_bytes = int(config['max_mb'] * 1024 * 1024)
+            if 'prewarm' in config:
+                prewarm = config['prewarm']
+        cache = modulecache.ModuleCache(self._create_module_mic,
+                                        max_entries=max_entries,
+                                        max_bytes=max_bytes,
+                                        evict=self._free_module_mic,
+                                        size=self._module_mic_size)
+        modules = dict((module.__name__, module) for module in self.modules
+                       if hasattr(module, 'INSTANCE_WORDS'))
+        prewarm = [modules[name] for name in prewarm if name in modules]
+        if prewarm and self.active_stt_engine is not None:
+            # the most popular module comes first in the profile
+            thread = threading.Thread(target=cache.prewarm,
+                                      args=(prewarm,),
+                                      name='module prewarm')
+            thread.daemon = True
+            thread.start()
+        return cache
+
+    def _create_module_mic(self, module):
+        self._logger.debug('creating mic for module %s', module.__name__)
+        engine = self.active_stt_engine.get_module_instance(module)
+        return self.mic.view(engine)
+
+    def _free_module_mic(self, mic):
+        mic.active_stt_engine.close()
+
+    def _module_mic_size(self, mic):
+        return getattr(mic.active_stt_engine, 'resident_bytes', None)
 
     @classmethod
     def get_modules(cls):
@@ -61,47 +108,64 @@ class Brain(object):
                      else 0, reverse=True)
         return modules
 
+    @staticmethod
+    def _candidates(texts):
+        # the most likely transcription first; texts without a confidence
+        # (see stt.Hypothesis) keep the order the STT engine gave them
+        return sorted(texts, key=lambda text: -(getattr(text, 'confidence',
+                                                        None) or 0))
+
+    def _matches(self, texts):
+        """
+        Yields the (text, module) pairs of valid phrases, trying the texts
+        in order of confidence and, for each, the modules in order of
+        priority. Fallback modules (with a negative PRIORITY, like Unclear)
+        come last, so a less likely transcription that some module
+        understands wins over giving up on the most likely one.
+        """
+        fallbacks = [module for module in self.modules
+                     if getattr(module, 'PRIORITY', 0) < 0]
+        modules = [module for module in self.modules
+                   if module not in fallbacks]
+        candidates = self._candidates(texts)
+        for group in (modules, fallbacks):
+            for text in candidates:
+                for module in group:
+                    yield text, module
+
     def query(self, texts):
         """
         Passes user input to the appropriate module, testing it against
         each candidate module's isValid function.
 
         Arguments:
-        text -- user input, typically speech, to be parsed by a module
+        texts -- user input, typically speech, to be parsed by a module:
+                 the candidate transcriptions
         """
-        for module in self.modules:
-            for text in texts:
-                if module.isValid(text):
-                    self._logger.debug("'%s' is a valid phrase for module " +
-                                       "'%s'", text, module.__name__)
-                    try:
-                        if self.active_stt_engine is not None and hasattr(module, 'INSTANCE_WORDS'):
-                            self._logger.debug('Finding mic with instance words %s', ', '.join(module.INSTANCE_WORDS))
-                            if module.__name__ not in self.module_mics:
-                                self._logger.debug('creating mic for module %s', module.__name__)
-                                self.module_mics[module.__name__] = client.mic.Mic(
-                                    self.mic.speaker,
-                                    self.mic.passive_stt_engine,
-                                    self.active_stt_engine.get_module_instance(module),
-                                    echo=self._echo
-                                )
-                            mic = self.module_mics[module.__name__]
-                        else:
-                            mic = self.mic
-                        module.handle(text, mic, self.profile)
-                    except phone.Hangup:
-                        self._logger.info('Module got hangup')
-                        print('Well fine! Just hang up on me')
-                    except Exception:
-                        self._logger.error('Failed to execute module',
-                                           exc_info=True)
-                        self.mic.say("I'm sorry. I had some trouble with " +
-                                     "that operation. Please try again later.")
+        for text, module in self._matches(texts):
+            if module.isValid(text):
+                self._logger.debug("'%s' is a valid phrase for module " +
+                                   "'%s'", text, module.__name__)
+                try:
+                    if self.active_stt_engine is not None and hasattr(module, 'INSTANCE_WORDS'):
+                        self._logger.debug('Finding mic with instance words %s', ', '.join(module.INSTANCE_WORDS))
+                        mic = self.module_mics.get(module)
                     else:
-                        self._logger.debug("Handling of phrase '%s' by " +
-                                           "module '%s' completed", text,
-                                           module.__name__)
-                    finally:
-                        return
+                        mic = self.mic
+                    module.handle(text, mic, self.profile)
+                except phone.Hangup:
+                    self._logger.info('Module got hangup')
+                    print('Well fine! Just hang up on me')
+                except Exception:
+                    self._logger.error('Failed to execute module',
+                                       exc_info=True)
+                    self.mic.say("I'm sorry. I had some trouble with " +
+                                 "that operation. Please try again later.")
+                else:
+                    self._logger.debug("Handling of phrase '%s' by " +
+                                       "module '%s' completed", text,
+                                       module.__name__)
+                finally:
+                    return
         self._logger.debug("No module was able to handle any of these " +
                            "phrases: %r", texts)
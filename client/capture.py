@@ -0,0 +1,465 @@
+# -*- coding: utf-8-*-
+"""
+Long-lived audio capture.
+
+A CaptureStream keeps a single PyAudio input stream open per device. The
+stream's callback copies everything it hears into a fixed-size RingBuffer,
+and consumers (threshold estimation, passive and active listening) read
+windows of that buffer through a CaptureReader. Because the stream never
+stops, a reader can also start a little in the past ("pre-roll") so that
+speech which began just before the listen call is not lost.
+
+Optionally the PyAudio input can run in a separate worker process, which
+writes into a SharedRingBuffer in shared memory. The worker has its own
+interpreter and GIL, so busy threads in Jasper itself can no longer delay
+the capture callback long enough to drop frames.
+"""
+import ctypes
+import logging
+import multiprocessing
+import threading
+import time
+
+import numpy as np
+
+import audiosource
+import noisefloor
+
+
+class RingBuffer(object):
+    """
+    A thread-safe, fixed-size circular buffer of PCM frames.
+
+    Positions are absolute frame counts since the buffer was created, so a
+    reader can tell whether the data it wants is still available or has
+    already been overwritten.
+    """
+
+    def __init__(self, frames, width=2):
+        """
+        Arguments:
+            frames -- the capacity of the buffer in frames
+            width -- (optional) the size of one frame in bytes (Default: 2)
+        """
+        self.width = width
+        self.capacity = int(frames)
+        self._size = self.capacity * width
+        self._buf = bytearray(self._size)
+        self._head = 0  # total number of bytes ever written
+        self._cond = threading.Condition()
+        self.lost = 0  # frames the writer knows it missed
+        self._demand = 0  # the highest position readers are waiting for
+
+    @property
+    def position(self):
+        """
+        Returns:
+            The absolute position (in frames) of the next frame to be written
+        """
+        return self._head // self.width
+
+    @property
+    def oldest(self):
+        """
+        Returns:
+            The absolute position (in frames) of the oldest available frame
+        """
+        return max(0, self.position - self.capacity)
+
+    def write(self, data):
+        """
+        Appends PCM data to the buffer, overwriting the oldest frames if
+        necessary, and wakes up all waiting readers.
+        """
+        data = bytes(data)
+        skipped = max(0, len(data) - self._size)
+        if skipped:
+            data = data[skipped:]
+        n = len(data)
+        with self._cond:
+            self._head += skipped
+            start = self._head % self._size
+            end = start + n
+            if end <= self._size:
+                self._buf[start:end] = data
+            else:
+                split = self._size - start
+                self._buf[start:] = data[:split]
+                self._buf[:n - split] = data[split:]
+            self._head += n
+            self._cond.notify_all()
+
+    def read(self, start, frames):
+        """
+        Returns the frames in [start, start + frames) as a byte string.
+
+        Raises:
+            ValueError if (part of) the requested window has already been
+            overwritten or has not been written yet
+        """
+        with self._cond:
+            return self._read(start, frames)
+
+    def _read(self, start, frames):
+        if start < self.oldest or start + frames > self.position:
+            raise ValueError("Frames [%d, %d) not available" %
+                             (start, start + frames))
+        begin = (start * self.width) % self._size
+        n = frames * self.width
+        end = begin + n
+        if end <= self._size:
+            return bytes(self._buf[begin:end])
+        return bytes(self._buf[begin:] + self._buf[:end - self._size])
+
+    def valid(self, start):
+        """
+        Returns:
+            True if the frame at start has not been overwritten yet
+        """
+        return start >= self.oldest
+
+    def wait_for(self, position, timeout=None):
+        """
+        Blocks until the buffer has been written up to position (in frames).
+
+        Returns:
+            True if the position has been reached, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            if position > self._demand:
+                self._demand = position
+                # wake up writers waiting for demand
+                self._cond.notify_all()
+            while self.position < position:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+    def wait_for_demand(self, ahead=0, timeout=None):
+        """
+        Blocks until a reader waits for frames that haven't been written
+        yet, or the buffer is less than ahead frames ahead of the furthest
+        position a reader has asked for. Writers that produce audio on
+        demand (see audiosource.ReplaySource) use this to pace themselves.
+
+        Returns:
+            True if there is demand, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while self._demand + ahead <= self.position:
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            return True
+
+
+class SharedRingBuffer(RingBuffer):
+    """
+    A RingBuffer in shared memory, for a writer in another process.
+
+    It has to be created before the writer process is started, so both
+    processes share the memory, the position (the sequence counter of the
+    frames written) and the lost frame counter.
+    """
+
+    def __init__(self, frames, width=2):
+        self.width = width
+        self.capacity = int(frames)
+        self._size = self.capacity * width
+        self._buf = multiprocessing.RawArray('c', self._size)
+        self._samples = None
+        if width == 2:
+            self._samples = np.frombuffer(self._buf, dtype='<i2')
+        self._seq = multiprocessing.RawValue(ctypes.c_longlong, 0)
+        self._lost = multiprocessing.RawValue(ctypes.c_longlong, 0)
+        self._cond = multiprocessing.Condition()
+        self._demand = 0
+
+    @property
+    def _head(self):
+        return self._seq.value
+
+    @_head.setter
+    def _head(self, value):
+        self._seq.value = value
+
+    @property
+    def lost(self):
+        return self._lost.value
+
+    @lost.setter
+    def lost(self, value):
+        self._lost.value = value
+
+    def view(self, start, frames):
+        """
+        Returns the frames in [start, start + frames) without copying them,
+        as a list of one or (if the window wraps around) two NumPy arrays
+        of 16 bit samples.
+
+        The arrays point into the ring, so the writer overwrites them after
+        about a buffer length. Check valid(start) once done with them to
+        make sure that hasn't happened yet.
+
+        Raises:
+            ValueError if (part of) the requested window is not available
+        """
+        if start < self.oldest or start + frames > self.position:
+            raise ValueError("Frames [%d, %d) not available" %
+                             (start, start + frames))
+        begin = start % self.capacity
+        end = begin + frames
+        if end <= self.capacity:
+            return [self._samples[begin:end]]
+        return [self._samples[begin:], self._samples[:end - self.capacity]]
+
+
+class CaptureReader(object):
+    """
+    A cursor into a RingBuffer. Every consumer gets its own reader, so
+    several of them can read the same audio independently.
+    """
+
+    def __init__(self, ring, start, timeout=2.0):
+        self._logger = logging.getLogger(__name__)
+        self._ring = ring
+        self.position = start
+        self.timeout = timeout
+        self.overruns = 0
+        self._start = start
+
+    @property
+    def available(self):
+        """
+        Returns:
+            The number of frames that can be read without blocking
+        """
+        return self._ring.position - self.position
+
+    def read(self, frames):
+        """
+        Reads the next frames from the ring buffer, blocking until they have
+        been captured.
+
+        Raises:
+            IOError if no audio arrives within the reader's timeout
+        """
+        return self._next(frames, self._ring.read)
+
+    def read_samples(self, frames):
+        """
+        Like read(), but returns the frames as a NumPy array of 16 bit
+        samples. With a SharedRingBuffer the array points into the shared
+        memory instead of being copied (unless the window wraps around), so
+        check intact() once done with it and don't keep it.
+        """
+        if getattr(self._ring, '_samples', None) is None:
+            return np.frombuffer(self.read(frames), dtype='<i2')
+        parts = self._next(frames, self._ring.view)
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+
+    def intact(self):
+        """
+        Returns:
+            True if the writer hasn't overwritten the frames returned by the
+            last read yet
+        """
+        return self._ring.valid(self._start)
+
+    def _next(self, frames, get):
+        if not self._ring.wait_for(self.position + frames, self.timeout):
+            raise IOError("No audio captured within %.1f seconds" %
+                          self.timeout)
+        while True:
+            oldest = self._ring.oldest
+            if self.position < oldest:
+                self.overruns += 1
+                self._logger.warning("Reader fell behind by %d frames, " +
+                                     "skipping ahead", oldest - self.position)
+                self.position = oldest
+            try:
+                data = get(self.position, frames)
+                break
+            except ValueError:
+                # the writer may have overwritten the start since the check
+                if self.position >= self._ring.oldest:
+                    raise
+        self._start = self.position
+        self.position += frames
+        return data
+
+
+def _capture_worker(ring, device, rate, chunk, stop):
+    """
+    The main function of the capture worker process: records from the
+    device into the shared ring buffer until stop is set.
+    """
+    logger = logging.getLogger(__name__)
+    source = audiosource.PyAudioSource(device, rate, chunk)
+
+    def write(data, lost):
+        if lost:
+            ring.lost += lost
+        ring.write(data)
+
+    source.start(write, ring)
+    try:
+        while not stop.wait(0.5):
+            if not source.active:
+                logger.error("Capture stream stopped unexpectedly")
+                break
+    finally:
+        source.stop()
+
+
+class CaptureStream(object):
+    """
+    Owns an always-open PyAudio input stream for one device and feeds it
+    into a RingBuffer. Use audio.AudioBackend.capture_stream() to get the
+    shared instance for a device instead of creating one directly.
+    """
+
+    def __init__(self, device, rate, buffer_seconds=15, chunk=1024,
+                 process=False, audio=None, source=None):
+        """
+        Arguments:
+            device -- the PyAudio input device index
+            rate -- the sample rate in Hz
+            buffer_seconds -- (optional) how much audio the ring buffer
+                              holds (Default: 15)
+            chunk -- (optional) frames per PyAudio callback (Default: 1024)
+            process -- (optional) capture in a separate worker process
+                       (Default: False)
+            audio -- (optional) the PyAudio instance to use; without it,
+                     the stream initializes (and terminates) its own
+            source -- (optional) an audiosource.AudioSource to record from
+                      instead of the device
+        """
+        self._logger = logging.getLogger(__name__)
+        self.device = device
+        self.rate = rate
+        self.chunk = chunk
+        self.width = 2
+        # tracks the background noise of everything captured; it listens
+        # from the very first block, before anybody reads from the stream
+        self.noise_floor = noisefloor.NoiseFloorTracker(rate)
+        # functions called with every block of captured audio
+        self._listeners = [self.noise_floor.push]
+        self._worker = None
+        if process:
+            self.buffer = SharedRingBuffer(int(rate * buffer_seconds),
+                                           self.width)
+            self._start_worker()
+            return
+        self.buffer = RingBuffer(int(rate * buffer_seconds), self.width)
+        if source is None:
+            source = audiosource.PyAudioSource(device, rate, chunk,
+                                               audio=audio)
+        self.source = source
+        self.source.start(self._write, self.buffer)
+
+    def _start_worker(self):
+        self._logger.info("Starting capture worker process for device %r " +
+                          "at %d Hz", self.device, self.rate)
+        self._stop = multiprocessing.Event()
+        self._worker = multiprocessing.Process(
+            target=_capture_worker, name='capture worker',
+            args=(self.buffer, self.device, self.rate, self.chunk,
+                  self._stop))
+        self._worker.daemon = True
+        self._worker.start()
+        # listeners run in this process, following the shared ring
+        self._dispatcher = threading.Thread(target=self._dispatch,
+                                            name='capture listeners')
+        self._dispatcher.daemon = True
+        self._dispatcher.start()
+
+    def _dispatch(self):
+        reader = CaptureReader(self.buffer, self.buffer.position)
+        while not self._stop.is_set():
+            try:
+                samples = reader.read_samples(self.chunk)
+            except IOError:
+                if not self._worker.is_alive():
+                    self._logger.error("Capture worker died (exit code %r)",
+                                       self._worker.exitcode)
+                    return
+                continue
+            self._notify(samples)
+            if not reader.intact():
+                # the worker overwrote the block while the listeners were
+                # looking at it, so they may have seen newer audio in part
+                # of it
+                reader.overruns += 1
+                self._logger.warning("Capture listeners fell behind the " +
+                                     "capture worker")
+
+    @property
+    def lost(self):
+        """
+        The number of frames the capture stream missed, e.g. because of
+        input overflows. Readers that fall behind the ring buffer count
+        their own overruns on top of this.
+        """
+        return self.buffer.lost
+
+    def _write(self, in_data, lost):
+        if lost:
+            self.buffer.lost += lost
+        self.buffer.write(in_data)
+        self._notify(np.frombuffer(in_data, dtype='<i2'))
+
+    def _notify(self, samples):
+        for listener in self._listeners:
+            try:
+                listener(samples)
+            except Exception:
+                self._logger.exception("Capture listener %r failed",
+                                       listener)
+
+    def add_listener(self, listener):
+        """
+        Registers a function that is called with every block of captured
+        audio, as a NumPy array of 16 bit samples. The array may point into
+        the ring buffer, so the listener must not keep it. It runs on the
+        thread of the audio source (the PyAudio callback, or with a capture
+        worker process, the thread following the shared ring), so it has to
+        be fast and must not block.
+        """
+        # replace the list instead of modifying it, so the callback never
+        # iterates over a list that is being changed
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [other for other in self._listeners
+                           if other is not listener]
+
+    def reader(self, preroll=0, start=None):
+        """
+        Returns a new CaptureReader starting preroll seconds before now, or
+        at the absolute position start if given (or at the oldest buffered
+        frame, if less audio is available).
+        """
+        if start is None:
+            start = self.buffer.position - int(preroll * self.rate)
+        return CaptureReader(self.buffer, max(self.buffer.oldest, start))
+
+    def close(self):
+        if self._worker is not None:
+            self._stop.set()
+            self._worker.join(5)
+            return
+        self.source.stop()
@@ -0,0 +1,147 @@
+# -*- coding: utf-8-*-
+"""
+Cue sounds played from memory.
+
+Playing the listening beeps with the speaker means forking and executing
+aplay for every beep and polling for it to finish, all before Mic starts
+listening. The CuePlayer instead decodes the cue sounds once at startup
+and writes them to a PyAudio output stream that stays open between
+prompts, on a thread of its own, so play() returns right away and Mic
+listens while the beep is still playing. Mic leaves the part of the
+captured audio that contains the beep out of the endpointing.
+
+The output stream is closed while the speaker talks (the sound card may
+not allow two streams at once) and reopened in the background afterwards.
+"""
+import collections
+import logging
+import Queue
+import threading
+import wave
+
+import jasperpath
+
+# the cue sounds in static/audio
+CUES = ('beep_hi', 'beep_lo')
+
+Cue = collections.namedtuple('Cue', ['rate', 'width', 'channels', 'data'])
+
+
+def load(filename):
+    """
+    Returns:
+        The Cue with the format and frames of a WAV file
+    """
+    wav = wave.open(filename, 'rb')
+    try:
+        return Cue(wav.getframerate(), wav.getsampwidth(),
+                   wav.getnchannels(), wav.readframes(wav.getnframes()))
+    finally:
+        wav.close()
+
+
+def duration(cue):
+    """
+    Returns:
+        The length of a Cue in seconds
+    """
+    return len(cue.data) / float(cue.rate * cue.width * cue.channels)
+
+
+class CuePlayer(object):
+    """
+    Plays preloaded cue sounds on an output stream of the AudioBackend.
+    """
+
+    # seconds from play() until the sound leaves the speaker, besides the
+    # cue itself (the output buffer and, if the stream has to be opened
+    # first, opening it)
+    LATENCY = 0.15
+
+    def __init__(self, backend, device, names=CUES):
+        """
+        Arguments:
+            backend -- the audio.AudioBackend to open the output stream with
+            device -- the PyAudio output device index
+            names -- (optional) the cue sounds to load (Default: CUES)
+        """
+        self._logger = logging.getLogger(__name__)
+        self._backend = backend
+        self.device = device
+        self.names = names
+        self.cues = dict((name, load(jasperpath.data('audio',
+                                                     name + '.wav')))
+                         for name in names)
+        self._stream = None
+        self._format = None
+        self._queue = Queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='cues')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def play(self, name):
+        """
+        Starts playing a cue sound and returns right away.
+
+        Returns:
+            The number of seconds until it has been played
+        """
+        cue = self.cues[name]
+        self._queue.put(('play', cue))
+        return duration(cue) + self.LATENCY
+
+    def prepare(self):
+        """
+        Opens the output stream in the background, if it isn't open.
+        """
+        self._queue.put(('open', self.cues[self.names[0]]))
+
+    def close(self):
+        """
+        Waits for the cues to finish playing and closes the output stream,
+        so the device is free for others.
+        """
+        done = threading.Event()
+        self._queue.put(('close', done))
+        done.wait()
+
+    def _run(self):
+        while True:
+            command, argument = self._queue.get()
+            try:
+                if command == 'play':
+                    self._open(argument)
+                    self._stream.start_stream()
+                    self._stream.write(argument.data)
+                    # returns once everything has been played
+                    self._stream.stop_stream()
+                elif command == 'open':
+                    self._open(argument)
+                elif command == 'close':
+                    self._close()
+            except Exception:
+                self._logger.exception("Cue output failed")
+                self._close()
+            finally:
+                if command == 'close':
+                    argument.set()
+
+    def _open(self, cue):
+        fmt = (cue.rate, cue.width, cue.channels)
+        if self._format == fmt:
+            return
+        self._close()
+        self._logger.debug("Opening cue output on device %r (%d Hz)",
+                           self.device, cue.rate)
+        self._stream = self._backend.open_output(
+            self.device, cue.rate, width=cue.width, channels=cue.channels,
+            start=False)
+        self._format = fmt
+
+    def _close(self):
+        if self._stream is not None:
+            try:
+                self._stream.close()
+            finally:
+                self._stream = None
+                self._format = None
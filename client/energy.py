@@ -0,0 +1,218 @@
+# -*- coding: utf-8-*-
+"""
+Vectorized frame-energy front end for the Mic class.
+
+Instead of calling audioop.rms() on every 32-sample chunk and averaging a
+Python list of the last N scores, Mic reads larger blocks and scores all
+of their sub-frames in a single NumPy call. The moving average of the
+scores is kept in a circular array with a running sum, so updating it is
+O(1) per score rather than O(N).
+
+The scores, averages and utterance state machine are equivalent to the
+original per-chunk implementation (see the benchmark at the bottom of this
+file for the CPU time saved).
+"""
+import logging
+
+import numpy as np
+
+
+def frame_scores(data, chunk, width=2):
+    """
+    Scores every chunk-sized sub-frame of a block of 16 bit mono PCM data.
+
+    The score of a sub-frame is its RMS (truncated to an integer, just like
+    audioop.rms() does) divided by three, i.e. exactly what Mic.getScore()
+    returns for that sub-frame.
+
+    Arguments:
+        data -- a byte string of little-endian PCM samples, or a NumPy
+                array of 16 bit samples
+        chunk -- the number of samples per sub-frame
+        width -- (optional) the sample width in bytes (Default: 2)
+
+    Returns:
+        A NumPy int64 array with one score per complete sub-frame
+    """
+    if width != 2:
+        raise ValueError("Only 16 bit samples are supported")
+    samples = data
+    if not isinstance(data, np.ndarray):
+        samples = np.frombuffer(data, dtype='<i2')
+    n = len(samples) // chunk
+    frames = samples[:n * chunk].reshape(n, chunk).astype(np.float64)
+    rms = np.sqrt((frames * frames).sum(axis=1) / chunk).astype(np.int64)
+    return rms // 3
+
+
+class MovingAverage(object):
+    """
+    Moving average over the last N values, backed by a circular array and a
+    running sum.
+    """
+
+    def __init__(self, initial, dtype=np.float64):
+        """
+        Arguments:
+            initial -- a sequence of N values the window is initialized with
+            dtype -- (optional) the NumPy type of the values (Default:
+                     float64); use an integer type to get exact sums
+        """
+        self._values = np.array(initial, dtype=dtype)
+        self.size = len(self._values)
+        self._index = 0
+        self._sum = self._values.sum()
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def average(self):
+        return self._sum / float(self.size)
+
+    def push(self, values):
+        """
+        Adds values to the window, dropping the oldest ones.
+
+        Returns:
+            A NumPy array with the running sum of the window after each of
+            the values was added
+        """
+        values = np.asarray(values, dtype=self._values.dtype)
+        sums = np.empty(len(values), dtype=self._values.dtype)
+        done = 0
+        while done < len(values):
+            # never wrap around inside a single vectorized step
+            step = min(len(values) - done, self.size - self._index)
+            new = values[done:done + step]
+            window = self._values[self._index:self._index + step]
+            sums[done:done + step] = self._sum + np.cumsum(new - window)
+            window[:] = new
+            self._sum = sums[done + step - 1]
+            self._index += step
+            if self._index == self.size:
+                # resync the running sum once per lap so rounding errors
+                # cannot accumulate
+                self._index = 0
+                self._sum = self._values.sum()
+            done += step
+        return sums
+
+
+class EnergyEndpointer(object):
+    """
+    The begin/end of utterance state machine used by
+    Mic.activeListenToAllOptions(), working on blocks of audio.
+
+    An utterance begins when the moving average of the scores rises above
+    start_factor * threshold and ends once it has stayed below
+    end_factor * threshold for silence seconds.
+    """
+
+    # States
+    BEFORE_UTTERANCE = 0
+    DURING_UTTERANCE = 1
+    AFTER_UTTERANCE = 2
+
+    def __init__(self, threshold, rate, chunk, window=30720,
+                 start_factor=1.25, end_factor=0.8, silence=0.25):
+        """
+        Arguments:
+            threshold -- the noise threshold (see Mic.fetchThreshold())
+            rate -- the sample rate in Hz
+            chunk -- the number of samples per scored sub-frame
+            window -- (optional) the number of samples the moving average
+                      covers (Default: 30720)
+            start_factor -- (optional) (Default: 1.25)
+            end_factor -- (optional) (Default: 0.8)
+            silence -- (optional) seconds of post-utterance silence that end
+                       the recording (Default: 0.25)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.chunk = chunk
+        self.start_level = threshold * start_factor
+        self.end_level = threshold * end_factor
+        self.silence_frames_threshold = int(silence * rate / chunk)
+        size = int(window / chunk)
+        self._average = MovingAverage([threshold * 1.2] * size)
+        self.state = self.BEFORE_UTTERANCE
+        self.utterances = 0
+        self.post_utterance_frames = 0
+
+    def feed(self, data):
+        """
+        Processes a block of audio.
+
+        Returns:
+            None if more audio is needed, otherwise the number of samples
+            of this block up to (and including) the sub-frame that ended
+            the recording
+        """
+        averages = self._average.push(frame_scores(data, self.chunk))
+        averages /= float(self._average.size)
+        for i, average in enumerate(averages.tolist()):
+            if average > self.start_level:
+                if self.state != self.DURING_UTTERANCE:
+                    self._logger.debug('Begin utterance')
+                    self.utterances += 1
+                    self.state = self.DURING_UTTERANCE
+            elif (self.state != self.BEFORE_UTTERANCE and
+                  average < self.end_level):
+                if self.state != self.AFTER_UTTERANCE:
+                    self._logger.debug('End utterance')
+                self.post_utterance_frames += 1
+                self.state = self.AFTER_UTTERANCE
+            if (self.state == self.AFTER_UTTERANCE and
+               self.post_utterance_frames >= self.silence_frames_threshold):
+                self._logger.debug('Enough post-utterance silence')
+                return (i + 1) * self.chunk
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+    import audioop
+    import time
+
+    parser = argparse.ArgumentParser(description='Energy front end ' +
+                                     'benchmark')
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='seconds of audio to process')
+    parser.add_argument('--rate', type=int, default=44100)
+    parser.add_argument('--chunk', type=int, default=32)
+    parser.add_argument('--block', type=int, default=1024,
+                        help='samples per vectorized read')
+    args = parser.parse_args()
+
+    nsamples = int(args.seconds * args.rate)
+    rng = np.random.RandomState(0)
+    audio = (rng.normal(0, 300, nsamples)).astype('<i2').tostring()
+    threshold = 100.0
+
+    def legacy():
+        lastN = [threshold * 1.2 for i in range(int(30720 / args.chunk))]
+        nbytes = args.chunk * 2
+        for offset in range(0, len(audio) - nbytes + 1, nbytes):
+            data = audio[offset:offset + nbytes]
+            score = audioop.rms(data, 2) / 3
+            lastN.pop(0)
+            lastN.append(score)
+            average = sum(lastN) / float(len(lastN))
+            average > threshold * 1.25
+
+    def vectorized():
+        endpointer = EnergyEndpointer(threshold, args.rate, args.chunk,
+                                      silence=args.seconds * 2)
+        nbytes = args.block * 2
+        for offset in range(0, len(audio), nbytes):
+            endpointer.feed(audio[offset:offset + nbytes])
+
+    for name, func in (('per-chunk audioop', legacy),
+                       ('vectorized', vectorized)):
+        start = time.clock()
+        func()
+        elapsed = time.clock() - start
+        print("%-18s %7.3f s CPU for %.1f s of audio (%5.1f%% of a core)" %
+              (name, elapsed, args.seconds,
+               100 * elapsed / args.seconds))
@@ -0,0 +1,313 @@
+# -*- coding: utf-8-*-
+"""
+A FLAC encoder for 16 bit mono audio, in pure NumPy.
+
+Cloud STT engines that accept FLAC get about half the bytes of raw PCM for
+the same utterance, which matters on a weak Wi-Fi link, and encoding it
+here means no flac process has to be spawned for every utterance.
+
+The encoder keeps to the simple part of the format: every block of audio
+is predicted with the best of the fixed polynomial predictors (or stored
+verbatim, if that is shorter), and the residual is Rice coded in as many
+partitions as pay off. That gets most of what the reference encoder gets
+out of speech at its default settings.
+
+The Encoder works incrementally, so audio can be encoded (and uploaded)
+while it is being captured; encode() encodes a whole utterance at once.
+"""
+import hashlib
+import time
+
+import numpy as np
+
+# the sample size the encoder supports
+BITS_PER_SAMPLE = 16
+# the default number of samples per frame
+BLOCK_SIZE = 4096
+
+MAX_RICE_PARAMETER = 14
+MAX_PARTITION_ORDER = 6
+MAX_FIXED_ORDER = 4
+
+# the codes of the block sizes and sample rates a frame header can name
+# without spelling them out
+_BLOCK_SIZE_CODES = {192: 1, 576: 2, 1152: 3, 2304: 4, 4608: 5, 256: 8,
+                     512: 9, 1024: 10, 2048: 11, 4096: 12, 8192: 13,
+                     16384: 14, 32768: 15}
+_SAMPLE_RATE_CODES = {88200: 1, 176400: 2, 192000: 3, 8000: 4, 16000: 5,
+                      22050: 6, 24000: 7, 32000: 8, 44100: 9, 48000: 10,
+                      96000: 11}
+
+
+def _crc_table(polynomial, width):
+    top = 1 << (width - 1)
+    mask = (1 << width) - 1
+    table = []
+    for byte in range(256):
+        crc = byte << (width - 8)
+        for i in range(8):
+            crc = ((crc << 1) ^ polynomial) if crc & top else crc << 1
+        table.append(crc & mask)
+    return table
+
+
+_CRC8_TABLE = _crc_table(0x07, 8)
+_CRC16_TABLE = _crc_table(0x8005, 16)
+
+
+def crc8(data):
+    """
+    Returns:
+        The CRC-8 of a frame header
+    """
+    crc = 0
+    for byte in bytearray(data):
+        crc = _CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def crc16(data):
+    """
+    Returns:
+        The CRC-16 of a frame
+    """
+    crc = 0
+    table = _CRC16_TABLE
+    for byte in bytearray(data):
+        crc = ((crc << 8) & 0xFFFF) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+def _bits(value, count):
+    # the count lowest bits of value, most significant first
+    return ((int(value) >> np.arange(count - 1, -1, -1, dtype=np.int64)) &
+            1).astype(np.uint8)
+
+
+def _sample_bits(samples):
+    # the bits of 16 bit samples, one after the other
+    return np.unpackbits(samples.astype('>i2').view(np.uint8))
+
+
+def _pack(chunks):
+    # bit arrays to bytes, padded with zeros to a whole byte
+    bits = np.concatenate(chunks)
+    return np.packbits(bits).tostring()
+
+
+def _utf8(value):
+    # the "UTF-8" coding of frame numbers, which goes up to 36 bits
+    if value < 0x80:
+        return chr(value)
+    count = 2
+    while value >= 1 << (5 * count + 1):
+        count += 1
+    tail = []
+    for i in range(count - 1):
+        tail.append(0x80 | (value & 0x3F))
+        value >>= 6
+    head = ((0xFF << (8 - count)) & 0xFF) | value
+    return ''.join(chr(byte) for byte in [head] + tail[::-1])
+
+
+def _rice(folded, parameter):
+    # Rice codes of non-negative values: the quotient in unary (as zeros
+    # ended by a one), then the remainder in binary
+    quotients = folded >> parameter
+    lengths = quotients + 1 + parameter
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    bits = np.zeros(lengths.sum(), dtype=np.uint8)
+    bits[starts + quotients] = 1
+    if parameter:
+        shifts = np.arange(parameter - 1, -1, -1, dtype=np.int64)
+        positions = (starts + quotients + 1)[:, np.newaxis] + \
+            np.arange(parameter)
+        bits[positions.ravel()] = \
+            ((folded[:, np.newaxis] >> shifts) & 1).ravel()
+    return bits
+
+
+def _residual(residual, predictor_order, block_size):
+    """
+    Returns:
+        The size in bits and the bit arrays of the Rice coded residual,
+        with the partition order and Rice parameters that make it shortest
+    """
+    folded = np.where(residual >= 0, residual * 2, -residual * 2 - 1)
+    parameters = np.arange(MAX_RICE_PARAMETER + 1, dtype=np.int64)
+    # the bits every value takes with every Rice parameter
+    costs = (folded[np.newaxis, :] >> parameters[:, np.newaxis]) + \
+        1 + parameters[:, np.newaxis]
+    best = None
+    for order in range(MAX_PARTITION_ORDER + 1):
+        size = block_size >> order
+        if block_size % (1 << order) or size <= predictor_order:
+            break
+        # the first partition doesn't have the warm-up samples
+        starts = np.arange(0, block_size, size) - predictor_order
+        starts[0] = 0
+        sums = np.add.reduceat(costs, starts, axis=1)
+        chosen = sums.argmin(axis=0)
+        length = 6 + 4 * len(starts) + sums.min(axis=0).sum()
+        if best is None or length < best[0]:
+            best = (length, order, starts, chosen)
+    length, order, starts, chosen = best
+    chunks = [_bits(0, 2), _bits(order, 4)]
+    ends = list(starts[1:]) + [len(folded)]
+    for start, end, parameter in zip(starts, ends, chosen):
+        chunks.append(_bits(parameter, 4))
+        chunks.append(_rice(folded[start:end], parameter))
+    return length, chunks
+
+
+def _subframe(samples):
+    """
+    Returns:
+        The bit arrays of the subframe of a block of samples
+    """
+    if (samples == samples[0]).all():
+        return [_bits(0, 8), _sample_bits(samples[:1])]
+    # the predictor with the smallest residual usually codes shortest
+    orders = range(min(MAX_FIXED_ORDER, len(samples) - 1) + 1)
+    order = min(orders, key=lambda order: np.abs(np.diff(samples,
+                                                         order)).sum())
+    residual = np.diff(samples, order)
+    length, chunks = _residual(residual, order, len(samples))
+    if order * BITS_PER_SAMPLE + length >= len(samples) * BITS_PER_SAMPLE:
+        return [_bits(1 << 1, 8), _sample_bits(samples)]
+    return ([_bits((0x08 | order) << 1, 8), _sample_bits(samples[:order])] +
+            chunks)
+
+
+class Encoder(object):
+    """
+    Encodes 16 bit mono PCM audio to FLAC, block by block.
+    """
+
+    def __init__(self, rate, block_size=BLOCK_SIZE):
+        """
+        Arguments:
+            rate -- the sample rate in Hz
+            block_size -- (optional) the number of samples per frame
+                          (Default: BLOCK_SIZE)
+        """
+        self.rate = rate
+        self.block_size = block_size
+        self._buffer = ''
+        self._frame_number = 0
+        # for the statistics
+        self.input_bytes = 0
+        self.output_bytes = 0
+        self.encode_time = 0.0
+
+    @property
+    def ratio(self):
+        """
+        The size of the FLAC data relative to the PCM data so far.
+        """
+        if not self.input_bytes:
+            return None
+        return self.output_bytes / float(self.input_bytes)
+
+    def header(self, total_samples=0, md5=None):
+        """
+        Returns:
+            The 'fLaC' marker and the STREAMINFO block, which comes before
+            the frames
+
+        Arguments:
+            total_samples -- (optional) the number of samples, if known
+            md5 -- (optional) the MD5 digest of the PCM data, if known
+        """
+        streaminfo = _pack([_bits(self.block_size, 16),
+                            _bits(self.block_size, 16),
+                            # the frame sizes are unknown
+                            _bits(0, 24), _bits(0, 24),
+                            _bits(self.rate, 20),
+                            _bits(0, 3),  # one channel
+                            _bits(BITS_PER_SAMPLE - 1, 5),
+                            _bits(total_samples, 36)])
+        streaminfo += md5 or '\0' * 16
+        # the last (and only) metadata block, of type STREAMINFO
+        data = 'fLaC' + _pack([_bits(1, 1), _bits(0, 7),
+                               _bits(len(streaminfo), 24)]) + streaminfo
+        self.output_bytes += len(data)
+        return data
+
+    def _frame(self, samples):
+        block_size = len(samples)
+        block_size_code = _BLOCK_SIZE_CODES.get(block_size)
+        extra = ''
+        if block_size_code is None:
+            if block_size <= 256:
+                block_size_code = 6
+                extra += chr(block_size - 1)
+            else:
+                block_size_code = 7
+                extra += chr((block_size - 1) >> 8) + \
+                    chr((block_size - 1) & 0xFF)
+        rate_code = _SAMPLE_RATE_CODES.get(self.rate)
+        if rate_code is None:
+            if self.rate < 1 << 16:
+                rate_code = 13
+                extra += chr(self.rate >> 8) + chr(self.rate & 0xFF)
+            else:
+                # the rate in the STREAMINFO block
+                rate_code = 0
+        header = _pack([_bits(0x3FFE, 14), _bits(0, 2),
+                        _bits(block_size_code, 4), _bits(rate_code, 4),
+                        # mono, 16 bits per sample
+                        _bits(0, 4), _bits(4, 3), _bits(0, 1)])
+        header += _utf8(self._frame_number) + extra
+        header += chr(crc8(header))
+        frame = header + _pack(_subframe(samples))
+        crc = crc16(frame)
+        self._frame_number += 1
+        return frame + chr(crc >> 8) + chr(crc & 0xFF)
+
+    def _encode(self, final):
+        start = time.time()
+        frames = []
+        size = self.block_size * 2
+        while len(self._buffer) >= size or (final and self._buffer):
+            block, self._buffer = self._buffer[:size], self._buffer[size:]
+            samples = np.frombuffer(block, dtype='<i2').astype(np.int64)
+            frames.append(self._frame(samples))
+        data = ''.join(frames)
+        self.encode_time += time.time() - start
+        self.output_bytes += len(data)
+        return data
+
+    def encode(self, data):
+        """
+        Returns:
+            The frames of the blocks of audio completed by data (a string of
+            16 bit little-endian samples)
+        """
+        self.input_bytes += len(data)
+        self._buffer += data
+        return self._encode(False)
+
+    def flush(self):
+        """
+        Returns:
+            The frame of the remaining, incomplete block, if there is one
+        """
+        return self._encode(True)
+
+
+def encode(data, rate, block_size=BLOCK_SIZE):
+    """
+    Encodes a whole utterance.
+
+    Arguments:
+        data -- a string of 16 bit little-endian mono samples
+        rate -- the sample rate in Hz
+        block_size -- (optional) the number of samples per frame
+
+    Returns:
+        The FLAC file
+    """
+    encoder = Encoder(rate, block_size)
+    header = encoder.header(len(data) // 2, hashlib.md5(data).digest())
+    return header + encoder.encode(data) + encoder.flush()
@@ -112,7 +112,7 @@ class Dealer(object):
         self.hands[player].append(new_hand)
         self.hit(player, -1)
 
-def read_line():
+def read_line(choices=None):
     return sys.stdin.readline()
 
 def myprint(str):
@@ -120,8 +120,11 @@ def myprint(str):
 
 def read_int(low_limit=None, high_limit=None, input_func=read_line, output_func=myprint):
     retval = None
+    choices = None
+    if low_limit is not None and high_limit is not None:
+        choices = [str(i) for i in range(low_limit, high_limit + 1)]
     while retval is None:
-        val = input_func().strip().lower()
+        val = input_func(choices=choices).strip().lower()
         try:
             retval = int(val)
             if low_limit is not None and retval < low_limit:
@@ -137,7 +140,7 @@ def read_int(low_limit=None, high_limit=None, input_func=read_line, output_func=
 def read_answer(valid, input_func=read_line, output_func=myprint):
     retval = None
     while retval is None:
-        retval = input_func().strip().lower()
+        retval = input_func(choices=valid).strip().lower()
         if retval in valid:
             return retval
         matches = list(filter(lambda x: x.startswith(retval), valid))
@@ -155,6 +158,7 @@ def play(input_func=read_line, output_func=myprint, min_players=1, max_players=5
     '''
 plays a game of blackjack with up to 10 players.
 Pass input_func and output_func with appropriate vectors for other implementations.
+input_func gets the valid answers as choices, if there are only a few.
     '''
 
     output_func('How many players? (between {0} and {1})'.format(min_players, max_players))
@@ -0,0 +1,313 @@
+# -*- coding: utf-8-*-
+"""
+Grammars for the vocabularies of modules.
+
+A module's INSTANCE_WORDS become a language model in which any word may
+follow any other, so with hundreds of words (like Zork's) the decoder has
+to consider a huge number of sentences, which is slow and makes for
+misrecognitions no game would accept. A module can declare a GRAMMAR
+instead, which only allows the sentences it can handle:
+
+    GRAMMAR = {
+        'S': ['<verb> [THE] <object>', 'LOOK', 'INVENTORY'],
+        'verb': ['TAKE', 'DROP', 'OPEN'],
+        'object': ['LAMP', 'MAILBOX'],
+    }
+
+Each rule is a list of alternatives. An alternative is a sequence of
+words and references to other rules (in angle brackets); a part of it in
+square brackets is optional. Sentences are derived from the rule 'S'.
+Rules can't refer to themselves (directly or not), so the grammar is
+finite, like a Julius DFA has to be.
+
+The grammar is compiled to JSGF for PocketSphinx (which turns it into a
+finite state grammar search) and to a Julius grammar and voca file for
+mkdfa.pl, see the vocabularies in vocabcompiler.py. Like phrases, it is
+only compiled again when it has changed.
+
+Run this file to compare the decode time and the transcriptions of a
+module's grammar and of a language model of its INSTANCE_WORDS.
+"""
+import re
+
+# the rule sentences are derived from
+START = 'S'
+
+_NAME = re.compile(r'^\w+$')
+
+
+class Grammar(object):
+    """
+    A grammar, as declared in the GRAMMAR of a module.
+    """
+
+    def __init__(self, rules):
+        """
+        Arguments:
+            rules -- the alternatives of every rule, by name
+
+        Raises:
+            ValueError if the grammar is malformed or recursive
+        """
+        if START not in rules:
+            raise ValueError("Grammar has no rule '%s'" % START)
+        self.rules = {}
+        for name, alternatives in rules.items():
+            if not _NAME.match(name):
+                raise ValueError("Invalid rule name '%s'" % name)
+            if isinstance(alternatives, basestring):
+                raise ValueError("Rule '%s' has to be a list of " % name +
+                                 "alternatives")
+            if not alternatives:
+                raise ValueError("Rule '%s' has no alternatives" % name)
+            self.rules[name] = [self._parse(name, alternative)
+                                for alternative in alternatives]
+        for name in self.rules:
+            self._check_references(name, [])
+
+    def _parse(self, name, alternative):
+        """
+        Returns:
+            The parts of an alternative, as (tokens, optional) tuples
+        """
+        parts = []
+        optional = None
+        for token in alternative.replace('[', ' [ ').replace(']',
+                                                             ' ] ').split():
+            if token == '[':
+                if optional is not None:
+                    raise ValueError("Nested brackets in rule '%s': %s" %
+                                     (name, alternative))
+                optional = []
+            elif token == ']':
+                if not optional:
+                    raise ValueError("Unbalanced or empty brackets in rule " +
+                                     "'%s': %s" % (name, alternative))
+                parts.append((tuple(optional), True))
+                optional = None
+            elif optional is not None:
+                optional.append(token)
+            else:
+                parts.append(((token,), False))
+        if optional is not None:
+            raise ValueError("Unbalanced brackets in rule '%s': %s" %
+                             (name, alternative))
+        if all(is_optional for tokens, is_optional in parts):
+            raise ValueError("Rule '%s' has an alternative " % name +
+                             "without any required part: %r" % alternative)
+        return parts
+
+    @staticmethod
+    def _reference(token):
+        # the name of the rule a token refers to, or None for a word
+        if token.startswith('<') and token.endswith('>'):
+            return token[1:-1]
+        return None
+
+    def _check_references(self, name, path):
+        if name in path:
+            raise ValueError("Rule '%s' is recursive: %s" %
+                             (name, ' -> '.join(path + [name])))
+        for parts in self.rules[name]:
+            for tokens, optional in parts:
+                for token in tokens:
+                    reference = self._reference(token)
+                    if reference is None:
+                        continue
+                    if reference not in self.rules:
+                        raise ValueError("Rule '%s' refers to the " % name +
+                                         "undefined rule '%s'" % reference)
+                    self._check_references(reference, path + [name])
+
+    def _tokens(self, parts):
+        for tokens, optional in parts:
+            for token in tokens:
+                yield token
+
+    @property
+    def words(self):
+        """
+        All words of the grammar, sorted.
+        """
+        return sorted(set(token
+                          for alternatives in self.rules.values()
+                          for parts in alternatives
+                          for token in self._tokens(parts)
+                          if self._reference(token) is None))
+
+    @property
+    def lines(self):
+        """
+        The rules in a canonical form, one alternative per line, e.g. to
+        calculate the revision of a vocabulary.
+        """
+        lines = []
+        for name, alternatives in sorted(self.rules.items()):
+            for parts in alternatives:
+                lines.append('%s: %s' % (name, self._format(parts)))
+        return lines
+
+    def _format(self, parts):
+        return ' '.join('[%s]' % ' '.join(tokens) if optional
+                        else tokens[0] for tokens, optional in parts)
+
+    def matches(self, sentence):
+        """
+        Returns:
+            True if the grammar allows the sentence (a string of words)
+        """
+        words = sentence.split()
+        return len(words) in self._match_rule(START, words, 0)
+
+    def _match_rule(self, name, words, start):
+        # the positions in words at which a match of the rule can end
+        ends = set()
+        for parts in self.rules[name]:
+            positions = set([start])
+            for tokens, optional in parts:
+                following = set(positions) if optional else set()
+                for position in positions:
+                    following |= self._match_tokens(tokens, words, position)
+                positions = following
+            ends |= positions
+        return ends
+
+    def _match_tokens(self, tokens, words, start):
+        positions = set([start])
+        for token in tokens:
+            reference = self._reference(token)
+            following = set()
+            for position in positions:
+                if reference is not None:
+                    following |= self._match_rule(reference, words, position)
+                elif position < len(words) and words[position] == token:
+                    following.add(position + 1)
+            positions = following
+        return positions
+
+    def to_jsgf(self, name='jasper'):
+        """
+        Returns:
+            The grammar in the JSpeech Grammar Format, with the start rule
+            as its public rule
+        """
+        lines = ['#JSGF V1.0;', 'grammar %s;' % name]
+        for rule, alternatives in sorted(self.rules.items(),
+                                         key=lambda x: (x[0] != START, x[0])):
+            lines.append('%s<%s> = %s;' % ('public ' if rule == START else '',
+                                           rule,
+                                           ' | '.join(self._format(parts)
+                                                      for parts
+                                                      in alternatives)))
+        return '\n'.join(lines) + '\n'
+
+    def _expand(self, parts):
+        # every sequence of tokens an alternative allows
+        sequences = [[]]
+        for tokens, optional in parts:
+            with_part = [sequence + list(tokens) for sequence in sequences]
+            sequences = (sequences + with_part) if optional else with_part
+        return [sequence for sequence in sequences if sequence]
+
+    def _is_category(self, name):
+        # a rule whose alternatives are single words is a Julius category
+        return name != START and all(
+            len(parts) == 1 and not parts[0][1] and
+            self._reference(parts[0][0][0]) is None
+            for parts in self.rules[name])
+
+    def to_julius(self):
+        """
+        Returns:
+            The grammar for mkdfa.pl, as a dict of the alternatives of every
+            non-terminal (lists of symbols), with the sentences derived from
+            'S' between the categories NS_B and NS_E, and the words of every
+            category. Rules whose alternatives are all single words become
+            categories, the other words get a category each.
+        """
+        categories = {}
+        category_of_word = {}
+
+        def symbol(token):
+            reference = self._reference(token)
+            if reference is not None:
+                if self._is_category(reference):
+                    return 'C_' + reference.upper()
+                return 'R_' + reference.upper()
+            if token not in category_of_word:
+                category = 'W_' + re.sub(r'\W', '_', token.upper())
+                while category in categories:
+                    category += '_'
+                category_of_word[token] = category
+                categories[category] = [token]
+            return category_of_word[token]
+
+        rules = {'S': [['NS_B', 'R_' + START.upper(), 'NS_E']]}
+        for name, alternatives in self.rules.items():
+            if self._is_category(name):
+                categories['C_' + name.upper()] = sorted(
+                    set(parts[0][0][0] for parts in alternatives))
+                continue
+            rules['R_' + name.upper()] = [
+                [symbol(token) for token in sequence]
+                for parts in alternatives
+                for sequence in self._expand(parts)]
+        return rules, categories
+
+
+if __name__ == '__main__':
+    import argparse
+    import importlib
+    import logging
+    import os
+    import shutil
+    import tempfile
+    import time
+    import wave
+
+    import stt
+    import vocabcompiler
+
+    parser = argparse.ArgumentParser(
+        description='Compares the decode time of a module\'s GRAMMAR with ' +
+        'that of a language model of its INSTANCE_WORDS')
+    parser.add_argument('module', help='the name of the module, e.g. Zork')
+    parser.add_argument('wavs', nargs='+', metavar='WAV',
+                        help='recordings of commands for the module')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    module = importlib.import_module('modules.' + args.module)
+    recordings = []
+    for filename in args.wavs:
+        wav = wave.open(filename, 'rb')
+        recordings.append((os.path.basename(filename),
+                           wav.readframes(wav.getnframes()),
+                           wav.getframerate()))
+        wav.close()
+
+    tempdir = tempfile.mkdtemp()
+    try:
+        config = stt.PocketSphinxSTT.get_config()
+        for name, phrases in [
+                ('word loop', sorted(set(module.INSTANCE_WORDS))),
+                ('grammar', Grammar(module.GRAMMAR))]:
+            vocabulary = vocabcompiler.PocketsphinxVocabulary(
+                name.replace(' ', '-'), path=tempdir)
+            vocabulary.compile(phrases)
+            engine = stt.PocketSphinxSTT(vocabulary, **config)
+            times = []
+            for filename, data, rate in recordings:
+                for run in range(args.runs):
+                    start = time.time()
+                    transcribed = engine.transcribe_pcm(data, rate)
+                    times.append(time.time() - start)
+                print("%s, %s: %r" % (name, filename, transcribed[:1]))
+            print("%s: %.3f s per utterance on average, %.3f s at most" %
+                  (name, sum(times) / len(times), max(times)))
+            engine.close()
+    finally:
+        shutil.rmtree(tempdir)
@@ -0,0 +1,340 @@
+# -*- coding: utf-8-*-
+"""
+HTTP plumbing shared by the engines that talk to web APIs.
+
+Every engine used to call requests.post() on its own, so every utterance
+paid for a new connection (and TLS handshake), waited for as long as the
+server liked and failed on the first dropped connection. get_session()
+returns a requests Session shared by all of them instead, which keeps
+connections alive in a pool, applies connect and read timeouts to every
+request and retries failed connections and overloaded servers a bounded
+number of times (except for requests with a streamed body, which can't be
+sent again). It can be tuned in the 'http' section of profile.yml:
+
+    http:
+      connect_timeout: 3.05  # seconds
+      read_timeout: 10       # seconds
+      retries: 2
+      pool_size: 4
+
+ChunkedUpload sends the body of a request with chunked transfer encoding
+while it is still being produced, so audio can be uploaded while the
+caller is still talking.
+
+TokenCache keeps OAuth access tokens in the config dir with their expiry,
+so they survive restarts. Tokens are renewed lazily: the first request
+after a token comes within REFRESH_MARGIN of its expiry fetches a new one.
+"""
+import logging
+import os
+import Queue
+import threading
+import time
+
+import requests
+from requests.packages.urllib3.util.retry import Retry
+import yaml
+
+import jasperpath
+
+# the defaults of the 'http' section of profile.yml
+DEFAULTS = {'connect_timeout': 3.05,
+            'read_timeout': 10,
+            'retries': 2,
+            'pool_size': 4}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class _RetryAdapter(requests.adapters.HTTPAdapter):
+    """
+    An HTTPAdapter that retries only requests whose body can be sent again.
+    A streamed body (e.g. of a ChunkedUpload) is gone once it has been
+    sent, so those requests are sent just once, over the same connections.
+    """
+
+    def __init__(self, **kwargs):
+        super(_RetryAdapter, self).__init__(**kwargs)
+        self._once = requests.adapters.HTTPAdapter(max_retries=0)
+        self._once.poolmanager = self.poolmanager
+
+    def send(self, request, **kwargs):
+        if (request.body is not None and
+           not isinstance(request.body, basestring)):
+            return self._once.send(request, **kwargs)
+        return super(_RetryAdapter, self).send(request, **kwargs)
+
+
+class Session(requests.Session):
+    """
+    A requests Session with default timeouts and bounded retries.
+    """
+
+    def __init__(self, connect_timeout=DEFAULTS['connect_timeout'],
+                 read_timeout=DEFAULTS['read_timeout'],
+                 retries=DEFAULTS['retries'],
+                 pool_size=DEFAULTS['pool_size']):
+        """
+        Arguments:
+            connect_timeout -- (optional) seconds to wait for a connection
+            read_timeout -- (optional) seconds to wait for the response to
+                            continue
+            retries -- (optional) how often a failed connection or a
+                       response of an overloaded server is retried
+            pool_size -- (optional) connections kept alive per host
+        """
+        super(Session, self).__init__()
+        self.timeout = (connect_timeout, read_timeout)
+        # recognition requests are safe to repeat, so POSTs are retried as
+        # well (unless their body is streamed); reads that time out are not,
+        # they'd just time out again
+        retry = Retry(total=retries, read=0, backoff_factor=0.2,
+                      method_whitelist=False,
+                      status_forcelist=[502, 503, 504])
+        adapter = _RetryAdapter(pool_connections=pool_size,
+                                pool_maxsize=pool_size, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return super(Session, self).request(method, url, **kwargs)
+
+
+def get_config():
+    """
+    Returns:
+        The 'http' section of profile.yml, completed with the DEFAULTS
+    """
+    config = dict(DEFAULTS)
+    profile_path = jasperpath.config('profile.yml')
+    if os.path.exists(profile_path):
+        with open(profile_path, 'r') as f:
+            profile = yaml.safe_load(f)
+            if 'http' in profile:
+                for key in DEFAULTS:
+                    if key in profile['http']:
+                        config[key] = profile['http'][key]
+    return config
+
+
+def get_session():
+    """
+    Returns:
+        The Session shared by all engines
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = Session(**get_config())
+        return _session
+
+
+class UploadAborted(Exception):
+    """
+    Raised in the request of an aborted ChunkedUpload, to drop the
+    connection instead of ending the body normally.
+    """
+    pass
+
+
+class ChunkedUpload(object):
+    """
+    A POST request whose body is sent in chunks as it is written, on a
+    thread of its own.
+    """
+
+    def __init__(self, session, url, headers=None):
+        """
+        Arguments:
+            session -- the Session to send the request with
+            url -- the URL to post to
+            headers -- (optional) the headers of the request
+        """
+        self._session = session
+        self._queue = Queue.Queue()
+        self._chunks = []
+        self._aborted = False
+        self._done = threading.Event()
+        self.response = None
+        self.error = None
+        self._thread = threading.Thread(target=self._run,
+                                        args=(url, headers),
+                                        name='chunked upload')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def data(self):
+        """
+        Everything written so far, e.g. to post it again if the upload
+        failed.
+        """
+        return ''.join(self._chunks)
+
+    def write(self, data):
+        """
+        Sends the next chunk of the body.
+        """
+        if data:
+            self._chunks.append(data)
+            self._queue.put(data)
+
+    def _body(self):
+        while True:
+            data = self._queue.get()
+            if data is None:
+                break
+            yield data
+        if self._aborted:
+            raise UploadAborted()
+
+    def _run(self, url, headers):
+        try:
+            response = self._session.post(url, data=self._body(),
+                                          headers=headers)
+            if self._aborted:
+                # nobody waits for it anymore
+                response.close()
+            else:
+                self.response = response
+        except UploadAborted:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
+
+    def finish(self, timeout=None):
+        """
+        Ends the body and waits for the response.
+
+        Arguments:
+            timeout -- (optional) seconds to wait for the response (Default:
+                       the read timeout of the session)
+
+        Returns:
+            The response
+
+        Raises:
+            The exception the request failed with,
+            requests.exceptions.Timeout if there is no response in time, or
+            UploadAborted if the upload is aborted in the meantime
+        """
+        if timeout is None:
+            timeout = getattr(self._session, 'timeout',
+                              (None, DEFAULTS['read_timeout']))[1]
+        self._queue.put(None)
+        if not self._done.wait(timeout):
+            raise requests.exceptions.Timeout('No response within %.1f s' %
+                                              timeout)
+        if self._aborted:
+            raise UploadAborted()
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+    def abort(self):
+        """
+        Drops the request without waiting for it, also from another thread
+        than the one writing it. A body that is still being sent is cut
+        off; if it has been sent already, a finish() waiting for the
+        response returns right away, and the response is closed when it
+        arrives.
+        """
+        self._aborted = True
+        self._queue.put(None)
+        self._done.set()
+
+
+class TokenCache(object):
+    """
+    OAuth access tokens with their expiry, stored in a YAML file that only
+    the user can read.
+
+    Use TokenCache.get_instance() to get the cache in the config dir.
+    """
+
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    # tokens expiring within this many seconds are renewed, the next time
+    # they are needed
+    REFRESH_MARGIN = 300
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls(jasperpath.config('tokens.yml'))
+            return cls._instance
+
+    def __init__(self, path):
+        """
+        Arguments:
+            path -- the file the tokens are stored in
+        """
+        self._logger = logging.getLogger(__name__)
+        self.path = path
+        self._lock = threading.Lock()
+        self._tokens = None
+
+    def _load(self):
+        if self._tokens is None:
+            self._tokens = {}
+            if os.path.exists(self.path):
+                try:
+                    with open(self.path, 'r') as f:
+                        self._tokens = yaml.safe_load(f) or {}
+                except (IOError, yaml.YAMLError):
+                    self._logger.warning("Can't read the tokens in '%s'",
+                                         self.path, exc_info=True)
+        return self._tokens
+
+    def _save(self):
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                         0o600)
+            with os.fdopen(fd, 'w') as f:
+                yaml.safe_dump(self._tokens, f, default_flow_style=False)
+        except (IOError, OSError):
+            self._logger.warning("Can't store the tokens in '%s'",
+                                 self.path, exc_info=True)
+
+    def get(self, key):
+        """
+        Returns:
+            The token stored under key, or None if there is none or it is
+            about to expire (so the caller renews it)
+        """
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        if entry['expires'] - self.REFRESH_MARGIN < time.time():
+            self._logger.debug("Token '%s' is about to expire", key)
+            return None
+        return entry['token']
+
+    def set(self, key, token, expires_in):
+        """
+        Stores a token.
+
+        Arguments:
+            key -- the key to store it under
+            token -- the token
+            expires_in -- the seconds until it expires
+        """
+        with self._lock:
+            self._load()[key] = {'token': token,
+                                 'expires': time.time() + expires_in}
+            self._save()
+
+    def invalidate(self, key):
+        """
+        Forgets a token, e.g. one the server doesn't accept anymore.
+        """
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
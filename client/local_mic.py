@@ -5,6 +5,8 @@ over the terminal. Useful for debugging. Unlike with the typical Mic
 implementation, Jasper is always active listening with local_mic.
 """
 
+import copy
+
 from client.local_phone import Phone
 
 class Mic:
@@ -17,6 +19,11 @@ class Mic:
         self.active_stt_engine = active_stt_engine
         return
 
+    def view(self, active_stt_engine):
+        mic = copy.copy(self)
+        mic.active_stt_engine = active_stt_engine
+        return mic
+
     def passiveListen(self, PERSONA):
         return True, "JASPER"
 
@@ -6,13 +6,21 @@ import logging
 import tempfile
 import wave
 import audioop
+import numpy as np
 import pyaudio
 import alteration
+import audio
+import audioprobe
+import audiosource
+import bargein
+import cues
+import energy
 import jasperpath
+import resampler
+import vad
+import vocabcompiler
+import copy
 import os
-import subprocess
-import threading
-import time
 import yaml
 
 import phone
@@ -24,12 +32,9 @@ class Mic:
     speechRec = None
     speechRec_persona = None
     speaker = None
-    _last_threshold = None
-    _last_threshold_time = None
-    _background_threshold_thread = None
-    lock = threading.Lock()
 
-    def __init__(self, speaker, passive_stt_engine, active_stt_engine, echo=False):
+    def __init__(self, speaker, passive_stt_engine, active_stt_engine,
+                 echo=False, source=None):
         """
         Initiates the pocketsphinx instance.
 
@@ -38,48 +43,208 @@ class Mic:
         passive_stt_engine -- performs STT while Jasper is in passive listen
                               mode
         acive_stt_engine -- performs STT while Jasper is in active listen mode
+        source -- (optional) an audiosource.AudioSource to listen to instead
+                  of the mic, e.g. replayed WAV files
         """
         self._logger = logging.getLogger(__name__)
         self.setSpeaker(speaker)
         self.passive_stt_engine = passive_stt_engine
         self.active_stt_engine = active_stt_engine
         self.phone = phone.get_phone()
-        self._logger.info("Initializing PyAudio. ALSA/Jack error messages " +
-                          "that pop up during this process are normal and " +
-                          "can usually be safely ignored.")
-        self._audio = pyaudio.PyAudio()
-        self._logger.info("Initialization of PyAudio completed.")
         self._echo = echo # whether to play back what it heard
 
         self._audio_dev = None
+        # seconds of audio kept in the capture ring buffer
+        buffer_seconds = 15
+        # whether to capture in a separate worker process
+        capture_process = False
+        # the capture sample rate, None to pick one the device supports
+        capture_rate = None
+        # where the audio comes from, if not from the mic
+        source_config = None
+        # seconds of audio from before activeListen() was called to include
+        self.PREROLL = 0.2
+        # settings of the spectral voice activity detector, None to use the
+        # energy threshold to find the end of an utterance
+        self._vad_config = None
+        # settings of the barge-in detector, None to not listen while
+        # speaking
+        barge_in_config = None
+        # whether to spot keywords in passiveListen(), if the passive STT
+        # engine can, instead of transcribing the next disturbance
+        self._kws_enabled = True
+        # the default detection threshold of the keyphrases (see
+        # stt.KeywordSpotter)
+        self.KWS_THRESHOLD = 1e-20
         profile_path = jasperpath.config('profile.yml')
         if os.path.exists(profile_path):
             with open(profile_path, 'r') as f:
                 profile = yaml.safe_load(f)
                 if 'audio_dev' in profile and 'speaker' in profile['audio_dev']:
                     self._audio_dev = profile['audio_dev']['mic']
+                if 'capture' in profile:
+                    if 'buffer_seconds' in profile['capture']:
+                        buffer_seconds = profile['capture']['buffer_seconds']
+                    if 'preroll' in profile['capture']:
+                        self.PREROLL = profile['capture']['preroll']
+                    if 'process' in profile['capture']:
+                        capture_process = profile['capture']['process']
+                    if 'rate' in profile['capture']:
+                        capture_rate = profile['capture']['rate']
+                    if 'source' in profile['capture']:
+                        source_config = profile['capture']['source']
+                if 'vad' in profile and profile['vad'].get('enabled', True):
+                    self._vad_config = {}
+                    for key in ('frame_ms', 'hangover_ms', 'aggressiveness'):
+                        if key in profile['vad']:
+                            self._vad_config[key] = profile['vad'][key]
+                if ('barge_in' in profile and
+                   profile['barge_in'].get('enabled', True)):
+                    barge_in_config = {}
+                    for key in ('frame_ms', 'margin_db', 'min_speech_ms',
+                                'max_delay_ms', 'echo_gain'):
+                        if key in profile['barge_in']:
+                            barge_in_config[key] = profile['barge_in'][key]
+                if 'keyword_spotting' in profile:
+                    self._kws_enabled = profile['keyword_spotting'].get(
+                        'enabled', True)
+                    if 'threshold' in profile['keyword_spotting']:
+                        self.KWS_THRESHOLD = \
+                            profile['keyword_spotting']['threshold']
         if self._audio_dev is None:
             self._audio_dev = 0
         self.keep_files = False
         self.last_file_recorded = None
-        self.RATE = 44100
+        # samples per score; keep this so that thresholds stay comparable
         self.CHUNK = 32
+        # samples per read from the capture stream, scored all at once
+        self.READ_CHUNK = 1024
         self.TARGET_RATE = 16000
         self.THRESHOLD_MULTIPLIER = 1.8
+        # used until any audio has been captured, roughly a quiet room
+        self.DEFAULT_THRESHOLD = 100
+        # the spotter for the PERSONA it was made for, and the reader it
+        # stopped at, so no audio is missed between passiveListen() calls
+        self._spotter = None
+        self._kws_reader = None
+        # engines recognizing only the choices of a prompt, shared by views
+        self._choice_engines = {}
+
+        # the audio devices are shared by all Mics, and so is the arbiter
+        # deciding who gets to use them
+        self._backend = audio.AudioBackend.get_instance()
+        self._arbiter = self._backend.arbiter
+
+        if source is None and source_config is not None:
+            source = audiosource.from_config(
+                source_config, capture_rate or self.TARGET_RATE)
+        if source is not None:
+            self.RATE = source.rate
+            capture_process = False
+        else:
+            self.RATE = capture_rate
+            if self.RATE is None:
+                self.RATE = self._choose_rate(capture_process)
+
+        # converts captured audio to TARGET_RATE block by block while
+        # streaming it to the active STT engine
+        self._resampler = None
+        if self.RATE != self.TARGET_RATE:
+            self._resampler = resampler.Resampler(self.RATE,
+                                                  self.TARGET_RATE)
+
+        self._capture = self._backend.capture_stream(
+            self._audio_dev, self.RATE, buffer_seconds=buffer_seconds,
+            process=capture_process, source=source)
+
+        # lets the caller interrupt say(); shared by all views of this Mic,
+        # so the next activeListen() of any of them gets the audio
+        self._barge_in = None
+        if barge_in_config is not None:
+            self._barge_in = bargein.BargeIn(
+                self._capture,
+                bargein.BargeInDetector(self.RATE, **barge_in_config))
+
+        # the listening beeps are played from memory, while listening; with
+        # a replayed audio source there's no sound card to play them on
+        self._cues = None
+        if source is None:
+            self._cues = self._get_cue_player()
+            if self._cues is not None:
+                self._cues.prepare()
+
+    def _choose_rate(self, process):
+        """
+        Returns:
+            The capture rate needing the least resampling to TARGET_RATE
+            that the mic supports, according to the (cached) device probe
+        """
+        # a capture worker process must not inherit an initialized PyAudio,
+        # so probe with a temporary one then
+        pa = None if process else self._backend.pyaudio
+        try:
+            capabilities = audioprobe.get_capabilities(self._audio_dev,
+                                                       audio=pa)
+        except Exception:
+            self._logger.warning('Could not probe audio device %r, ' +
+                                 'capturing at 44100 Hz', self._audio_dev,
+                                 exc_info=True)
+            return 44100
+        rate = audioprobe.choose_capture_rate(capabilities, self.TARGET_RATE)
+        self._logger.info('Capturing at %d Hz', rate)
+        return rate
+
+    def _get_cue_player(self):
+        """
+        Returns:
+            A CuePlayer for the speaker's sound card, or None if it has to
+            be played with the speaker (aplay) instead
+        """
+        try:
+            pa = self._backend.pyaudio
+            index = audioprobe.find_alsa_device(pa, int(self.speaker.device))
+            if index is None:
+                self._logger.info('No PyAudio device for speaker %r, ' +
+                                  'playing cues with the speaker',
+                                  self.speaker.device)
+                return None
+            return cues.CuePlayer(self._backend, index)
+        except Exception:
+            self._logger.warning('Could not set up cue output, playing ' +
+                                 'cues with the speaker', exc_info=True)
+            return None
+
+    def _play_cue(self, name):
+        """
+        Plays one of the cue sounds in cues.CUES.
 
-        self.start_background_threshold_thread()
-
-    def start_background_threshold_thread(self):
-        cls = self.__class__
-        if cls._background_threshold_thread is None:
-            self._logger.info("Starting background threshold monitoring")
-            cls._background_threshold_thread = threading.Thread(target=self.backgroundThreshold)
-            cls._background_threshold_thread.setDaemon(True)
-            cls._background_threshold_thread.setName('noise threshold monitor')
-            cls._background_threshold_thread.start()
+        Returns:
+            The capture position by which the cue will have been heard, or
+            None if it has been played already
+        """
+        if self._cues is None:
+            self.speaker.play(jasperpath.data('audio', name + '.wav'))
+            return None
+        position = self._capture.buffer.position
+        return position + int(self._cues.play(name) * self.RATE)
+
+    @property
+    def noise_floor(self):
+        """
+        The NoiseFloorTracker fed by the capture stream, for diagnostics
+        (see its estimate and history).
+        """
+        return self._capture.noise_floor
 
-    def __del__(self):
-        self._audio.terminate()
+    def view(self, active_stt_engine):
+        """
+        Returns a Mic sharing everything with this one except for the active
+        STT engine, e.g. for a module with its own vocabulary. Views are
+        cheap, they don't open any devices.
+        """
+        mic = copy.copy(self)
+        mic.active_stt_engine = active_stt_engine
+        return mic
 
     @classmethod
     def setSpeaker(cls, speaker):
@@ -90,202 +255,260 @@ class Mic:
         score = rms / 3
         return score
 
-    def backgroundThreshold(self):
-        cls = self.__class__
-        while True:
-            try:
-                self._logger.debug('Starting background sound threshold run')
-                cls._last_threshold = self.fetchThresholdInBackground()
-                cls._last_threshold_time = time.time()
-                self._logger.debug('Finsihed background threshold run, new threshold {}'.format(cls._last_threshold))
-            except IOError as e:
-                self._logger.warning('backgroundThreshold got exception: {}'.format(repr(e)))
-
-            time.sleep(300)
+    def _get_endpointer(self, THRESHOLD):
+        """
+        Returns:
+            A new endpointer for activeListenToAllOptions(), either the
+            spectral VAD (if configured in profile.yml) or the energy
+            threshold based one
+        """
+        if self._vad_config is None:
+            # increasing the window results in longer pause after command
+            # generation; 30720 samples was tuned at 44.1 kHz
+            return energy.EnergyEndpointer(THRESHOLD, self.RATE, self.CHUNK,
+                                           window=30720 * self.RATE / 44100)
+        config = self._vad_config
+        noise_rms = None
+        if THRESHOLD is not None:
+            noise_rms = 3 * THRESHOLD / self.THRESHOLD_MULTIPLIER
+        detector = vad.VoiceActivityDetector(
+            self.RATE, frame_ms=config.get('frame_ms', 20),
+            aggressiveness=config.get('aggressiveness', 1),
+            noise_rms=noise_rms)
+        return vad.VADEndpointer(detector,
+                                 hangover_ms=config.get('hangover_ms', 300))
+
+    def _read_blocks(self, reader, nsamples):
+        """
+        Reads nsamples samples from a capture reader in blocks of up to
+        READ_CHUNK samples.
+        """
+        while nsamples > 0:
+            size = min(self.READ_CHUNK, nsamples)
+            nsamples -= size
+            yield reader.read(size)
 
     def fetchThreshold(self):
-        cls = self.__class__
-        if cls._last_threshold is None or time.time() - cls._last_threshold_time > 900:
+        """
+        Returns:
+            The current noise threshold, based on the continuously tracked
+            noise floor
+        """
+        # the tracker only lacks an estimate right after startup or if the
+        # capture stalls; score what has been captured instead, like the
+        # tracker would
+        estimate = self.noise_floor.wait(2.0)
+        if estimate is None:
+            stream = self._capture.reader(preroll=1)
+            scores = energy.frame_scores(stream.read(stream.available),
+                                         self.CHUNK)
+            if not len(scores):
+                self._logger.warning('No audio captured, using the ' +
+                                     'default noise threshold')
+                return self.DEFAULT_THRESHOLD
+            self._logger.warning('No noise floor estimate available, ' +
+                                 'using %d frames', len(scores) * self.CHUNK)
+            estimate = scores.mean()
+        threshold = estimate * self.THRESHOLD_MULTIPLIER
+        self._logger.debug('returned threshold is {}'.format(threshold))
+        return threshold
+
+    def _get_keyword_spotter(self, PERSONA):
+        """
+        Returns:
+            A KeywordSpotter for PERSONA and the keyword phrases with a
+            threshold, or None if the passive STT engine can't spot
+            keywords or spotting is disabled in profile.yml
+        """
+        if not self._kws_enabled or not hasattr(self.passive_stt_engine,
+                                                'keyword_spotter'):
+            return None
+        if self._spotter is None or self._spotter[0] != PERSONA:
             try:
-                self._logger.debug('Starting foreground sound threshold run')
-                cls._last_threshold = self.fetchThresholdInBackground()
-                cls._last_threshold_time = time.time()
-                self._logger.debug('Finsihed foreground sound threshold run')
-            except IOError as e:
-                self._logger.warning('FetchThreshold got exception: {}'.format(repr(e)))
-        self._logger.debug('returned threshold is {}'.format(cls._last_threshold))
-        return cls._last_threshold
-
-    def fetchThresholdInBackground(self):
-        cls = self.__class__
-
-        # number of seconds to allow to establish threshold
-        THRESHOLD_TIME = 1
-
-        stream = None
-        cls.lock.acquire()
-        try:
-
-            # prepare recording stream
-            stream = self._audio.open(format=pyaudio.paInt16,
-                                    channels=1,
-                                    rate=self.RATE,
-                                    input=True,
-                                    input_device_index=self._audio_dev,
-                                    frames_per_buffer=self.CHUNK)
-
-            # stores the audio data
-            frames = []
+                keyphrases = vocabcompiler.get_keyword_thresholds()
+                keyphrases.setdefault(PERSONA, self.KWS_THRESHOLD)
+                spotter = self.passive_stt_engine.keyword_spotter(keyphrases)
+            except Exception:
+                self._logger.warning('Could not set up keyword spotting, ' +
+                                     'transcribing disturbances instead',
+                                     exc_info=True)
+                self._kws_enabled = False
+                return None
+            self._spotter = (PERSONA, spotter)
+            self._kws_reader = None
+        return self._spotter[1]
+
+    def _spot_keyword(self, spotter, PERSONA):
+        """
+        passiveListen() with a KeywordSpotter: spots keyphrases in the
+        live audio, continuing where the last call stopped.
+        """
 
-            # stores the lastN score values
-            lastN = [i for i in range(int(20480/self.CHUNK))]
+        # number of seconds to listen before returning
+        LISTEN_TIME = 10
 
-            # calculate the long run average, and thereby the proper threshold
-            for i in range(0, int(self.RATE / self.CHUNK * THRESHOLD_TIME + 0.5)):
+        # number of seconds of audio fed again when continuing, so that a
+        # keyphrase said right as the last call returned isn't cut off
+        OVERLAP_TIME = 0.5
 
-                # This is a poorly documentd hack to avoid buffer overflows on some platforms
-                # Only works with pyaudio 0.2.11 and up
-                data = stream.read(self.CHUNK, False)
-                # data = stream.read(CHUNK)
-                frames.append(data)
+        if self._kws_reader is None:
+            stream = self._capture.reader()
+        else:
+            stream = self._capture.reader(
+                start=self._kws_reader.position -
+                int(OVERLAP_TIME * self.RATE))
 
-                # save this data point as a score
-                lastN.pop(0)
-                lastN.append(self.getScore(data))
-            average = sum(lastN) / len(lastN)
+        phrase = None
+        spotter.start(self.RATE)
+        try:
+            for data in self._read_blocks(stream, LISTEN_TIME * self.RATE):
+                phrase = spotter.feed(data)
+                if phrase:
+                    break
+        finally:
+            spotter.stop()
 
-        finally :
-            if stream is not None:
-                stream.stop_stream()
-                stream.close()
-                stream = None
-            cls.lock.release()
+        if not phrase:
+            self._kws_reader = stream
+            return (None, None)
+        # the audio up to here has been dealt with
+        self._kws_reader = None
 
-        # this will be the benchmark to cause a disturbance over!
-        THRESHOLD = average * self.THRESHOLD_MULTIPLIER
+        if PERSONA in phrase:
+            return (self.fetchThreshold(), PERSONA)
 
-        return THRESHOLD
+        return (False, [phrase])
 
     def passiveListen(self, PERSONA):
         """
         Listens for PERSONA in everyday sound. Times out after LISTEN_TIME, so
         needs to be restarted.
+
+        If the passive STT engine can spot keywords, PERSONA and the keyword
+        phrases with a threshold are spotted in the live audio as soon as
+        they are said. Otherwise, the audio around the next disturbance is
+        transcribed to check for PERSONA.
         """
+        spotter = self._get_keyword_spotter(PERSONA)
+        if spotter is not None:
+            return self._spot_keyword(spotter, PERSONA)
 
-        # number of seconds to allow to establish threshold
-        THRESHOLD_TIME = 1
+        # number of seconds of audio from before listening started to keep
+        CONTEXT_TIME = 1
 
         # number of seconds to listen before forcing restart
         LISTEN_TIME = 10
 
-        # prepare recording stream
-        stream = self._audio.open(format=pyaudio.paInt16,
-                                  channels=1,
-                                  rate=self.RATE,
-                                  input=True,
-                                  input_device_index=self._audio_dev,
-                                  frames_per_buffer=self.CHUNK)
-
-        # stores the audio data
-        frames = []
-
-        # stores the lastN score values
-        lastN = [i for i in range(int(30720/self.CHUNK))]
-
-        # calculate the long run average, and thereby the proper threshold
-        for i in range(0, self.RATE / self.CHUNK * THRESHOLD_TIME):
-
-            data = stream.read(self.CHUNK)
-            frames.append(data)
-
-            # save this data point as a score
-            lastN.pop(0)
-            lastN.append(self.getScore(data))
-            average = sum(lastN) / len(lastN)
-
         # this will be the benchmark to cause a disturbance over!
-        THRESHOLD = average * self.THRESHOLD_MULTIPLIER
+        THRESHOLD = self.fetchThreshold()
 
-        # save some memory for sound data
-        frames = []
+        # read from the shared capture stream, starting CONTEXT_TIME seconds
+        # in the past so the start of a disturbance right away is kept
+        stream = self._capture.reader(preroll=CONTEXT_TIME)
+
+        # stores the audio data
+        frames = [stream.read(stream.available)]
 
         # flag raised when sound disturbance detected
         didDetect = False
 
         # start passively listening for disturbance above threshold
-        for i in range(0, self.RATE / self.CHUNK * LISTEN_TIME):
-
-            data = stream.read(self.CHUNK)
-            frames.append(data)
-            score = self.getScore(data)
-
-            if score > THRESHOLD:
+        nframes = self.RATE / self.CHUNK * LISTEN_TIME
+        for data in self._read_blocks(stream, nframes * self.CHUNK):
+            loud = np.flatnonzero(energy.frame_scores(data, self.CHUNK) >
+                                  THRESHOLD)
+            if len(loud):
+                frames.append(data[:(loud[0] + 1) * self.CHUNK * 2])
                 didDetect = True
                 break
+            frames.append(data)
 
         # no use continuing if no flag raised
         if not didDetect:
             print "No disturbance detected"
-            stream.stop_stream()
-            stream.close()
             return (None, None)
 
         # cutoff any recording before this disturbance was detected
-        frames = frames[-int(20480/self.CHUNK):]
+        # (20480 samples, which was tuned at 44.1 kHz)
+        keep = int(20480 * self.RATE / 44100)
+        frames = [''.join(frames)[-keep * 2:]]
 
         # otherwise, let's keep recording for few seconds and save the file
         DELAY_MULTIPLIER = 1
-        for i in range(0, self.RATE / self.CHUNK * DELAY_MULTIPLIER):
-
-            data = stream.read(self.CHUNK)
-            frames.append(data)
+        nframes = self.RATE / self.CHUNK * DELAY_MULTIPLIER
+        frames.extend(self._read_blocks(stream, nframes * self.CHUNK))
 
-        # save the audio data
-        stream.stop_stream()
-        stream.close()
-
-        with tempfile.NamedTemporaryFile(mode='w+b') as f:
-            wav_fp = wave.open(f, 'wb')
-            wav_fp.setnchannels(1)
-            wav_fp.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
-            wav_fp.setframerate(self.RATE)
-            wav_fp.writeframes(''.join(frames))
-            wav_fp.close()
-            f.seek(0)
-            # check if PERSONA was said
-            transcribed = self.passive_stt_engine.transcribe(f)
+        # check if PERSONA was said
+        transcribed = self.passive_stt_engine.transcribe_pcm(
+            ''.join(frames), self.RATE, 2)
 
         if any(PERSONA in phrase for phrase in transcribed):
             return (THRESHOLD, PERSONA)
 
         return (False, transcribed)
 
-    def activeListen(self, THRESHOLD=None, LISTEN=True, MUSIC=False):
+    def activeListen(self, THRESHOLD=None, LISTEN=True, MUSIC=False,
+                     choices=None):
         """
             Records until a second of silence or times out after 12 seconds
 
+            With choices (e.g. ['YES', 'NO']), only listens for one of them
+
             Returns the first matching string or None
         """
 
-        options = self.activeListenToAllOptions(THRESHOLD, LISTEN, MUSIC)
+        options = self.activeListenToAllOptions(THRESHOLD, LISTEN, MUSIC,
+                                                choices=choices)
         if options:
             return options[0]
 
+    def _get_choices_engine(self, choices):
+        """
+        Returns:
+            An STT engine that only recognizes the choices (or rejects the
+            utterance), or the active STT engine if it can't be narrowed
+            down to them
+        """
+        key = (type(self.active_stt_engine), tuple(sorted(set(choices))))
+        if key not in self._choice_engines:
+            engine = None
+            if hasattr(self.active_stt_engine, 'get_choices_instance'):
+                try:
+                    engine = self.active_stt_engine.get_choices_instance(
+                        key[1])
+                except Exception:
+                    self._logger.warning('Could not compile a vocabulary ' +
+                                         'of the choices %r, listening ' +
+                                         'with the full one instead',
+                                         key[1], exc_info=True)
+            self._choice_engines[key] = engine
+        return self._choice_engines[key] or self.active_stt_engine
+
     def activeListenToAllOptions(self, THRESHOLD=None, LISTEN=True,
-                                 MUSIC=False):
+                                 MUSIC=False, choices=None):
         """
             Records until a second of silence or times out after 12 seconds
 
+            With choices, only one of them is returned. If the STT engine
+            can reject an utterance as none of them, it switches to a
+            vocabulary of just these phrases for this listen; otherwise it
+            transcribes as usual and other transcriptions are dropped
+
             Returns a list of the matching options or None
         """
 
-        cls = self.__class__
         LISTEN_TIME = 12
 
         # check if no threshold provided
         if THRESHOLD is None:
             THRESHOLD = self.fetchThreshold()
 
+        # if the caller interrupted the last say(), they are already
+        # talking; listen from where they started instead of beeping
+        barge_in = None
+        if self._barge_in is not None:
+            barge_in = self._barge_in.take()
+
         #wait_count = 0
         #while not self.phone.ptt_pressed() and wait_count < 120:
             #wait_count += 1
@@ -296,130 +519,142 @@ class Mic:
         #if not self.phone.ptt_pressed():
             #return ['',]
 
-        cls.lock.acquire()
-
-        stream = None
-        self.speaker.play(jasperpath.data('audio', 'beep_hi.wav'))
-
+        self._arbiter.acquire(audio.LISTEN, 'listen')
+        streaming = False
         try:
-            # prepare recording stream
-            stream = self._audio.open(format=pyaudio.paInt16,
-                                    channels=1,
-                                    rate=self.RATE,
-                                    input=True,
-                                    input_device_index=self._audio_dev,
-                                    frames_per_buffer=self.CHUNK)
+            # the beep plays while we're already listening
+            cue_end = None
+            if barge_in is None:
+                cue_end = self._play_cue('beep_hi')
+
+            # engines that decode incrementally get the audio while it is
+            # being captured, so only the last block is left to decode at
+            # the end
+            if choices is None:
+                engine = self.active_stt_engine
+            else:
+                engine = self._get_choices_engine(choices)
+            if engine.SUPPORTS_STREAMING:
+                engine.start_stream(self.TARGET_RATE, 2)
+                streaming = True
+
+            # start PREROLL seconds in the past, so we don't miss callers who
+            # start talking right as the beep ends
+            if barge_in is None:
+                stream = self._capture.reader(preroll=self.PREROLL)
+            else:
+                stream = self._capture.reader(
+                    start=barge_in - int(self.PREROLL * self.RATE))
 
             frames = []
-            # increasing the range # results in longer pause after command
-            # generation
-            lastN = [THRESHOLD * 1.2 for i in range(int(30720/self.CHUNK))]
-            # States:
-            # 0 -- before utterance
-            # 1 -- during utterance
-            # 2 -- after utterance
-            state = 0
-            utterances = 0
-            post_utterance_frames = 0
-            silence_frames_threshold = int(0.25*self.RATE/self.CHUNK) # 1/4 of a second
-
-            for i in range(0, self.RATE / self.CHUNK * LISTEN_TIME):
+            endpointer = self._get_endpointer(THRESHOLD)
+
+            nframes = self.RATE / self.CHUNK * LISTEN_TIME
+            for data in self._read_blocks(stream, nframes * self.CHUNK):
                 if self.phone.on_hook():
                     raise phone.Hangup()
 
-                # Only works with pyaudio 0.2.11 and up
-                data = stream.read(self.CHUNK, False)
-                # data = stream.read(CHUNK)
+                # drop the beep itself, neither the endpointer nor the STT
+                # engine should hear it
+                if cue_end is not None:
+                    skip = min(max(0, cue_end - stream.position +
+                                   len(data) // 2), len(data) // 2)
+                    data = data[skip * 2:]
+                if not data:
+                    continue
+                end = endpointer.feed(data)
+                if end is not None:
+                    data = data[:end * 2]
                 frames.append(data)
-                score = self.getScore(data)
-
-                lastN.pop(0)
-                lastN.append(score)
-
-                average = sum(lastN) / float(len(lastN))
-
-                # TODO: 0.8 should not be a MAGIC NUMBER!
-                # if not self.phone.ptt_pressed() and average < THRESHOLD * 0.8:
-                if average > THRESHOLD * 1.25:
-                    if state != 1:
-                        self._logger.debug('Begin utterance')
-                        utterances += 1
-                        state = 1
-                elif state > 0 and average < THRESHOLD * 0.8:
-                    if state != 2:
-                        self._logger.debug('End utterance')
-                    post_utterance_frames += 1
-                    state = 2
-                if state == 2 and post_utterance_frames >= silence_frames_threshold:
-                    self._logger.debug('Enough post-utterance silnce')
+                if streaming:
+                    if self._resampler is not None:
+                        data = self._resampler.process(data)
+                    engine.feed(data)
+                if end is not None:
                     break
 
-            self.speaker.play(jasperpath.data('audio', 'beep_lo.wav'))
-
-        # save the audio data
-        finally: 
-            if stream is not None:
-                stream.stop_stream()
-                stream.close()
-
-            cls.lock.release()
-
-        with tempfile.NamedTemporaryFile(mode='w+b', suffix='.wav', delete=not self.keep_files) as f:
-            wav_fp = wave.open(f, 'wb')
-            wav_fp.setnchannels(1)
-            wav_fp.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
-            wav_fp.setframerate(self.RATE)
-            wav_fp.writeframes(''.join(frames))
-            wav_fp.close()
-            f.seek(0)
-            if self.RATE == self.TARGET_RATE:
-                self._logger.debug('No resample necessary')
-                candidates = self.active_stt_engine.transcribe(f)
+            self._play_cue('beep_lo')
+
+            if streaming and self._resampler is not None:
+                engine.feed(self._resampler.flush())
+
+        except Exception:
+            if streaming:
+                if self._resampler is not None:
+                    self._resampler.reset()
+                engine.abort()
+            raise
+        finally:
+            self._arbiter.release()
+
+        if streaming:
+            candidates = engine.finish()
+        else:
+            data = resampler.resample(''.join(frames), self.RATE,
+                                      self.TARGET_RATE)
+            candidates = engine.transcribe_pcm(data, self.TARGET_RATE, 2)
+
+        if barge_in is not None:
+            # hearing nothing means the speaker's own voice triggered it
+            self._barge_in.record(any(candidates or []))
+
+        if self._echo or self.keep_files:
+            if streaming:
+                data = resampler.resample(''.join(frames), self.RATE,
+                                          self.TARGET_RATE)
+            with tempfile.NamedTemporaryFile(mode='w+b', suffix='.wav', delete=not self.keep_files) as f:
+                wav_fp = wave.open(f, 'wb')
+                wav_fp.setnchannels(1)
+                wav_fp.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
+                wav_fp.setframerate(self.TARGET_RATE)
+                wav_fp.writeframes(data)
+                wav_fp.close()
+                f.flush()
                 if self._echo:
+                    if self._cues is not None:
+                        self._cues.close()
                     self.speaker.play(f.name)
                 if self.keep_files:
                     self.last_file_recorded = f.name
-            else:
-                resampled_file = resample(f.name, self.TARGET_RATE)
-                f_prime = open(resampled_file)
-                candidates = self.active_stt_engine.transcribe(f_prime)
-                f_prime.close()
-                if self._echo:
-                    self.speaker.play(resampled_file)
-                if self.keep_files:
-                    self.last_file_recorded = resampled_file
-                    os.remove(f.name)
-                else:
-                    os.remove(resampled_file)
 
-            if candidates:
-                self._logger.info('Got the following possible transcriptions:')
-                for c in candidates:
-                    self._logger.info(c)
-            # f.close()
-            return candidates
+        if candidates:
+            self._logger.info('Got the following possible transcriptions:')
+            for c in candidates:
+                self._logger.info(c)
+
+        if choices is not None and candidates:
+            # engines that can't be narrowed down may hear anything
+            valid = set(' '.join(choice.upper().split())
+                        for choice in choices)
+            candidates = [c for c in candidates
+                          if ' '.join(c.upper().split()) in valid]
+            if not candidates:
+                self._logger.info('None of them is one of %r', choices)
+        return candidates
 
     def say(self, phrase,
             OPTIONS=" -vdefault+m3 -p 40 -s 160 --stdout > say.wav"):
-        cls = self.__class__
         # alter phrase before speaking
         phrase = alteration.clean(phrase)
-        cls.lock.acquire()
-        try:
-            self.speaker.say(phrase)
-        finally:
-            cls.lock.release()
+        if self._barge_in is not None and self._barge_in.interrupted:
+            # the caller is talking, skip the rest until somebody listens
+            self._logger.debug("Not saying '%s', interrupted", phrase)
+        else:
+            noise_rms = 0
+            if self._barge_in is not None:
+                # scores are a third of the rms
+                noise_rms = 3 * self.fetchThreshold()
+            with self._arbiter.claim(audio.SPEAK, 'say'):
+                if self._cues is not None:
+                    # the speaker may need the output device to itself
+                    self._cues.close()
+                if self._barge_in is None:
+                    self.speaker.say(phrase)
+                else:
+                    with self._barge_in.monitoring(self.speaker, noise_rms):
+                        self.speaker.say(phrase)
+                if self._cues is not None:
+                    # reopen it for the next beep while the caller listens
+                    self._cues.prepare()
         if self.phone.on_hook():
             raise phone.Hangup()
-
-def resample(filename, rate):
-    ofd, ofn = tempfile.mkstemp(suffix='.wav')
-    os.close(ofd)
-    cmd = ['sox', filename, ofn, 'rate', str(rate)]
-    with tempfile.TemporaryFile() as f:
-        subprocess.call(cmd, stdout=f, stderr=f)
-        f.seek(0)
-        output=f.read()
-        if output:
-            logging.debug('Output of resample was: {0}'.format(output))
-    return ofn
@@ -0,0 +1,212 @@
+# -*- coding: utf-8-*-
+"""
+A local stand-in for the speech APIs of the cloud STT engines.
+
+The MockSpeechServer answers the requests of GoogleSTT, AttSTT and
+WitAiSTT with a fixed transcription, after receiving the audio at a
+limited bandwidth and waiting for a simulated network latency, so the
+engines can be tested and benchmarked without a network or API keys.
+
+Run this file to measure how much of the wait for a transcription
+streaming the audio while it is being captured saves over uploading it
+once the caller stopped talking (see the bottom of this file).
+"""
+import BaseHTTPServer
+import json
+import SocketServer
+import threading
+import time
+import urlparse
+
+
+class MockSpeechHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _read(self, size):
+        # as fast as the simulated bandwidth allows
+        data = ''
+        while len(data) < size:
+            block = self.rfile.read(min(size - len(data), 4096))
+            if not block:
+                break
+            data += block
+            if self.server.bandwidth:
+                time.sleep(len(block) / float(self.server.bandwidth))
+        return data
+
+    def _read_body(self):
+        if self.headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int(self.rfile.readline().split(';')[0], 16)
+                if size == 0:
+                    # the (empty) trailer
+                    self.rfile.readline()
+                    return ''.join(chunks), True
+                chunks.append(self._read(size))
+                self.rfile.readline()
+        return self._read(int(self.headers.get('content-length', 0))), False
+
+    def do_POST(self):
+        server = self.server
+        if server.latency:
+            # the first bytes take that long to arrive
+            time.sleep(server.latency / 2.0)
+        body, chunked = self._read_body()
+        server.received.append((self.path, chunked, len(body)))
+        if server.latency:
+            # and the response takes that long to come back
+            time.sleep(server.latency / 2.0)
+        text = server.transcription
+        path = urlparse.urlsplit(self.path).path
+        if path.startswith('/oauth'):
+            response = {'access_token': 'MOCK', 'expires_in': 3600}
+        elif path.startswith('/speech-api'):
+            response = {'result': [{'alternative': [{'transcript': text}],
+                                    'final': True}],
+                        'result_index': 0}
+        elif path.startswith('/speech/v3'):
+            response = {'Recognition': {'Status': 'OK', 'NBest': [
+                {'Hypothesis': text, 'Confidence': 0.9}]}}
+        else:
+            response = {'_text': text}
+        data = json.dumps(response)
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MockSpeechServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+    """
+    Serves on a free port of localhost, on a thread of its own.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, bandwidth=None, latency=0,
+                 transcription='what time is it'):
+        """
+        Arguments:
+            bandwidth -- (optional) the bytes per second the requests are
+                         received with (Default: no limit)
+            latency -- (optional) the round trip time in seconds (Default: 0)
+            transcription -- (optional) the text every request is answered
+                             with
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           MockSpeechHandler)
+        self.bandwidth = bandwidth
+        self.latency = latency
+        self.transcription = transcription
+        # (path, whether it was chunked, bytes) of every request
+        self.received = []
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='mock speech server')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def handle_error(self, request, client_address):
+        # clients hang up on aborted uploads
+        pass
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def point(self, engine):
+        """
+        Makes an engine send its requests to this server.
+        """
+        if hasattr(engine, 'HOST'):
+            engine.HOST = self.url
+            engine._regenerate_request_url()
+        if hasattr(engine, 'TOKEN_URL'):
+            engine.TOKEN_URL = self.url + '/oauth/v4/token'
+        if hasattr(engine, 'SPEECH_URL'):
+            engine.SPEECH_URL = (self.url +
+                                 urlparse.urlsplit(engine.SPEECH_URL).path)
+        return engine
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    import argparse
+    import logging
+
+    import numpy as np
+
+    import httpsession
+    import stt
+
+    parser = argparse.ArgumentParser(
+        description='Measures the wait for a transcription after the end ' +
+        'of an utterance, uploading the audio while it is captured or ' +
+        'afterwards')
+    parser.add_argument('--stt', default='witai',
+                        choices=['google', 'att', 'witai'])
+    parser.add_argument('--bandwidth', type=float, default=256,
+                        help='the upload bandwidth in kbit/s')
+    parser.add_argument('--latency', type=float, default=0.1,
+                        help='the round trip time in seconds')
+    parser.add_argument('--seconds', type=float, default=3,
+                        help='the length of the utterance')
+    parser.add_argument('--rate', type=int, default=16000)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--encoding', choices=['pcm', 'flac'],
+                        help='the encoding of the audio (Default: that of ' +
+                        'the engine)')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    server = MockSpeechServer(bandwidth=args.bandwidth * 1000 / 8,
+                              latency=args.latency)
+    # no network needed, so no is_available() check
+    engine_class = dict((engine.SLUG, engine)
+                        for engine in stt.get_engines())[args.stt]
+    if args.stt == 'google':
+        engine = engine_class(api_key='MOCK')
+    elif args.stt == 'att':
+        engine = engine_class('MOCK', 'MOCK')
+        engine._tokens = httpsession.TokenCache('/dev/null')
+    else:
+        engine = engine_class('MOCK')
+    if args.encoding:
+        engine.encoding = args.encoding
+    server.point(engine)
+
+    chunk = 1024
+    # a tone switched on and off like syllables, in some noise, so FLAC
+    # compresses it about as well as speech
+    t = np.arange(int(args.seconds * args.rate)) / float(args.rate)
+    audio = (3000 * np.sin(2 * np.pi * 200 * t) *
+             (np.sin(2 * np.pi * 2 * t) > 0) +
+             np.random.normal(0, 50, len(t))).astype('<i2').tostring()
+    for run in range(args.runs):
+        # audio is captured in real time either way
+        engine.start_stream(args.rate)
+        for i in range(0, len(audio), chunk * 2):
+            time.sleep(chunk / float(args.rate))
+            engine.feed(audio[i:i + chunk * 2])
+        start = time.time()
+        result = engine.finish()
+        streamed = time.time() - start
+
+        start = time.time()
+        engine.transcribe_pcm(audio, args.rate)
+        uploaded = time.time() - start
+        print("%r: %.3f s streamed, %.3f s uploaded afterwards, " %
+              (result, streamed, uploaded) +
+              "%d of %d bytes sent" % (server.received[-1][2], len(audio)))
+    server.close()
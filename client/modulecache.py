@@ -0,0 +1,193 @@
+# -*- coding: utf-8-*-
+"""
+A bounded cache for the per-module Mics of the Brain.
+
+A module with INSTANCE_WORDS gets its own STT engine (and a Mic view using
+it), which takes a while to create and stays resident afterwards. The
+ModuleCache keeps the most recently used ones up to a number of entries
+and/or an approximate resident size, evicting the least recently used
+ones beyond that. The size of an entry is what its STT engine reports
+(see AbstractSTTEngine.resident_bytes), which leaves out memory that
+evicting it doesn't free. Without a report, it is the growth of the
+process's resident memory while the entry was created, which is rough
+(other threads allocate meanwhile) but needs no cooperation from the STT
+engines. Hit, miss and eviction counters help sizing the limits.
+
+Only get() evicts, on the thread that uses the values. Prewarming on
+another thread only fills the cache up to its limits, so it can't free a
+value that is in use.
+"""
+import collections
+import logging
+import os
+import threading
+
+
+def resident_bytes():
+    """
+    Returns:
+        The resident set size of this process in bytes, or None if it
+        can't be determined (on systems without /proc)
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class ModuleCache(object):
+    """
+    An LRU cache of values created on demand, keyed by module name.
+    """
+
+    def __init__(self, create, max_entries=None, max_bytes=None,
+                 evict=None, size=None):
+        """
+        Arguments:
+            create -- called with a module to create its value
+            max_entries -- (optional) the number of values kept at most
+                           (Default: no limit)
+            max_bytes -- (optional) the approximate resident size of the
+                         values kept at most (Default: no limit)
+            evict -- (optional) called with every value dropped from the
+                     cache, e.g. to free its resources
+            size -- (optional) called with a new value to get the bytes
+                    evicting it frees, or None to measure its size
+        """
+        self._logger = logging.getLogger(__name__)
+        self._create = create
+        self._evict = evict
+        self._size = size
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # name -> (value, size), least recently used first
+        self._entries = collections.OrderedDict()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    @property
+    def resident_bytes(self):
+        """
+        The approximate resident size of all cached values in bytes.
+        """
+        with self._lock:
+            return sum(size for value, size in self._entries.values())
+
+    @property
+    def stats(self):
+        """
+        A dict with the counters and current size of the cache.
+        """
+        with self._lock:
+            return {'entries': len(self._entries),
+                    'resident_bytes': self.resident_bytes,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
+
+    def get(self, module):
+        """
+        Returns:
+            The value for the module, created if it isn't cached
+        """
+        name = module.__name__
+        with self._lock:
+            if name in self._entries:
+                self.hits += 1
+                entry = self._entries.pop(name)
+                self._entries[name] = entry
+                return entry[0]
+            self.misses += 1
+            self._logger.debug('Creating cache entry for module %s', name)
+            self._entries[name] = self._create_entry(module)
+            self._shrink()
+            self._logger.debug('Module cache: %r', self.stats)
+            return self._entries[name][0]
+
+    def prewarm(self, modules):
+        """
+        Creates the values of modules that aren't cached yet, most popular
+        first, without counting them as misses, until the cache is full.
+        They count as less recently used than the values already cached.
+        Prewarming never evicts, since the values may be in use on the
+        thread calling get().
+        """
+        for module in modules:
+            with self._lock:
+                name = module.__name__
+                if name in self._entries:
+                    continue
+                if self._is_full():
+                    self._logger.debug('Module cache full, not prewarming ' +
+                                       '%s', name)
+                    return
+                self._logger.debug('Prewarming module %s', name)
+                entry = self._create_entry(module)
+                if (self._entries and self.max_bytes is not None and
+                        self.resident_bytes + entry[1] > self.max_bytes):
+                    self._logger.debug('Module %s does not fit into the ' +
+                                       'module cache', name)
+                    self._free(name, entry[0])
+                    return
+                # the least recently used, so that the less popular
+                # modules after it are evicted before it
+                self._entries = collections.OrderedDict(
+                    [(name, entry)] + self._entries.items())
+
+    def _create_entry(self, module):
+        before = resident_bytes()
+        value = self._create(module)
+        after = resident_bytes()
+        size = self._size(value) if self._size is not None else None
+        if size is None:
+            size = 0
+            if before is not None and after is not None:
+                size = max(0, after - before)
+        return value, size
+
+    def _is_full(self):
+        return ((self.max_entries is not None and
+                 len(self._entries) >= self.max_entries) or
+                (self.max_bytes is not None and
+                 self.resident_bytes >= self.max_bytes))
+
+    def _shrink(self):
+        # the newest entry is never evicted, even if it alone is too big
+        while len(self._entries) > 1 and (
+                (self.max_entries is not None and
+                 len(self._entries) > self.max_entries) or
+                (self.max_bytes is not None and
+                 self.resident_bytes > self.max_bytes)):
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        name, (value, size) = self._entries.popitem(last=False)
+        self.evictions += 1
+        self._logger.debug('Evicting module %s (%d bytes)', name, size)
+        self._free(name, value)
+
+    def _free(self, name, value):
+        if self._evict is not None:
+            try:
+                self._evict(value)
+            except Exception:
+                self._logger.warning('Failed to free the cache entry of ' +
+                                     'module %s', name, exc_info=True)
+
+    def clear(self):
+        """
+        Evicts all values.
+        """
+        with self._lock:
+            while self._entries:
+                self._drop_oldest()
@@ -16,8 +16,7 @@ def ask_yes_no(prompt, mic):
     answer = None
     while answer not in valid_choices:
         mic.say(prompt)
-        answer = mic.activeListen().upper()
-        answer = answer.split(' ')[0]
+        answer = mic.activeListen(choices=INSTANCE_WORDS) or ''
         if answer == 'REPEAT':
             continue
         if answer not in valid_choices:
@@ -17,8 +17,17 @@ def handle(text, mic, profile):
 
     logger = logging.getLogger(__name__)
 
-    def in_func():
-        retval = mic.activeListen().upper().split(' ')[0]
+    def in_func(choices=None):
+        # the game's choices are lower case words and digits
+        if choices is not None and all(not choice.isdigit() or
+                                       int(choice) < len(NUMBERS)
+                                       for choice in choices):
+            choices = [NUMBERS[int(choice)] if choice.isdigit()
+                       else choice.upper() for choice in choices]
+        else:
+            choices = None
+        retval = mic.activeListen(choices=choices) or ''
+        retval = retval.upper().split(' ')[0]
         if retval in NUMBERS:
             for i, numword in enumerate(NUMBERS):
                 if retval == numword:
@@ -7,6 +7,22 @@ from client.games.utils import mk_print_list
 WORDS = [ 'PLAY', 'CRIBBAGE'  ]
 INSTANCE_WORDS = [ 'ACE', 'TWO', 'THREE', 'FOUR', 'FIVE', 'SIX', 'SEVEN', 'EIGHT', 'NINE', 'TEN', 'JACK', 'QUEEN', 'KING', 'OF', 'CLUBS', 'DIAMONDS', 'HEARTS', 'SPADES']
 
+# a card, or its rank or suit alone, as cribbage.input_card() reads them
+GRAMMAR = {
+    'S': ['[<article>] <rank> [OF <suit>]', '<suit>'],
+    'article': ['A', 'AN', 'THE'],
+    'rank': INSTANCE_WORDS[:13],
+    'suit': INSTANCE_WORDS[-4:],
+}
+
+# the same phrases as choices for activeListen(); they don't depend on the
+# hand, so the engine for them is only compiled once, and input_card()
+# rejects the cards that can't be played
+CARDS = (['%s OF %s' % (rank, suit) for rank in GRAMMAR['rank']
+          for suit in GRAMMAR['suit']] + GRAMMAR['rank'])
+CHOICES = ([' '.join((article, card)) for article in GRAMMAR['article']
+            for card in CARDS] + CARDS + GRAMMAR['suit'])
+
 
 PRIORITY = 50
 
@@ -16,7 +32,7 @@ def handle(text, mic, profile):
     """
 
     def in_func():
-        return mic.activeListen().lower().split()
+        return (mic.activeListen(choices=CHOICES) or '').lower().split()
 
     def out_func(string):
         if type(string) is not str:
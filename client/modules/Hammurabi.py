@@ -16,6 +16,25 @@ INSTANCE_WORDS = [
     'ALL',
 ] + mk_upper(text2int.units) + mk_upper(text2int.tens) + mk_upper(text2int.scales)
 
+# the answers to yes or no questions, and numbers below a hundred thousand
+# the way text2int reads them
+GRAMMAR = {
+    'S': ['YES', 'NO', 'QUIT', 'NONE', 'ALL', '<number>'],
+    'number': [
+        '<below_hundred>',
+        '<hundreds>',
+        '<hundreds> [AND] <below_hundred>',
+        '<thousands> [<hundreds>]',
+        '<thousands> [<hundreds>] [AND] <below_hundred>',
+    ],
+    'thousands': ['<below_hundred> THOUSAND', '<hundreds> THOUSAND'],
+    'hundreds': ['<digit> HUNDRED'],
+    'below_hundred': ['ZERO', '<digit>', '<teen>', '<ten> [<digit>]'],
+    'digit': mk_upper(text2int.units[1:10]),
+    'teen': mk_upper(text2int.units[10:]),
+    'ten': mk_upper(text2int.tens),
+}
+
 PRIORITY = 50
 
 instructions = [
@@ -56,7 +75,7 @@ def get_yes_no(prompt, mic):
     mic.say(prompt)
     answer = ''
     while answer not in ['YES', 'NO']:
-        answer = mic.activeListen()
+        answer = mic.activeListen(choices=['YES', 'NO'])
         if answer not in ['YES', 'NO']:
             print('Didn\'t like {0}'.format(answer))
             mic.say('That wasn\'t a yes or no.')
@@ -17,12 +17,12 @@ def handle(text, mic, profile):
     mic.say('Let\'s change my voice')
     
     mic.say('Which voice would you like? from one through nine')
-    answer = mic.activeListen()
+    answer = mic.activeListen(choices=INSTANCE_WORDS)
     while answer not in INSTANCE_WORDS:
         mic.say('I don\'t know voice {}'.format(answer))
         print('Don\'t know {}'.format(answer))
         mic.say('Which voice would you like?')
-        answer = mic.activeListen()
+        answer = mic.activeListen(choices=INSTANCE_WORDS)
 
     if answer == 'ONE':
         new_tts_engine = tts.get_engine_by_slug('espeak-tts')
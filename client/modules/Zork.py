@@ -683,6 +683,92 @@ INSTANCE_WORDS = [
         # "ZZMGCK",
 ]
 
+# what can be said to Zork, instead of any sequence of INSTANCE_WORDS
+GRAMMAR = {
+    'S': [
+        '<command>',
+        '[<move>] <direction>',
+        '<move> <preposition> <thing>',
+        '<verb> <thing>',
+        '<verb> <thing> <preposition> <thing>',
+        '<verb> <particle> <thing>',
+        '<verb> <thing> <particle>',
+        'LOOK <preposition> <thing>',
+        'WHAT IS <thing>',
+        'WHERE IS <thing>',
+        'WHATS <preposition> <thing>',
+        'SAY <command>',
+        'TALK TO <thing>',
+        'TELL <thing> <command>',
+        'SIT [DOWN]',
+        'SIT ON <thing>',
+    ],
+    'command': [
+        'AGAIN', 'INVENTORY', 'LOOK [AROUND]', 'SCORE', 'SAVE', 'RESTORE',
+        'RESTART', 'QUIT', 'VERBOSE', 'SUPERBRIEF', 'VERSION', 'WAIT', 'YES',
+        'NO', 'XYZZY', 'ZORK', 'HELLO', 'HI', 'SCREAM', 'YELL', 'LISTEN',
+        'JUMP', 'SWIM', 'DAMN', 'STAY', 'CLIMB', 'PLAY', 'GO BACK',
+        'COME BACK', 'EXIT', 'FALL', 'HIDE', 'PRESS ON', 'WADE', 'CLEAR',
+    ],
+    'move': ['GO', 'WALK', 'RUN', 'CLIMB', 'SLIDE', 'FORD'],
+    'direction': [
+        'NORTH', 'SOUTH', 'EAST', 'WEST', 'NORTHEAST', 'NORTHWEST',
+        'SOUTHEAST', 'SOUTHWEST', 'UP', 'DOWN', 'IN', 'OUT',
+    ],
+    'verb': [
+        'APPLY', 'ATTACK', 'BLOW', 'BREAK', 'BRUSH', 'CLEAN', 'CLIMB',
+        'CLOSE', 'CONSUME', 'COVER', 'CUT', 'DAMAGE', 'DESCRIBE', 'DESTROY',
+        'DIG', 'DISPATCH', 'DRINK', 'DROP', 'EAT', 'ENTER', 'EXAMINE',
+        'FEED', 'FEEL', 'FIGHT', 'FILL', 'FIND', 'FIX', 'FOLLOW', 'FORCE',
+        'FREE', 'GET', 'GIVE', 'GRAB', 'HIDE', 'HIT', 'HOLD', 'HURL', 'HURT',
+        'INJURE', 'INSERT', 'KICK', 'KILL', 'KISS', 'LEAVE', 'LIFT', 'LIGHT',
+        'LOCK', 'MOVE', 'OPEN', 'PET', 'PICK', 'PLACE', 'PLUG', 'POUR',
+        'PRESS', 'PULL', 'PUSH', 'PUT', 'RAISE', 'READ', 'REMOVE', 'RING',
+        'RUB', 'SEARCH', 'SEE', 'SEND', 'SET', 'SHUT', 'SLAY', 'SLICE',
+        'SMELL', 'SNIFF', 'SPILL', 'SPIN', 'STAB', 'STRIKE', 'SWALLOW',
+        'SWING', 'SWITCH', 'TAKE', 'TASTE', 'TAUNT', 'THROW', 'TIE', 'TOSS',
+        'TOUCH', 'UNLOCK', 'UNTIE', 'WAKE', 'WAVE', 'WEAR',
+    ],
+    # as in PICK UP, SWITCH ON
+    'particle': ['UP', 'DOWN', 'ON', 'OFF', 'OUT', 'IN', 'AWAY', 'BACK',
+                 'OVER'],
+    'preposition': [
+        'AT', 'BEHIND', 'BELOW', 'BENEATH', 'FROM', 'IN', 'INSIDE', 'INTO',
+        'ON', 'OFF', 'OUT', 'OVER', 'THRU', 'TO', 'UNDER', 'UNDERNEATH',
+        'WITH', 'FOR', 'AROUND', 'OF',
+    ],
+    'thing': [
+        '[<article>] [<adjective>] <object>',
+        '<pronoun>',
+        'ALL [BUT <object>]',
+    ],
+    'article': ['THE', 'A', 'AN'],
+    'pronoun': ['IT', 'THEM', 'ME', 'MYSELF', 'HERE'],
+    'adjective': [
+        'BLACK', 'BLOODY', 'BOARDED', 'BROKEN', 'BROWN', 'DARK', 'DEAD',
+        'ELVISH', 'ENCRUSTED', 'FIERCE', 'FINE', 'FRONT', 'GOLD', 'HUGE',
+        'OLD', 'SMALL', 'WOODEN', 'ONE',
+    ],
+    'object': [
+        'AXE', 'BAG', 'BAR', 'BASKET', 'BAT', 'BAUBLE', 'BELL', 'BIRD',
+        'BIRDSEED', 'BLADE', 'BLOCK', 'BOARD', 'BOARDS', 'BOLT', 'BOOK',
+        'BOOKLET', 'BOOKS', 'BOTTLE', 'BOX', 'BRANCH', 'BRUSH', 'CAGE',
+        'CANARY', 'CANDLE', 'CANVAS', 'CARPET', 'CASE', 'CASKET', 'CHIMNEY',
+        'CHUTE', 'CLIFF', 'COINS', 'CRACK', 'CRAWLWAY', 'CUP', 'DINNER',
+        'DIRT', 'DOOR', 'DUMBWAITER', 'EGG', 'FLOOR', 'FOOD', 'FOREST',
+        'FORK', 'GARLIC', 'GAS', 'GATE', 'GLASS', 'GLUE', 'GRATE', 'GROUND',
+        'GRUE', 'HAND', 'HANDS', 'HEAP', 'HOUSE', 'JEWEL', 'KEY', 'KITCHEN',
+        'KNIFE', 'LADDER', 'LAMP', 'LANTERN', 'LEAF', 'LEAFLET', 'LEAVES',
+        'LETTER', 'LIGHT', 'LIQUID', 'LUNCH', 'MAIL', 'MAILBOX', 'MAN', 'MAP',
+        'MATCH', 'MATCHBOOK', 'MIRROR', 'MOUTH', 'NAIL', 'NEST', 'PAPER',
+        'PASSAGE', 'PATH', 'PEPPER', 'PERSON', 'PINES', 'PIPE', 'PLUG',
+        'POT', 'RAMP', 'RIVER', 'ROPE', 'RUG', 'SACK', 'SANDWICH',
+        'STAIRCASE', 'STAIRS', 'STAIRWAY', 'STONE', 'STREAM', 'STUFF',
+        'SWITCH', 'SWORD', 'TABLE', 'TEETH', 'THIEF', 'TORCH', 'TRAIL',
+        'TRAP', 'TRAPDOOR', 'TREE', 'TREES', 'WALL', 'WATER', 'WINDOW',
+    ],
+}
+
 WORDS = [ 'PLAY', 'ZORK' ]
 # WORDS = ZORK_WORDS
 
@@ -0,0 +1,142 @@
+# -*- coding: utf-8-*-
+"""
+Continuous background noise estimation.
+
+The NoiseFloorTracker is fed with every block of audio the capture stream
+records. It scores the audio just like Mic does, averages the scores over
+short segments and takes a low percentile of the segments from the last
+minute as the noise floor. Speech and other short, loud noises only affect
+the upper segments, so the estimate follows the background noise without
+anybody having to stop and record a quiet second for it.
+"""
+import collections
+import threading
+import time
+
+import numpy as np
+
+import energy
+
+
+class NoiseFloorTracker(object):
+    """
+    Percentile based noise floor estimator for 16 bit mono PCM data.
+    """
+
+    def __init__(self, rate, chunk=32, segment_seconds=0.1, window_seconds=60,
+                 percentile=20, min_seconds=1, history_interval=10,
+                 history_size=360):
+        """
+        Arguments:
+            rate -- the sample rate in Hz
+            chunk -- (optional) the number of samples per score, see
+                     energy.frame_scores() (Default: 32)
+            segment_seconds -- (optional) the scores are averaged over
+                               segments of this length (Default: 0.1)
+            window_seconds -- (optional) how much audio the estimate is
+                              based on (Default: 60)
+            percentile -- (optional) the percentile of the segment averages
+                          taken as the noise floor (Default: 20)
+            min_seconds -- (optional) how much audio is needed before there
+                           is an estimate (Default: 1)
+            history_interval -- (optional) seconds between the entries of
+                                the history (Default: 10)
+            history_size -- (optional) the number of history entries kept
+                            (Default: 360, i.e. an hour)
+        """
+        self.rate = rate
+        self.chunk = chunk
+        self.percentile = percentile
+        self.history_interval = history_interval
+        self._segment_scores = max(1, int(segment_seconds * rate / chunk))
+        self._min_segments = max(1, int(min_seconds / segment_seconds))
+        self._segments = np.zeros(max(self._min_segments,
+                                      int(window_seconds / segment_seconds)))
+        self._index = 0
+        self._filled = 0
+        # scores of the current, incomplete segment
+        self._sum = 0
+        self._count = 0
+        # leftover samples that didn't make a complete chunk
+        self._pending = np.zeros(0, dtype='<i2')
+        self._estimate = None
+        self._dirty = False
+        self._last_history = None
+        self._history = collections.deque(maxlen=history_size)
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def push(self, data):
+        """
+        Adds a block of captured audio. This is cheap enough to be called
+        from the PyAudio callback.
+
+        Arguments:
+            data -- a byte string of 16 bit little-endian PCM data, or a
+                    NumPy array of its samples (which isn't kept)
+        """
+        samples = data
+        if not isinstance(data, np.ndarray):
+            samples = np.frombuffer(data, dtype='<i2')
+        if len(self._pending):
+            samples = np.concatenate((self._pending, samples))
+        n = len(samples) // self.chunk * self.chunk
+        # copy the leftover, the array may point into the capture ring
+        self._pending = samples[n:].copy()
+        scores = energy.frame_scores(samples[:n], self.chunk)
+        while len(scores):
+            take = min(len(scores), self._segment_scores - self._count)
+            self._sum += int(scores[:take].sum())
+            self._count += take
+            scores = scores[take:]
+            if self._count == self._segment_scores:
+                self._add_segment(self._sum / float(self._count))
+                self._sum = 0
+                self._count = 0
+
+    def _add_segment(self, average):
+        with self._lock:
+            self._segments[self._index] = average
+            self._index = (self._index + 1) % len(self._segments)
+            self._filled = min(self._filled + 1, len(self._segments))
+            self._dirty = True
+        if self._filled < self._min_segments:
+            return
+        self._ready.set()
+        now = time.time()
+        if (self._last_history is None or
+           now - self._last_history >= self.history_interval):
+            self._last_history = now
+            self._history.append((now, self.estimate))
+
+    @property
+    def estimate(self):
+        """
+        The current noise floor (in the units of energy.frame_scores()), or
+        None if not enough audio has been seen yet.
+        """
+        with self._lock:
+            if self._dirty:
+                self._dirty = False
+                if self._filled >= self._min_segments:
+                    self._estimate = float(np.percentile(
+                        self._segments[:self._filled], self.percentile))
+            return self._estimate
+
+    @property
+    def history(self):
+        """
+        A list of (timestamp, estimate) tuples, oldest first, one every
+        history_interval seconds.
+        """
+        return list(self._history)
+
+    def wait(self, timeout=None):
+        """
+        Waits until there is an estimate.
+
+        Returns:
+            The current estimate, or None on timeout
+        """
+        self._ready.wait(timeout)
+        return self.estimate
@@ -0,0 +1,237 @@
+# -*- coding: utf-8-*-
+"""
+In-process sample rate conversion for 16 bit mono PCM.
+
+The Resampler converts between any pair of integer sample rates with a
+polyphase FIR filter (a Kaiser-windowed sinc), vectorized with NumPy. It
+works on in-memory byte strings and keeps enough state to be fed audio
+block by block, so Mic no longer has to write a WAV file and fork sox for
+every utterance.
+"""
+import fractions
+import threading
+
+import numpy as np
+
+
+class Resampler(object):
+    """
+    Streaming rational resampler.
+
+    Feed it blocks of PCM data with process() and call flush() once the
+    input has ended to get the remaining samples. The total output length
+    is ceil(input_length * to_rate / from_rate) samples, aligned with the
+    input (the filter delay is compensated).
+    """
+
+    # maximum number of output samples computed in one vectorized step
+    BLOCK = 4096
+
+    def __init__(self, from_rate, to_rate, zero_crossings=16, rolloff=0.945,
+                 beta=8.6):
+        """
+        Arguments:
+            from_rate -- the input sample rate in Hz
+            to_rate -- the output sample rate in Hz
+            zero_crossings -- (optional) number of sinc zero crossings on
+                              each side of the filter; more is sharper but
+                              slower (Default: 16)
+            rolloff -- (optional) cutoff frequency relative to the lower
+                       Nyquist frequency (Default: 0.945)
+            beta -- (optional) Kaiser window shape parameter (Default: 8.6)
+        """
+        self.from_rate = int(from_rate)
+        self.to_rate = int(to_rate)
+        gcd = fractions.gcd(self.from_rate, self.to_rate)
+        self.up = self.to_rate // gcd
+        self.down = self.from_rate // gcd
+        self._filters = self._design(zero_crossings, rolloff, beta)
+        self.taps = self._filters.shape[1]
+        # the filter is centered on this (upsampled) index
+        self._delay = zero_crossings * max(self.up, self.down)
+        self.reset()
+
+    def _design(self, zero_crossings, rolloff, beta):
+        """
+        Returns:
+            The polyphase filter bank as an (up, taps) array, where row p
+            holds the coefficients h[p], h[p + up], h[p + 2 * up], ...
+        """
+        factor = max(self.up, self.down)
+        cutoff = rolloff * 0.5 / factor
+        half = zero_crossings * factor
+        t = np.arange(-half, half + 1, dtype=np.float64)
+        h = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(len(t), beta)
+        h *= self.up
+        taps = -(-len(h) // self.up)
+        padded = np.zeros(taps * self.up)
+        padded[:len(h)] = h
+        return padded.reshape(taps, self.up).T.copy()
+
+    def reset(self):
+        """
+        Forgets all buffered input, so the resampler can be reused for a
+        new, unrelated stream.
+        """
+        # input samples still needed, starting at absolute index _offset;
+        # samples before the start of the stream count as silence
+        self._buffer = np.zeros(self.taps - 1)
+        self._offset = -(self.taps - 1)
+        self._consumed = 0
+        self._produced = 0
+
+    def _input_index(self, n):
+        return (n * self.down + self._delay) // self.up
+
+    def _run(self, samples):
+        self._buffer = np.concatenate((self._buffer, samples))
+        last = self._offset + len(self._buffer) - 1
+        # number of output samples whose newest input sample is available
+        count = max(0, (last * self.up + self.up - 1 - self._delay) //
+                    self.down + 1 - self._produced)
+        out = np.empty(count)
+        k = np.arange(self.taps)
+        for start in range(0, count, self.BLOCK):
+            n = np.arange(self._produced + start,
+                          self._produced + min(count, start + self.BLOCK))
+            pos = n * self.down + self._delay
+            phase = pos % self.up
+            base = pos // self.up - self._offset
+            window = self._buffer[base[:, np.newaxis] - k]
+            out[start:start + len(n)] = (window *
+                                         self._filters[phase]).sum(axis=1)
+        self._produced += count
+        # drop input that no future output sample depends on
+        keep = self._input_index(self._produced) - (self.taps - 1)
+        if keep > self._offset:
+            self._buffer = self._buffer[keep - self._offset:]
+            self._offset = keep
+        return out
+
+    @staticmethod
+    def _to_pcm(samples):
+        return np.clip(np.round(samples), -32768, 32767).astype('<i2')
+
+    def process(self, data):
+        """
+        Resamples the next block of input.
+
+        Arguments:
+            data -- 16 bit little-endian PCM data (a byte string or anything
+                    supporting the buffer protocol)
+
+        Returns:
+            The resampled PCM data that is available so far, as bytes
+        """
+        samples = np.frombuffer(data, dtype='<i2')
+        if self.up == self.down:
+            return samples.tostring()
+        self._consumed += len(samples)
+        return self._to_pcm(self._run(samples.astype(np.float64))).tostring()
+
+    def flush(self):
+        """
+        Marks the end of the input.
+
+        Returns:
+            The remaining resampled PCM data, as bytes
+        """
+        if self.up == self.down:
+            return ''
+        total = -(-self._consumed * self.up // self.down)
+        # pad with enough silence to compute every remaining output sample
+        out = self._run(np.zeros(self.taps))
+        out = out[:max(0, total - (self._produced - len(out)))]
+        self.reset()
+        return self._to_pcm(out).tostring()
+
+
+_resamplers = {}
+_resamplers_lock = threading.Lock()
+
+
+def resample(data, from_rate, to_rate):
+    """
+    Resamples a complete block of 16 bit mono PCM data.
+
+    Arguments:
+        data -- the PCM data (bytes)
+        from_rate -- the sample rate of data in Hz
+        to_rate -- the sample rate to convert to in Hz
+
+    Returns:
+        The resampled PCM data as bytes
+    """
+    if from_rate == to_rate:
+        return bytes(data)
+    key = (from_rate, to_rate)
+    with _resamplers_lock:
+        if key not in _resamplers:
+            # designing the filter bank is the expensive part, so keep it
+            _resamplers[key] = Resampler(from_rate, to_rate)
+        resampler = _resamplers[key]
+        resampler.reset()
+        return resampler.process(data) + resampler.flush()
+
+
+if __name__ == '__main__':
+    import argparse
+    import os
+    import subprocess
+    import tempfile
+    import time
+    import wave
+
+    import diagnose
+
+    parser = argparse.ArgumentParser(description='Resampler benchmark')
+    parser.add_argument('--seconds', type=float, default=5,
+                        help='seconds of audio per utterance')
+    parser.add_argument('--from-rate', type=int, default=44100)
+    parser.add_argument('--to-rate', type=int, default=16000)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    pcm = rng.normal(0, 2000, int(args.seconds * args.from_rate))
+    pcm = Resampler._to_pcm(pcm).tostring()
+
+    def in_process():
+        return resample(pcm, args.from_rate, args.to_rate)
+
+    def with_sox():
+        # what Mic used to do: write a WAV, fork sox, read the result back
+        with tempfile.NamedTemporaryFile(suffix='.wav') as f:
+            wav_fp = wave.open(f, 'wb')
+            wav_fp.setnchannels(1)
+            wav_fp.setsampwidth(2)
+            wav_fp.setframerate(args.from_rate)
+            wav_fp.writeframes(pcm)
+            wav_fp.close()
+            f.flush()
+            ofd, ofn = tempfile.mkstemp(suffix='.wav')
+            os.close(ofd)
+            with open(os.devnull, 'w') as devnull:
+                subprocess.call(['sox', f.name, ofn, 'rate',
+                                 str(args.to_rate)],
+                                stdout=devnull, stderr=devnull)
+            wav_fp = wave.open(ofn, 'rb')
+            data = wav_fp.readframes(wav_fp.getnframes())
+            wav_fp.close()
+            os.remove(ofn)
+            return data
+
+    benchmarks = [('in-process', in_process)]
+    if diagnose.check_executable('sox'):
+        benchmarks.append(('sox', with_sox))
+    else:
+        print("sox not found, only benchmarking the in-process resampler")
+
+    in_process()  # filter design is a one-time cost
+    for name, func in benchmarks:
+        start = time.time()
+        for i in range(args.runs):
+            func()
+        elapsed = (time.time() - start) / args.runs
+        print("%-10s %7.1f ms per %.1f s utterance" %
+              (name, 1000 * elapsed, args.seconds))
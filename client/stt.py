@@ -9,14 +9,89 @@ import urllib
 import urlparse
 import re
 import subprocess
+import audioop
+import StringIO
+import Queue
+import collections
+import copy
+import math
+import socket
+import struct
+import threading
+import time
 from abc import ABCMeta, abstractmethod
+from multiprocessing.pool import ThreadPool
 import requests
 import yaml
 import jasperpath
 import diagnose
+import flac
+import grammar
+import httpsession
+import modulecache
+import resampler
 import vocabcompiler
 
 
+def pcm_to_bytes(buffer, width=2):
+    """
+    Converts a buffer of mono PCM audio to a byte string of 16 bit samples.
+
+    Arguments:
+        buffer -- the audio as bytes, bytearray, memoryview or NumPy array
+        width -- (optional) the sample width of buffer in bytes (Default: 2)
+
+    Returns:
+        The audio as a byte string of 16 bit little-endian samples
+    """
+    if hasattr(buffer, 'tobytes'):
+        # memoryview or NumPy array
+        data = buffer.tobytes()
+    else:
+        data = bytes(buffer)
+    if width != 2:
+        data = audioop.lin2lin(data, width, 2)
+    return data
+
+
+def pcm_to_wav(data, rate):
+    """
+    Wraps 16 bit mono PCM data in a WAV container, in memory.
+
+    Returns:
+        The WAV file contents as a byte string
+    """
+    f = StringIO.StringIO()
+    wav_fp = wave.open(f, 'wb')
+    wav_fp.setnchannels(1)
+    wav_fp.setsampwidth(2)
+    wav_fp.setframerate(rate)
+    wav_fp.writeframes(data)
+    wav_fp.close()
+    return f.getvalue()
+
+
+class Hypothesis(str):
+    """
+    A transcription with the confidence of the STT engine in it.
+
+    It is a str, so modules handle it like any other text; engines that
+    know how likely their candidates are return them as Hypotheses.
+    """
+
+    def __new__(cls, text, confidence=None):
+        hypothesis = super(Hypothesis, cls).__new__(cls, text)
+        # between 0 and 1, or None if unknown
+        hypothesis.confidence = confidence
+        return hypothesis
+
+    def __repr__(self):
+        if self.confidence is None:
+            return super(Hypothesis, self).__repr__()
+        return '%s (%.2f)' % (super(Hypothesis, self).__repr__(),
+                              self.confidence)
+
+
 class AbstractSTTEngine(object):
     """
     Generic parent class for all STT engines
@@ -24,6 +99,12 @@ class AbstractSTTEngine(object):
 
     __metaclass__ = ABCMeta
     VOCABULARY_TYPE = None
+    # True if the engine decodes audio incrementally as it is fed to it
+    # with start_stream()/feed()/finish()
+    SUPPORTS_STREAMING = False
+    # the bytes of memory an instance took up that close() frees again, if
+    # the engine can tell (e.g. for the Brain's module cache)
+    resident_bytes = None
 
     @classmethod
     def get_config(cls):
@@ -54,9 +135,39 @@ class AbstractSTTEngine(object):
 
     @classmethod
     def get_module_instance(cls, module):
-        phrases = sorted(list(set(vocabcompiler.get_instance_phrases_from_module(module))))
+        # a grammar, if the module has one, narrows down what is expected
+        phrases = vocabcompiler.get_grammar_from_module(module)
+        if phrases is None:
+            phrases = sorted(list(set(vocabcompiler.get_instance_phrases_from_module(module))))
         return cls.get_instance('instance-' + module.__name__, phrases)
 
+    @classmethod
+    def get_choices_instance(cls, choices):
+        """
+        Returns an instance that only recognizes one of the choices (e.g.
+        YES or NO), for prompts with a handful of valid answers.
+
+        A vocabulary of just the choices makes every utterance come out as
+        one of them, so only engines that can also reject an utterance as
+        none of them override this. The others keep listening with their
+        whole vocabulary.
+
+        Arguments:
+            choices -- the phrases to choose from
+
+        Returns:
+            The instance, or None if the engine can't be narrowed down
+        """
+        return None
+
+    @classmethod
+    def _get_grammar_instance(cls, choices):
+        # an instance with a grammar of the choices, compiled once
+        phrases = grammar.Grammar({grammar.START: sorted(set(choices))})
+        revision = vocabcompiler.AbstractVocabulary.phrases_to_revision(
+            phrases)
+        return cls.get_instance('choices-' + revision[:12], phrases)
+
     @classmethod
     @abstractmethod
     def is_available(cls):
@@ -66,40 +177,193 @@ class AbstractSTTEngine(object):
     def transcribe(self, fp):
         pass
 
+    def transcribe_pcm(self, buffer, rate, width=2):
+        """
+        Performs STT on mono PCM audio that is already in memory.
 
-class PocketSphinxSTT(AbstractSTTEngine):
+        This default implementation wraps the audio in a WAV file and passes
+        it to transcribe(), so engines that only implement transcribe() keep
+        working. Engines should override it to avoid the copy.
+
+        Arguments:
+            buffer -- the audio as bytes, bytearray, memoryview or NumPy array
+            rate -- the sample rate in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        data = pcm_to_bytes(buffer, width)
+        # a SpooledTemporaryFile stays in memory unless the engine needs a
+        # real file descriptor
+        with tempfile.SpooledTemporaryFile(max_size=len(data) + 1024) as f:
+            f.write(pcm_to_wav(data, rate))
+            f.seek(0)
+            return self.transcribe(f)
+
+    def start_stream(self, rate, width=2):
+        """
+        Starts a streaming transcription. Audio is then passed in with
+        feed() while it is being captured, and finish() returns the result.
+
+        This default implementation just collects the audio and transcribes
+        it with transcribe_pcm() in finish(). Engines that can decode
+        incrementally override these methods and set SUPPORTS_STREAMING.
+
+        Arguments:
+            rate -- the sample rate of the audio in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        self._stream_format = (rate, width)
+        self._stream_buffers = []
+
+    def feed(self, chunk):
+        """
+        Passes the next chunk of audio of a streaming transcription.
+        """
+        self._stream_buffers.append(pcm_to_bytes(chunk,
+                                                 self._stream_format[1]))
+
+    def partial(self):
+        """
+        Returns:
+            The current partial hypothesis of a streaming transcription, or
+            None if the engine doesn't provide one
+        """
+        return None
+
+    def finish(self):
+        """
+        Ends a streaming transcription.
+
+        Returns:
+            The transcription, just like transcribe_pcm()
+        """
+        data = ''.join(self._stream_buffers)
+        self._stream_buffers = None
+        return self.transcribe_pcm(data, self._stream_format[0])
+
+    def abort(self):
+        """
+        Ends a streaming transcription, discarding its audio.
+        """
+        self._stream_buffers = None
+
+    def close(self):
+        """
+        Frees what the engine holds on to that the garbage collector can't,
+        e.g. when a module's engine is evicted from the Brain's cache. The
+        engine can't be used afterwards.
+        """
+        pass
+
+
+class PocketSphinxLog(object):
     """
-    The default Speech-to-Text implementation which relies on PocketSphinx.
+    An in-memory sink for the log of PocketSphinx.
+
+    PocketSphinx can only log to a file, so it is given the write end of a
+    pipe (as /dev/fd/N), which a thread drains. The messages are kept in a
+    bounded ring for diagnostics and passed to the logger only if debug
+    logging is enabled, so nothing is written to disk and no decoding has
+    to wait for the log to be read.
+
+    PocketSphinx has a single log per process, so there is only one sink;
+    use PocketSphinxLog.get_instance() to get it.
     """
 
-    SLUG = 'sphinx'
-    VOCABULARY_TYPE = vocabcompiler.PocketsphinxVocabulary
+    _instance = None
+    _instance_lock = threading.Lock()
 
-    def __init__(self, vocabulary, hmm_dir="/usr/share/" +
-                 "pocketsphinx/model/hmm/en_US/hub4wsj_sc_8k"):
+    # the number of recent messages kept
+    MAX_MESSAGES = 500
+
+    @classmethod
+    def get_instance(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
 
+    def __init__(self, max_messages=None):
         """
-        Initiates the pocketsphinx instance.
+        Arguments:
+            max_messages -- (optional) the number of recent messages kept
+                            (Default: MAX_MESSAGES)
+        """
+        self._logger = logging.getLogger(__name__)
+        self._messages = collections.deque(
+            maxlen=max_messages or self.MAX_MESSAGES)
+        if not os.path.isdir('/dev/fd'):
+            self._logger.debug("Can't capture the PocketSphinx log on " +
+                               "this system, discarding it")
+            self.path = os.devnull
+            return
+        read_fd, self._write_fd = os.pipe()
+        self.path = '/dev/fd/%d' % self._write_fd
+        thread = threading.Thread(target=self._run,
+                                  args=(os.fdopen(read_fd, 'r'),),
+                                  name='pocketsphinx log')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, pipe):
+        for line in iter(pipe.readline, ''):
+            line = line.rstrip()
+            if not line:
+                continue
+            self._messages.append(line)
+            if self._logger.isEnabledFor(logging.DEBUG):
+                self._logger.debug('pocketsphinx: %s', line)
 
+    @property
+    def messages(self):
+        """
+        The recent messages of PocketSphinx, oldest first.
+        """
+        return list(self._messages)
+
+
+class PocketSphinxDecoder(object):
+    """
+    A pocketsphinx.Decoder shared by all PocketSphinxSTT instances using the
+    same acoustic model. Loading the model is what takes most of the time
+    and memory, so it is loaded once, and every vocabulary (the passive and
+    active ones and one per module) is registered as a named search of the
+    decoder, whose words are added to its dictionary. Selecting a search
+    before an utterance is cheap.
+
+    With PocketSphinx versions that don't have named searches yet, every
+    search gets a decoder of its own instead.
+
+    Use PocketSphinxDecoder.get_instance() to get the shared instance for
+    an acoustic model. The lock has to be held from selecting a search
+    until the end of the utterance.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls, hmm_dir):
+        with cls._instances_lock:
+            if hmm_dir not in cls._instances:
+                cls._instances[hmm_dir] = cls(hmm_dir)
+            return cls._instances[hmm_dir]
+
+    def __init__(self, hmm_dir):
+        """
         Arguments:
-            vocabulary -- a PocketsphinxVocabulary instance
             hmm_dir -- the path of the Hidden Markov Model (HMM)
         """
-
         self._logger = logging.getLogger(__name__)
 
         # quirky bug where first import doesn't work
         try:
             import pocketsphinx as ps
-        except:
+        except Exception:
             import pocketsphinx as ps
+        self._ps = ps
 
-        with tempfile.NamedTemporaryFile(prefix='psdecoder_',
-                                         suffix='.log', delete=False) as f:
-            self._logfile = f.name
-
-        self._logger.debug("Initializing PocketSphinx Decoder with hmm_dir " +
-                           "'%s'", hmm_dir)
+        self.log = PocketSphinxLog.get_instance()
+        self.logfile = self.log.path
 
         # Perform some checks on the hmm_dir so that we can display more
         # meaningful error messages if neccessary
@@ -127,11 +391,286 @@ class PocketSphinxSTT(AbstractSTTEngine):
                                  "hmm_dir in your profile.",
                                  hmm_dir, ', '.join(missing_hmm_files))
 
-        self._decoder = ps.Decoder(hmm=hmm_dir, logfn=self._logfile,
-                                   **vocabulary.decoder_kwargs)
+        self.hmm_dir = hmm_dir
+        self.named_searches = hasattr(ps.Decoder, 'set_search')
+        # how a named search is dropped again, depending on the version
+        self._remove_method = None
+        for method in ('remove_search', 'unset_search'):
+            if hasattr(ps.Decoder, method):
+                self._remove_method = method
+                break
+        # True if remove_search() frees the memory of a search
+        self.frees_searches = (not self.named_searches or
+                               self._remove_method is not None)
+        self.lock = threading.RLock()
+        # the decoder of the selected search
+        self.decoder = None
+        # (lm, grammar or keyphrase file, dict) of every search, by name
+        self._searches = {}
+        # the growth of the resident memory when a search was added
+        self._sizes = {}
+        # the decoder of every search, without named searches
+        self._decoders = {}
+        self._selected = None
+
+    def add_search(self, name, lm, dictionary):
+        """
+        Registers a language model and its dictionary as a named search.
+        Registering a search again with the same files does nothing.
+        """
+        self._add_search(name, 'lm', lm, dictionary)
+
+    def add_grammar_search(self, name, jsgf, dictionary):
+        """
+        Registers a JSGF grammar and its dictionary as a named search,
+        which the decoder compiles to a finite state grammar.
+        """
+        self._add_search(name, 'jsgf', jsgf, dictionary)
+
+    def add_keyphrase_search(self, name, kws, dictionary):
+        """
+        Registers a keyphrase file (one phrase per line, each with its
+        detection threshold, e.g. 'JASPER /1e-20/') as a named search,
+        which spots the phrases in audio of any length. The words of the
+        phrases have to be in the dictionary.
+
+        Raises:
+            RuntimeError if this PocketSphinx version has no named searches,
+            which it got along with the keyphrase search
+        """
+        if not self.named_searches:
+            raise RuntimeError("This version of PocketSphinx has no " +
+                               "keyphrase search")
+        self._add_search(name, 'kws', kws, dictionary)
+
+    def _add_search(self, name, kind, path, dictionary):
+        with self.lock:
+            if self._searches.get(name) == (path, dictionary):
+                return
+            self._logger.debug("Adding search '%s' to the PocketSphinx " +
+                               "decoder", name)
+            # nothing else decodes meanwhile, which would allocate as well
+            before = modulecache.resident_bytes()
+            if not self.named_searches:
+                kwargs = {kind: path}
+                self._decoders[name] = self._create_decoder(
+                    hmm=self.hmm_dir, logfn=self.logfile, dict=dictionary,
+                    **kwargs)
+            elif self.decoder is None:
+                self._logger.debug("Initializing PocketSphinx Decoder " +
+                                   "with hmm_dir '%s'", self.hmm_dir)
+                config = self._ps.Decoder.default_config()
+                config.set_string('-hmm', self.hmm_dir)
+                config.set_string('-dict', dictionary)
+                config.set_string('-logfn', self.logfile)
+                self.decoder = self._create_decoder(config)
+            else:
+                self._add_words(dictionary)
+            if self.named_searches:
+                setters = {'lm': self.decoder.set_lm_file,
+                           'jsgf': self.decoder.set_jsgf_file,
+                           'kws': self.decoder.set_kws}
+                setters[kind](name, path)
+            self._searches[name] = (path, dictionary)
+            after = modulecache.resident_bytes()
+            if before is not None and after is not None:
+                self._sizes[name] = max(0, after - before)
+            if self._selected == name:
+                # the search has been replaced, select it again
+                self._selected = None
+
+    def _create_decoder(self, *args, **kwargs):
+        try:
+            return self._ps.Decoder(*args, **kwargs)
+        except Exception:
+            # the reason is in the log, which may not be logged
+            self._logger.error("Failed to create the PocketSphinx " +
+                               "decoder. Its last messages were:\n%s",
+                               '\n'.join(self.log.messages[-20:]))
+            raise
+
+    def _add_words(self, dictionary):
+        words = []
+        with open(dictionary, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if (len(fields) >= 2 and
+                   self.decoder.lookup_word(fields[0]) is None):
+                    words.append((fields[0], ' '.join(fields[1:])))
+        # only rebuild the searches after the last word
+        for i, (word, phones) in enumerate(words):
+            self.decoder.add_word(word, phones, i == len(words) - 1)
+
+    def search_size(self, name):
+        """
+        Returns:
+            The growth of the resident memory when the search was added in
+            bytes, or None if unknown
+        """
+        return self._sizes.get(name)
+
+    def remove_search(self, name):
+        """
+        Forgets a search and frees its memory. Without named searches, this
+        frees its decoder. A named search is removed from the decoder if
+        its version can do that (see frees_searches); otherwise it stays in
+        the decoder, but is replaced when it is added again.
+        """
+        with self.lock:
+            if self._searches.pop(name, None) is None:
+                return
+            self._sizes.pop(name, None)
+            self._decoders.pop(name, None)
+            if self._selected == name:
+                self._selected = None
+                if not self.named_searches:
+                    self.decoder = None
+            if self.named_searches and self._remove_method is not None:
+                getattr(self.decoder, self._remove_method)(name)
+
+    def hypothesis(self):
+        """
+        Returns:
+            The best hypothesis of the current utterance, or None
+        """
+        if hasattr(self.decoder, 'hyp'):
+            hyp = self.decoder.hyp()
+            return hyp.hypstr if hyp is not None else None
+        result = self.decoder.get_hyp()
+        return result[0] if result else None
+
+    def posterior(self):
+        """
+        Returns:
+            The posterior probability of the best hypothesis of the finished
+            utterance in the decoder's log units, or None if the decoder
+            can't tell
+        """
+        if hasattr(self.decoder, 'hyp'):
+            hyp = self.decoder.hyp()
+            return getattr(hyp, 'prob', None) if hyp is not None else None
+        if hasattr(self.decoder, 'get_prob'):
+            return self.decoder.get_prob()
+        return None
+
+    def nbest(self, n):
+        """
+        Returns:
+            Up to n (text, score) tuples of the best distinct hypotheses of
+            the finished utterance, best first. The scores are the
+            decoder's path scores (in log units). Decoders without N-best
+            support only return the best hypothesis, with a score of None.
+        """
+        if n > 1 and hasattr(self.decoder, 'nbest'):
+            best = {}
+            try:
+                for i, entry in enumerate(self.decoder.nbest()):
+                    if i >= 4 * n:
+                        # the rest are mostly different fillers
+                        break
+                    text = (entry.hypstr or '').strip()
+                    if text not in best:
+                        best[text] = entry.score
+            except RuntimeError:
+                # there is no lattice, e.g. for an empty utterance
+                best = {}
+            if best:
+                return sorted(best.items(), key=lambda x: -x[1])[:n]
+        return [(self.hypothesis(), None)]
+
+    def select(self, name):
+        """
+        Makes a search the one the next utterance is decoded with. Call it
+        with the lock held.
+        """
+        if self._selected == name:
+            return
+        if self.named_searches:
+            self.decoder.set_search(name)
+        else:
+            self.decoder = self._decoders[name]
+        self._selected = name
+
+
+class PocketSphinxSTT(AbstractSTTEngine):
+    """
+    The default Speech-to-Text implementation which relies on PocketSphinx.
+    """
+
+    SLUG = 'sphinx'
+    VOCABULARY_TYPE = vocabcompiler.PocketsphinxVocabulary
+    SUPPORTS_STREAMING = True
+    # the sample rate the acoustic models expect
+    SAMPLE_RATE = 16000
 
-    def __del__(self):
-        os.remove(self._logfile)
+    # the base of the logarithms of the decoder's scores (its -logbase)
+    LOG_BASE = 1.0001
+    # the min_confidence of an instance recognizing one of a few choices:
+    # anything said fits one of them somewhat, so the decoder has to be
+    # surer that it was one of them
+    CHOICES_MIN_CONFIDENCE = 0.5
+
+    def __init__(self, vocabulary, hmm_dir="/usr/share/" +
+                 "pocketsphinx/model/hmm/en_US/hub4wsj_sc_8k", nbest=5,
+                 min_confidence=0.05):
+
+        """
+        Initiates the pocketsphinx instance. All instances share a decoder,
+        see PocketSphinxDecoder.
+
+        Arguments:
+            vocabulary -- a PocketsphinxVocabulary instance
+            hmm_dir -- the path of the Hidden Markov Model (HMM)
+            nbest -- (optional) the number of hypotheses returned at most
+                     (Default: 5)
+            min_confidence -- (optional) hypotheses less likely than this
+                              are dropped, even the best one
+                              (Default: 0.05)
+        """
+
+        self._logger = logging.getLogger(__name__)
+        self.nbest = nbest
+        self.min_confidence = min_confidence
+        self._shared = PocketSphinxDecoder.get_instance(hmm_dir)
+        self._search = vocabulary.name
+        kwargs = vocabulary.decoder_kwargs
+        self._dictionary = kwargs['dict']
+        if 'jsgf' in kwargs:
+            self._shared.add_grammar_search(self._search, kwargs['jsgf'],
+                                            kwargs['dict'])
+        else:
+            self._shared.add_search(self._search, kwargs['lm'],
+                                    kwargs['dict'])
+
+    @property
+    def _decoder(self):
+        return self._shared.decoder
+
+    def close(self):
+        self._shared.remove_search(self._search)
+
+    @property
+    def resident_bytes(self):
+        """
+        The memory the search of the engine took up, or 0 if close() can't
+        free it with this version of PocketSphinx.
+        """
+        if not self._shared.frees_searches:
+            return 0
+        return self._shared.search_size(self._search)
+
+    @classmethod
+    def get_choices_instance(cls, choices):
+        """
+        Returns an instance with a grammar of just the choices, which
+        decodes much faster than the vocabulary of a module. If the
+        posterior of the best choice is below CHOICES_MIN_CONFIDENCE (or a
+        higher min_confidence), it transcribes an empty string instead.
+        """
+        instance = cls._get_grammar_instance(choices)
+        instance.min_confidence = max(instance.min_confidence,
+                                      cls.CHOICES_MIN_CONFIDENCE)
+        return instance
 
     @classmethod
     def get_config(cls):
@@ -144,10 +683,10 @@ class PocketSphinxSTT(AbstractSTTEngine):
         if os.path.exists(profile_path):
             with open(profile_path, 'r') as f:
                 profile = yaml.safe_load(f)
-                try:
-                    config['hmm_dir'] = profile['pocketsphinx']['hmm_dir']
-                except KeyError:
-                    pass
+                if 'pocketsphinx' in profile:
+                    for key in ('hmm_dir', 'nbest', 'min_confidence'):
+                        if key in profile['pocketsphinx']:
+                            config[key] = profile['pocketsphinx'][key]
 
         return config
 
@@ -164,41 +703,501 @@ class PocketSphinxSTT(AbstractSTTEngine):
         # FIXME: Can't use the Decoder.decode_raw() here, because
         # pocketsphinx segfaults with tempfile.SpooledTemporaryFile()
         data = fp.read()
-        self._decoder.start_utt()
-        self._decoder.process_raw(data, False, True)
-        self._decoder.end_utt()
+        return self._decode(data)
 
-        result = self._decoder.get_hyp()
-        with open(self._logfile, 'r+') as f:
-            for line in f:
-                self._logger.debug(line.strip())
-            f.truncate()
+    def transcribe_pcm(self, buffer, rate, width=2):
+        """
+        Performs STT on in-memory audio, resampling it if necessary.
+
+        Arguments:
+            buffer -- the audio as bytes, bytearray, memoryview or NumPy array
+            rate -- the sample rate in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        data = pcm_to_bytes(buffer, width)
+        if rate != self.SAMPLE_RATE:
+            data = resampler.resample(data, rate, self.SAMPLE_RATE)
+        return self._decode(data)
+
+    def _decode(self, data):
+        with self._shared.lock:
+            self._shared.select(self._search)
+            self._decoder.start_utt()
+            self._decoder.process_raw(data, False, True)
+            self._decoder.end_utt()
+            return self._get_transcription()
+
+    def start_stream(self, rate, width=2):
+        """
+        Starts an utterance that is decoded incrementally while audio is
+        passed in with feed(), so that finish() only has to decode the last
+        chunk.
+
+        Arguments:
+            rate -- the sample rate of the audio in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        self._stream_width = width
+        self._stream_resampler = None
+        if rate != self.SAMPLE_RATE:
+            self._stream_resampler = resampler.Resampler(rate,
+                                                         self.SAMPLE_RATE)
+        # the search stays selected until finish() or abort()
+        self._shared.lock.acquire()
+        try:
+            self._shared.select(self._search)
+            self._decoder.start_utt()
+        except Exception:
+            self._shared.lock.release()
+            raise
+
+    def feed(self, chunk):
+        data = pcm_to_bytes(chunk, self._stream_width)
+        if self._stream_resampler is not None:
+            data = self._stream_resampler.process(data)
+        if data:
+            self._decoder.process_raw(data, False, False)
+
+    def partial(self):
+        return self._shared.hypothesis()
+
+    def finish(self):
+        try:
+            if self._stream_resampler is not None:
+                data = self._stream_resampler.flush()
+                if data:
+                    self._decoder.process_raw(data, False, False)
+            self._decoder.end_utt()
+            return self._get_transcription()
+        finally:
+            self._shared.lock.release()
+
+    def abort(self):
+        try:
+            self._decoder.end_utt()
+        finally:
+            self._shared.lock.release()
 
-        transcribed = [result[0]]
+    def _get_transcription(self):
+        """
+        Returns:
+            The N-best hypotheses of the finished utterance as Hypotheses,
+            best first. The confidence of the best one is its posterior
+            probability from the decoder, those of the others are scaled
+            down from it by their path scores. Hypotheses below
+            min_confidence are dropped, so if the decoder isn't sure of any
+            of them, the result is an empty transcription. Without a
+            posterior, the confidences are unknown and nothing is dropped.
+        """
+        results = self._shared.nbest(self.nbest)
+        prob = self._shared.posterior()
+        if prob is None:
+            transcribed = [Hypothesis(text or '') for text, score in results]
+        else:
+            best = results[0][1]
+            confidence = math.exp(min(prob, 0) * math.log(self.LOG_BASE))
+            transcribed = []
+            for text, score in results:
+                if score is not None:
+                    # the path scores only tell the hypotheses apart
+                    weight = math.exp((score - best) *
+                                      math.log(self.LOG_BASE))
+                else:
+                    weight = 1.0
+                if confidence * weight >= self.min_confidence:
+                    transcribed.append(Hypothesis(text or '',
+                                                  confidence * weight))
+            if not transcribed:
+                transcribed.append(Hypothesis(''))
         self._logger.info('Transcribed: %r', transcribed)
         return transcribed
 
+    def keyword_spotter(self, keyphrases):
+        """
+        Returns:
+            A KeywordSpotter for keyphrases on the decoder of this engine,
+            whose vocabulary has to contain their words
+
+        Arguments:
+            keyphrases -- a dict of the detection thresholds, by phrase
+        """
+        path = os.path.join(os.path.dirname(self._dictionary), 'keyphrases')
+        return KeywordSpotter(self._shared, self._search + '-keyphrases',
+                              keyphrases, path, self._dictionary)
+
     @classmethod
     def is_available(cls):
         return diagnose.check_python_import('pocketsphinx')
 
 
+class KeywordSpotter(object):
+    """
+    Spots keyphrases in a continuous stream of audio, with the keyphrase
+    search of a PocketSphinxDecoder.
+
+    Unlike transcribing a recording with the keyword language model, this
+    checks the audio as it is fed, so a keyphrase is spotted a few hundred
+    milliseconds after it was said, and only the keyphrases can be
+    spotted, each with a threshold trading misses for false alarms.
+    Smaller thresholds (like 1e-40) make a phrase easier to spot, which
+    longer phrases need.
+    """
+
+    # the sample rate the acoustic models expect
+    SAMPLE_RATE = 16000
+
+    def __init__(self, shared, name, keyphrases, path, dictionary):
+        """
+        Arguments:
+            shared -- the PocketSphinxDecoder to use
+            name -- the name of the search
+            keyphrases -- a dict of the detection thresholds, by phrase
+            path -- where to write the keyphrase file
+            dictionary -- a dictionary with the words of the phrases
+        """
+        self._logger = logging.getLogger(__name__)
+        self._shared = shared
+        self._search = name
+        self.keyphrases = dict(keyphrases)
+        with open(path, 'w') as f:
+            for phrase, threshold in sorted(self.keyphrases.items()):
+                f.write('%s /%g/\n' % (phrase, threshold))
+        self._shared.add_keyphrase_search(name, path, dictionary)
+        self._resampler = None
+
+    def start(self, rate, width=2):
+        """
+        Starts spotting in audio passed in with feed(). The decoder is
+        reserved for the spotter until stop() is called.
+
+        Arguments:
+            rate -- the sample rate of the audio in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        self._width = width
+        self._resampler = None
+        if rate != self.SAMPLE_RATE:
+            self._resampler = resampler.Resampler(rate, self.SAMPLE_RATE)
+        self._shared.lock.acquire()
+        try:
+            self._shared.select(self._search)
+            self._shared.decoder.start_utt()
+        except Exception:
+            self._shared.lock.release()
+            raise
+
+    def feed(self, chunk):
+        """
+        Returns:
+            The keyphrase spotted in the audio so far, or None
+        """
+        data = pcm_to_bytes(chunk, self._width)
+        if self._resampler is not None:
+            data = self._resampler.process(data)
+        if not data:
+            return None
+        decoder = self._shared.decoder
+        decoder.process_raw(data, False, False)
+        hypothesis = self._shared.hypothesis()
+        if not hypothesis:
+            return None
+        # start over, so the phrase isn't reported again
+        decoder.end_utt()
+        decoder.start_utt()
+        phrase = hypothesis.strip()
+        self._logger.info('Spotted: %r', phrase)
+        return phrase
+
+    def stop(self):
+        try:
+            self._shared.decoder.end_utt()
+        finally:
+            self._shared.lock.release()
+
+
+def log_julius_output(logger, lines):
+    """
+    Logs the errors, warnings and statistics in the output of julius.
+    """
+    for line in lines:
+        line = line.strip()
+        if len(line) > 7 and line[:7].upper() == 'ERROR: ':
+            if not line[7:].startswith('adin_'):
+                logger.error(line[7:])
+        elif len(line) > 9 and line[:9].upper() == 'WARNING: ':
+            logger.warning(line[9:])
+        elif len(line) > 6 and line[:6].upper() == 'STAT: ':
+            logger.debug(line[6:])
+
+
+class JuliusWorker(object):
+    """
+    A long-lived julius process in module mode, shared by all JuliusSTT
+    instances using the same acoustic model.
+
+    Julius loads the acoustic model once. Utterances are sent to it over
+    its adinnet audio socket, and the results are read from its module
+    control socket, over which the grammars of the vocabularies are
+    added and (de)activated as well, so switching between vocabularies
+    needs no restart either. If julius dies or stops responding, it is
+    restarted with the next utterance.
+
+    Use JuliusWorker.get_instance() to get the shared worker.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    # seconds to wait for julius to start up and to recognize an utterance
+    STARTUP_TIMEOUT = 30
+    RECOGNITION_TIMEOUT = 30
+
+    # bytes of audio per adinnet packet
+    PACKET_SIZE = 4096
+
+    @classmethod
+    def get_instance(cls, hmmdefs, tiedlist):
+        key = (hmmdefs, tiedlist)
+        with cls._instances_lock:
+            if key not in cls._instances:
+                cls._instances[key] = cls(hmmdefs, tiedlist)
+            return cls._instances[key]
+
+    def __init__(self, hmmdefs, tiedlist, executable='julius'):
+        """
+        Arguments:
+            hmmdefs -- the path of the HMM definitions
+            tiedlist -- the path of the HMM list
+            executable -- (optional) the julius executable
+                          (Default: 'julius')
+        """
+        self._logger = logging.getLogger(__name__)
+        self.hmmdefs = hmmdefs
+        self.tiedlist = tiedlist
+        self.executable = executable
+        self.lock = threading.Lock()
+        self.restarts = 0
+        self._proc = None
+        self._module = None
+        self._module_file = None
+        self._adin = None
+        # the names of the grammars julius has, and the active one
+        self._grammars = set()
+        self._active = None
+
+    @staticmethod
+    def _free_port():
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.bind(('127.0.0.1', 0))
+            return s.getsockname()[1]
+        finally:
+            s.close()
+
+    def _connect(self, port, deadline):
+        while True:
+            if self._proc.poll() is not None:
+                raise RuntimeError('julius exited with code %d' %
+                                   self._proc.returncode)
+            try:
+                return socket.create_connection(('127.0.0.1', port), 1)
+            except socket.error:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _start(self, vocabulary):
+        module_port = self._free_port()
+        adin_port = self._free_port()
+        cmd = [self.executable,
+               '-module', module_port,
+               '-input', 'adinnet',
+               '-adport', adin_port,
+               '-dfa', vocabulary.dfa_file,
+               '-v', vocabulary.dict_file,
+               '-h', self.hmmdefs,
+               '-hlist', self.tiedlist,
+               '-forcedict']
+        cmd = [str(x) for x in cmd]
+        self._logger.debug('Executing: %r', cmd)
+        self._proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                      stderr=subprocess.STDOUT)
+        # keep logging (and draining) its output
+        thread = threading.Thread(target=log_julius_output,
+                                  args=(self._logger,
+                                        iter(self._proc.stdout.readline,
+                                             '')),
+                                  name='julius output')
+        thread.daemon = True
+        thread.start()
+        deadline = time.time() + self.STARTUP_TIMEOUT
+        # julius only opens the audio port once a module client connected
+        self._module = self._connect(module_port, deadline)
+        self._module.settimeout(self.RECOGNITION_TIMEOUT)
+        self._module_file = self._module.makefile('r')
+        self._adin = self._connect(adin_port, deadline)
+        # the grammar given on the command line has no name, so it is
+        # replaced by a named one when the first vocabulary is selected
+        self._grammars = set()
+        self._active = None
+
+    def _stop(self):
+        for s in (self._module_file, self._module, self._adin):
+            if s is not None:
+                try:
+                    s.close()
+                except socket.error:
+                    pass
+        self._module = self._module_file = self._adin = None
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+        self._proc = None
+
+    def close(self):
+        """
+        Stops julius.
+        """
+        with self.lock:
+            self._stop()
+
+    @staticmethod
+    def _command(line, *blocks):
+        # every block (the DFA, the dictionary) ends with its end marker
+        data = line + '\n'
+        for block, end in blocks:
+            if block and not block.endswith('\n'):
+                block += '\n'
+            data += block + end + '\n'
+        return data
+
+    def _select(self, name, vocabulary):
+        if name == self._active:
+            return
+        commands = ''
+        if self._active is not None:
+            commands += self._command('DEACTIVATEGRAM %s' % self._active)
+        if name in self._grammars:
+            commands += self._command('ACTIVATEGRAM %s' % name)
+        else:
+            with open(vocabulary.dfa_file, 'r') as f:
+                dfa = f.read()
+            with open(vocabulary.dict_file, 'r') as f:
+                dictionary = f.read()
+            self._logger.debug("Adding grammar '%s' to julius", name)
+            # a new grammar is active right away
+            commands += self._command('CHANGEGRAM %s' % name
+                                      if not self._grammars
+                                      else 'ADDGRAM %s' % name,
+                                      (dfa, 'DFAEND'),
+                                      (dictionary, 'DICEND'))
+            self._grammars.add(name)
+        # all at once, so julius applies them before the next utterance
+        self._module.sendall(commands)
+        self._active = name
+
+    def _read_message(self):
+        lines = []
+        while True:
+            line = self._module_file.readline()
+            if not line:
+                raise IOError('julius closed the module connection')
+            if line.strip() == '.':
+                return ''.join(lines)
+            lines.append(line)
+
+    def _recognize(self, data):
+        for i in range(0, len(data), self.PACKET_SIZE):
+            packet = data[i:i + self.PACKET_SIZE]
+            self._adin.sendall(struct.pack('<i', len(packet)) + packet)
+        # an empty packet ends the utterance
+        self._adin.sendall(struct.pack('<i', 0))
+        while True:
+            message = self._read_message()
+            if '<RECOGOUT>' in message:
+                return self.parse_result(message)
+            if '<RECOGFAIL' in message or '<REJECTED' in message:
+                return ['']
+            if 'STATUS="ERROR"' in message:
+                self._logger.warning('julius: %s', message.strip())
+
+    @staticmethod
+    def parse_result(message):
+        """
+        Returns:
+            The sentences of a RECOGOUT message of julius, best first
+        """
+        hypotheses = []
+        for rank, shypo in re.findall(
+                r'<SHYPO RANK="(\d+)"[^>]*>(.*?)</SHYPO>', message, re.S):
+            words = [word for word in re.findall(r'WORD="([^"]*)"', shypo)
+                     if word not in ('<s>', '</s>')]
+            hypotheses.append((int(rank), ' '.join(words)))
+        transcribed = [text for rank, text in sorted(hypotheses) if text]
+        if not transcribed:
+            transcribed.append('')
+        return transcribed
+
+    def recognize(self, data, name, vocabulary):
+        """
+        Recognizes an utterance, (re)starting julius if necessary.
+
+        Arguments:
+            data -- 16 bit mono PCM data at 16 kHz
+            name -- the name of the grammar to recognize it with
+            vocabulary -- the JuliusVocabulary of that grammar
+
+        Returns:
+            A list of the recognized sentences, best first
+        """
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    if self._proc is None or self._proc.poll() is not None:
+                        if self._proc is not None:
+                            self.restarts += 1
+                            self._logger.warning('julius exited with code ' +
+                                                 '%r, restarting',
+                                                 self._proc.returncode)
+                        self._stop()
+                        self._start(vocabulary)
+                    self._select(name, vocabulary)
+                    return self._recognize(data)
+                except (IOError, socket.error, RuntimeError):
+                    self._logger.warning('julius failed', exc_info=True)
+                    self._stop()
+                    if attempt:
+                        raise
+                    self.restarts += 1
+
+
 class JuliusSTT(AbstractSTTEngine):
     """
     A very basic Speech-to-Text engine using Julius.
+
+    By default, all instances share one persistent julius process (see
+    JuliusWorker). With 'persistent: false' in the 'julius' section of
+    profile.yml, julius is run once per utterance instead.
     """
 
     SLUG = 'julius'
     VOCABULARY_TYPE = vocabcompiler.JuliusVocabulary
+    SAMPLE_RATE = 16000
 
     def __init__(self, vocabulary=None, hmmdefs="/usr/share/voxforge/julius/" +
                  "acoustic_model_files/hmmdefs", tiedlist="/usr/share/" +
-                 "voxforge/julius/acoustic_model_files/tiedlist"):
+                 "voxforge/julius/acoustic_model_files/tiedlist",
+                 persistent=True):
         self._logger = logging.getLogger(__name__)
         self._vocabulary = vocabulary
         self._hmmdefs = hmmdefs
         self._tiedlist = tiedlist
         self._pattern = re.compile(r'sentence(\d+): <s> (.+) </s>')
+        self._worker = None
+        if persistent:
+            # julius is started with the first utterance
+            self._worker = JuliusWorker.get_instance(hmmdefs, tiedlist)
+            return
 
         # Inital test run: we run this command once to log errors/warnings
         cmd = ['julius',
@@ -215,15 +1214,7 @@ class JuliusSTT(AbstractSTTEngine):
                 with tempfile.SpooledTemporaryFile() as err_f:
                     subprocess.call(cmd, stdin=f, stdout=out_f, stderr=err_f)
             out_f.seek(0)
-            for line in out_f.read().splitlines():
-                line = line.strip()
-                if len(line) > 7 and line[:7].upper() == 'ERROR: ':
-                    if not line[7:].startswith('adin_'):
-                        self._logger.error(line[7:])
-                elif len(line) > 9 and line[:9].upper() == 'WARNING: ':
-                    self._logger.warning(line[9:])
-                elif len(line) > 6 and line[:6].upper() == 'STAT: ':
-                    self._logger.debug(line[6:])
+            log_julius_output(self._logger, out_f.read().splitlines())
 
     @classmethod
     def get_config(cls):
@@ -241,9 +1232,43 @@ class JuliusSTT(AbstractSTTEngine):
                         config['hmmdefs'] = profile['julius']['hmmdefs']
                     if 'tiedlist' in profile['julius']:
                         config['tiedlist'] = profile['julius']['tiedlist']
+                    if 'persistent' in profile['julius']:
+                        config['persistent'] = \
+                            profile['julius']['persistent']
         return config
 
     def transcribe(self, fp, mode=None):
+        if self._worker is not None:
+            wav = wave.open(fp, 'rb')
+            try:
+                data = wav.readframes(wav.getnframes())
+                return self.transcribe_pcm(data, wav.getframerate(),
+                                           wav.getsampwidth())
+            finally:
+                wav.close()
+        return self._run_julius(stdin=fp)
+
+    def transcribe_pcm(self, buffer, rate, width=2):
+        """
+        Performs STT on in-memory audio by sending it to the julius worker
+        (or piping it into julius).
+
+        Arguments:
+            buffer -- the audio as bytes, bytearray, memoryview or NumPy array
+            rate -- the sample rate in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        data = pcm_to_bytes(buffer, width)
+        if self._worker is None:
+            return self._run_julius(data=pcm_to_wav(data, rate))
+        if rate != self.SAMPLE_RATE:
+            data = resampler.resample(data, rate, self.SAMPLE_RATE)
+        transcribed = self._worker.recognize(data, self._vocabulary.name,
+                                             self._vocabulary)
+        self._logger.info('Transcribed: %r', transcribed)
+        return transcribed
+
+    def _run_julius(self, stdin=None, data=None):
         cmd = ['julius',
                '-quiet',
                '-nolog',
@@ -255,12 +1280,20 @@ class JuliusSTT(AbstractSTTEngine):
                '-forcedict']
         cmd = [str(x) for x in cmd]
         self._logger.debug('Executing: %r', cmd)
-        with tempfile.SpooledTemporaryFile() as out_f:
-            with tempfile.SpooledTemporaryFile() as err_f:
-                subprocess.call(cmd, stdin=fp, stdout=out_f, stderr=err_f)
-            out_f.seek(0)
-            results = [(int(i), text) for i, text in
-                       self._pattern.findall(out_f.read())]
+        if data is not None:
+            proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.PIPE)
+            output = proc.communicate(data)[0]
+        else:
+            with tempfile.SpooledTemporaryFile() as out_f:
+                with tempfile.SpooledTemporaryFile() as err_f:
+                    subprocess.call(cmd, stdin=stdin, stdout=out_f,
+                                    stderr=err_f)
+                out_f.seek(0)
+                output = out_f.read()
+        results = [(int(i), text) for i, text in
+                   self._pattern.findall(output)]
         transcribed = [text for i, text in
                        sorted(results, key=lambda x: x[0])
                        if text]
@@ -274,7 +1307,203 @@ class JuliusSTT(AbstractSTTEngine):
         return diagnose.check_executable('julius')
 
 
-class GoogleSTT(AbstractSTTEngine):
+class HTTPSTTEngine(AbstractSTTEngine):
+    """
+    Base class of the engines using a web API that accepts raw PCM audio,
+    and maybe FLAC.
+
+    In streaming mode the audio is uploaded with chunked transfer encoding
+    while it is being captured, so most of it has been sent by the time
+    the caller stops talking. If the streamed request fails, the audio is
+    posted again in one piece.
+
+    The audio is sent in the encoding named by the engine's 'encoding'
+    option in profile.yml, one of the keys of CONTENT_TYPES. FLAC needs
+    about half the bytes of PCM for speech, which shortens the upload on a
+    slow link by more than the encoding takes (see flac.py).
+
+    Subclasses implement _request() and _parse_response().
+    """
+
+    SUPPORTS_STREAMING = True
+    # the content types of the encodings the API accepts, by the name of
+    # the encoding, with a placeholder for the sample rate
+    CONTENT_TYPES = {}
+    _encoding = 'pcm'
+
+    @property
+    def encoding(self):
+        return self._encoding
+
+    @encoding.setter
+    def encoding(self, value):
+        if value not in self.CONTENT_TYPES:
+            raise ValueError("Encoding '%s' not supported by %s, use one " %
+                             (value, self.__class__.__name__) +
+                             "of: %s" % ', '.join(sorted(self.CONTENT_TYPES)))
+        self._encoding = value
+
+    @classmethod
+    def _get_encoding(cls, profile, section):
+        # the 'encoding' option of the engine's section of profile.yml
+        if section in profile and 'encoding' in profile[section]:
+            return {'encoding': profile[section]['encoding']}
+        return {}
+
+    def _content_type(self, rate):
+        return self.CONTENT_TYPES[self.encoding] % rate
+
+    def _encode(self, data, rate):
+        if self.encoding != 'flac':
+            return data
+        start = time.time()
+        encoded = flac.encode(data, rate)
+        self._logger.debug('FLAC encoded %d bytes of audio to %d bytes ' +
+                           '(%.0f%%) in %.3f s', len(data), len(encoded),
+                           100.0 * len(encoded) / max(len(data), 1),
+                           time.time() - start)
+        return encoded
+
+    @abstractmethod
+    def _request(self, rate):
+        """
+        Returns:
+            (url, headers) of a request that transcribes 16 bit mono PCM
+            audio at rate, or None if the engine is not configured
+        """
+        pass
+
+    @abstractmethod
+    def _parse_response(self, r):
+        """
+        Returns:
+            The transcription in a successful response
+        """
+        pass
+
+    def _should_retry(self, r):
+        """
+        Returns:
+            True if the request should be repeated after this response,
+            e.g. because an access token has to be renewed
+        """
+        return False
+
+    def transcribe(self, fp):
+        wav = wave.open(fp, 'rb')
+        frame_rate = wav.getframerate()
+        width = wav.getsampwidth()
+        data = wav.readframes(wav.getnframes())
+        wav.close()
+        return self.transcribe_pcm(data, frame_rate, width)
+
+    def transcribe_pcm(self, buffer, rate, width=2):
+        """
+        Transcribes in-memory audio with a single request.
+
+        Arguments:
+            buffer -- the audio as bytes, bytearray, memoryview or NumPy array
+            rate -- the sample rate in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        return self._post(self._encode(pcm_to_bytes(buffer, width), rate),
+                          rate)
+
+    def _send(self, data, rate):
+        request = self._request(rate)
+        if request is None:
+            return None
+        url, headers = request
+        return self._http.post(url, data=data, headers=headers)
+
+    def _post(self, data, rate, r=None):
+        """
+        Posts audio, unless r is the response to it already, and returns
+        the transcription in the response.
+        """
+        try:
+            if r is None:
+                r = self._send(data, rate)
+            if r is not None and self._should_retry(r):
+                r = self._send(data, rate)
+            if r is None:
+                return []
+            r.raise_for_status()
+        except requests.exceptions.HTTPError as e:
+            return self._http_error(e.response)
+        except requests.exceptions.RequestException:
+            self._logger.critical('Request failed.', exc_info=True)
+            return []
+        return self._parse_response(r)
+
+    def _http_error(self, r):
+        self._logger.critical('Request failed with response: %r',
+                              r.text,
+                              exc_info=True)
+        return []
+
+    def start_stream(self, rate, width=2):
+        self._stream_format = (rate, width)
+        self._upload = None
+        self._encoder = None
+        request = self._request(rate)
+        if request is not None:
+            url, headers = request
+            self._upload = httpsession.ChunkedUpload(self._http, url,
+                                                     headers)
+            if self.encoding == 'flac':
+                # the number of samples is unknown yet, which FLAC allows
+                self._encoder = flac.Encoder(rate)
+                self._upload.write(self._encoder.header())
+
+    def feed(self, chunk):
+        if self._upload is not None:
+            data = pcm_to_bytes(chunk, self._stream_format[1])
+            if self._encoder is not None:
+                data = self._encoder.encode(data)
+            self._upload.write(data)
+
+    def finish(self):
+        # the upload stays reachable for abort() while waiting for the
+        # response
+        upload = self._upload
+        if upload is None:
+            return []
+        rate = self._stream_format[0]
+        encoder, self._encoder = self._encoder, None
+        if encoder is not None:
+            upload.write(encoder.flush())
+            self._logger.debug('FLAC encoded %d bytes of audio to %d bytes ' +
+                               '(%.0f%%) in %.3f s', encoder.input_bytes,
+                               encoder.output_bytes,
+                               100.0 * (encoder.ratio or 0),
+                               encoder.encode_time)
+        try:
+            r = upload.finish()
+        except httpsession.UploadAborted:
+            return []
+        except requests.exceptions.Timeout:
+            self._logger.critical('Request timed out.', exc_info=True)
+            return []
+        except requests.exceptions.RequestException:
+            self._logger.warning('Streaming the audio failed, posting it ' +
+                                 'again', exc_info=True)
+            return self._post(upload.data, rate)
+        finally:
+            self._upload = None
+        return self._post(upload.data, rate, r)
+
+    def abort(self):
+        """
+        Aborts a streaming transcription, also while finish() waits for
+        the response on another thread.
+        """
+        upload, self._upload = self._upload, None
+        if upload is not None:
+            upload.abort()
+
+
+class GoogleSTT(HTTPSTTEngine):
     """
     Speech-To-Text implementation which relies on the Google Speech API.
 
@@ -305,18 +1534,23 @@ class GoogleSTT(AbstractSTTEngine):
     """
 
     SLUG = 'google'
+    HOST = 'https://www.google.com'
+    CONTENT_TYPES = {'pcm': 'audio/l16; rate=%d',
+                     'flac': 'audio/x-flac; rate=%d'}
 
-    def __init__(self, api_key=None, language='en-us'):
+    def __init__(self, api_key=None, language='en-us', encoding='flac'):
         # FIXME: get init args from config
         """
         Arguments:
         api_key - the public api key which allows access to Google APIs
+        encoding - 'flac' or 'pcm', the encoding of the uploaded audio
         """
         self._logger = logging.getLogger(__name__)
         self._request_url = None
         self._language = None
         self._api_key = None
-        self._http = requests.Session()
+        self._http = httpsession.get_session()
+        self.encoding = encoding
         self.language = language
         self.api_key = api_key
 
@@ -350,9 +1584,9 @@ class GoogleSTT(AbstractSTTEngine):
                                       'lang': self.language,
                                       'maxresults': 6,
                                       'pfilter': 2})
+            scheme, host = urlparse.urlsplit(self.HOST)[:2]
             self._request_url = urlparse.urlunparse(
-                ('https', 'www.google.com', '/speech-api/v2/recognize', '',
-                 query, ''))
+                (scheme, host, '/speech-api/v2/recognize', '', query, ''))
         else:
             self._request_url = None
 
@@ -368,42 +1602,33 @@ class GoogleSTT(AbstractSTTEngine):
                 profile = yaml.safe_load(f)
                 if 'keys' in profile and 'GOOGLE_SPEECH' in profile['keys']:
                     config['api_key'] = profile['keys']['GOOGLE_SPEECH']
+                config.update(cls._get_encoding(profile, 'google-stt'))
         return config
 
-    def transcribe(self, fp):
+    def _request(self, rate):
         """
-        Performs STT via the Google Speech API, transcribing an audio file and
-        returning an English string.
-
-        Arguments:
-        audio_file_path -- the path to the .wav file to be transcribed
+        The audio is sent as raw PCM or FLAC, so no WAV file is needed.
         """
-
         if not self.api_key:
             self._logger.critical('API key missing, transcription request ' +
                                   'aborted.')
-            return []
+            return None
         elif not self.language:
             self._logger.critical('Language info missing, transcription ' +
                                   'request aborted.')
-            return []
-
-        wav = wave.open(fp, 'rb')
-        frame_rate = wav.getframerate()
-        wav.close()
-        data = fp.read()
-
-        headers = {'content-type': 'audio/l16; rate=%s' % frame_rate}
-        r = self._http.post(self.request_url, data=data, headers=headers)
-        try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError:
-            self._logger.critical('Request failed with http status %d',
-                                  r.status_code)
-            if r.status_code == requests.codes['forbidden']:
-                self._logger.warning('Status 403 is probably caused by an ' +
-                                     'invalid Google API key.')
-            return []
+            return None
+        return (self.request_url,
+                {'content-type': self._content_type(rate)})
+
+    def _http_error(self, r):
+        self._logger.critical('Request failed with http status %d',
+                              r.status_code)
+        if r.status_code == requests.codes['forbidden']:
+            self._logger.warning('Status 403 is probably caused by an ' +
+                                 'invalid Google API key.')
+        return []
+
+    def _parse_response(self, r):
         r.encoding = 'utf-8'
         try:
             # We cannot simply use r.json() because Google sends invalid json
@@ -432,7 +1657,7 @@ class GoogleSTT(AbstractSTTEngine):
         return diagnose.check_network_connection()
 
 
-class AttSTT(AbstractSTTEngine):
+class AttSTT(HTTPSTTEngine):
     """
     Speech-To-Text implementation which relies on the AT&T Speech API.
 
@@ -448,12 +1673,19 @@ class AttSTT(AbstractSTTEngine):
     """
 
     SLUG = "att"
+    TOKEN_URL = 'https://api.att.com/oauth/v4/token'
+    SPEECH_URL = 'https://api.att.com/speech/v3/speechToText'
+    # the lifetime assumed for tokens whose expiry is unknown
+    TOKEN_LIFETIME = 3600
+    CONTENT_TYPES = {'pcm': 'audio/raw;coding=linear;rate=%d;byteorder=LE'}
 
-    def __init__(self, app_key, app_secret):
+    def __init__(self, app_key, app_secret, encoding='pcm'):
         self._logger = logging.getLogger(__name__)
-        self._token = None
+        self._http = httpsession.get_session()
+        self._tokens = httpsession.TokenCache.get_instance()
         self.app_key = app_key
         self.app_secret = app_secret
+        self.encoding = encoding
 
     @classmethod
     def get_config(cls):
@@ -469,78 +1701,92 @@ class AttSTT(AbstractSTTEngine):
                         config['app_key'] = profile['att-stt']['app_key']
                     if 'app_secret' in profile['att-stt']:
                         config['app_secret'] = profile['att-stt']['app_secret']
+                config.update(cls._get_encoding(profile, 'att-stt'))
         return config
 
+    @property
+    def _token_key(self):
+        return 'att-stt:%s' % self.app_key
+
     @property
     def token(self):
-        if not self._token:
+        """
+        The OAuth access token, from the token cache, or a new one if there
+        is none or it is about to expire.
+        """
+        token = self._tokens.get(self._token_key)
+        if not token:
+            self._logger.debug('Requesting a new OAuth access token')
             headers = {'content-type': 'application/x-www-form-urlencoded',
                        'accept': 'application/json'}
             payload = {'client_id': self.app_key,
                        'client_secret': self.app_secret,
                        'scope': 'SPEECH',
                        'grant_type': 'client_credentials'}
-            r = requests.post('https://api.att.com/oauth/v4/token',
-                              data=payload,
-                              headers=headers)
-            self._token = r.json()['access_token']
-        return self._token
+            r = self._http.post(self.TOKEN_URL,
+                                data=payload,
+                                headers=headers)
+            r.raise_for_status()
+            response = r.json()
+            token = response['access_token']
+            expires_in = int(response.get('expires_in') or
+                             self.TOKEN_LIFETIME)
+            self._tokens.set(self._token_key, token, expires_in)
+        return token
+
+    def _request(self, rate):
+        try:
+            token = self.token
+        except requests.exceptions.RequestException:
+            self._logger.critical('Requesting an OAuth access token ' +
+                                  'failed.', exc_info=True)
+            return None
+        except (ValueError, KeyError):
+            self._logger.critical('Cannot parse token response.',
+                                  exc_info=True)
+            return None
+        headers = {'authorization': 'Bearer %s' % token,
+                   'accept': 'application/json',
+                   'content-type': self._content_type(rate)}
+        return self.SPEECH_URL, headers
 
-    def transcribe(self, fp):
-        data = fp.read()
-        r = self._get_response(data)
+    def _should_retry(self, r):
         if r.status_code == requests.codes['unauthorized']:
             # Request token invalid, retry once with a new token
             self._logger.warning('OAuth access token invalid, generating a ' +
                                  'new one and retrying...')
-            self._token = None
-            r = self._get_response(data)
+            self._tokens.invalidate(self._token_key)
+            return True
+        return False
+
+    def _parse_response(self, r):
         try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError:
-            self._logger.critical('Request failed with response: %r',
-                                  r.text,
-                                  exc_info=True)
+            recognition = r.json()['Recognition']
+            if recognition['Status'] != 'OK':
+                raise ValueError(recognition['Status'])
+            results = [(x['Hypothesis'], x['Confidence'])
+                       for x in recognition['NBest']]
+        except ValueError as e:
+            self._logger.debug('Recognition failed with status: %s',
+                               e.args[0])
             return []
-        except requests.exceptions.RequestException:
-            self._logger.critical('Request failed.', exc_info=True)
+        except KeyError:
+            self._logger.critical('Cannot parse response.',
+                                  exc_info=True)
             return []
         else:
-            try:
-                recognition = r.json()['Recognition']
-                if recognition['Status'] != 'OK':
-                    raise ValueError(recognition['Status'])
-                results = [(x['Hypothesis'], x['Confidence'])
-                           for x in recognition['NBest']]
-            except ValueError as e:
-                self._logger.debug('Recognition failed with status: %s',
-                                   e.args[0])
-                return []
-            except KeyError:
-                self._logger.critical('Cannot parse response.',
-                                      exc_info=True)
-                return []
-            else:
-                transcribed = [x[0].upper() for x in sorted(results,
-                                                            key=lambda x: x[1],
-                                                            reverse=True)]
-                self._logger.info('Transcribed: %r', transcribed)
-                return transcribed
-
-    def _get_response(self, data):
-        headers = {'authorization': 'Bearer %s' % self.token,
-                   'accept': 'application/json',
-                   'content-type': 'audio/wav'}
-        return requests.post('https://api.att.com/speech/v3/speechToText',
-                             data=data,
-                             headers=headers)
+            transcribed = [x[0].upper() for x in sorted(results,
+                                                        key=lambda x: x[1],
+                                                        reverse=True)]
+            self._logger.info('Transcribed: %r', transcribed)
+            return transcribed
 
     @classmethod
     def is_available(cls):
         return diagnose.check_network_connection()
 
 
-class WitAiSTT(AbstractSTTEngine):
+class WitAiSTT(HTTPSTTEngine):
     """
     Speech-To-Text implementation which relies on the Wit.ai Speech API.
 
@@ -555,10 +1801,15 @@ class WitAiSTT(AbstractSTTEngine):
     """
 
     SLUG = "witai"
+    SPEECH_URL = 'https://api.wit.ai/speech?v=20150101'
+    CONTENT_TYPES = {'pcm': 'audio/raw;encoding=signed-integer;bits=16;' +
+                            'rate=%d;endian=little'}
 
-    def __init__(self, access_token):
+    def __init__(self, access_token, encoding='pcm'):
         self._logger = logging.getLogger(__name__)
+        self._http = httpsession.get_session()
         self.token = access_token
+        self.encoding = encoding
 
     @classmethod
     def get_config(cls):
@@ -573,6 +1824,7 @@ class WitAiSTT(AbstractSTTEngine):
                     if 'access_token' in profile['witai-stt']:
                         config['access_token'] = \
                             profile['witai-stt']['access_token']
+                config.update(cls._get_encoding(profile, 'witai-stt'))
         return config
 
     @property
@@ -583,29 +1835,20 @@ class WitAiSTT(AbstractSTTEngine):
     def token(self, value):
         self._token = value
         self._headers = {'Authorization': 'Bearer %s' % self.token,
-                         'accept': 'application/json',
-                         'Content-Type': 'audio/wav'}
+                         'accept': 'application/json'}
 
     @property
     def headers(self):
         return self._headers
 
-    def transcribe(self, fp):
-        data = fp.read()
-        r = requests.post('https://api.wit.ai/speech?v=20150101',
-                          data=data,
-                          headers=self.headers)
+    def _request(self, rate):
+        headers = dict(self.headers)
+        headers['Content-Type'] = self._content_type(rate)
+        return self.SPEECH_URL, headers
+
+    def _parse_response(self, r):
         try:
-            r.raise_for_status()
             text = r.json()['_text']
-        except requests.exceptions.HTTPError:
-            self._logger.critical('Request failed with response: %r',
-                                  r.text,
-                                  exc_info=True)
-            return []
-        except requests.exceptions.RequestException:
-            self._logger.critical('Request failed.', exc_info=True)
-            return []
         except ValueError as e:
             self._logger.critical('Cannot parse response: %s',
                                   e.args[0])
@@ -626,6 +1869,242 @@ class WitAiSTT(AbstractSTTEngine):
         return diagnose.check_network_connection()
 
 
+class HedgedSTT(AbstractSTTEngine):
+    """
+    Runs a local and a remote STT engine on every utterance at the same
+    time, so a slow or failing network can't stall a call.
+
+    The remote engine's result is used if it arrives in time. The local
+    engine's is used right away if it is confident enough, or once the
+    deadline has passed without a remote result (or if the remote engine
+    failed). Confident means that the confidence of its best hypothesis,
+    which has to be an absolute one like PocketSphinxSTT's posterior, is
+    at least min_confidence; a result without one is never used early.
+
+    The engine that loses is cancelled if it hasn't started yet. A web
+    API's request that is under way is aborted, so it doesn't tie up a
+    thread of the pool until it times out; otherwise the loser's result is
+    discarded when it arrives. Wins, losses, errors and latencies are
+    counted per engine.
+
+    Passive listening only uses the local engine. Sample configuration:
+
+        ...
+        stt_engine: hedged
+        hedged-stt:
+          local: sphinx
+          remote: google
+          deadline: 2.0        # seconds
+          min_confidence: 0.8  # posterior of the local engine's best
+                               # hypothesis
+    """
+
+    SLUG = 'hedged'
+
+    # the thread pool all instances run their engines in
+    POOL_SIZE = 4
+    _pool = None
+    _pool_lock = threading.Lock()
+
+    def __init__(self, local, remote, deadline=2.0, min_confidence=0.8):
+        """
+        Arguments:
+            local -- the local STT engine instance
+            remote -- the remote STT engine instance
+            deadline -- (optional) seconds to wait for the remote engine
+                        when the local one isn't confident (Default: 2)
+            min_confidence -- (optional) the confidence at which the local
+                              engine's result is used without waiting for
+                              the remote one (Default: 0.8)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.local = local
+        self.remote = remote
+        self.deadline = deadline
+        self.min_confidence = min_confidence
+        self._stats_lock = threading.Lock()
+        self._stats = dict((engine, {'wins': 0, 'losses': 0, 'errors': 0,
+                                     'latencies': collections.deque(
+                                         maxlen=100)})
+                           for engine in ('local', 'remote'))
+
+    @classmethod
+    def get_config(cls):
+        # FIXME: Replace this as soon as we have a config module
+        config = {'local': 'sphinx', 'remote': 'google'}
+        profile_path = jasperpath.config('profile.yml')
+        if os.path.exists(profile_path):
+            with open(profile_path, 'r') as f:
+                profile = yaml.safe_load(f)
+                if 'hedged-stt' in profile:
+                    for key in ('local', 'remote', 'deadline',
+                                'min_confidence'):
+                        if key in profile['hedged-stt']:
+                            config[key] = profile['hedged-stt'][key]
+        return config
+
+    @classmethod
+    def get_instance(cls, vocabulary_name, phrases):
+        config = cls.get_config()
+        for engine in ('local', 'remote'):
+            engine_class = get_engine_by_slug(config[engine])
+            config[engine] = engine_class.get_instance(vocabulary_name,
+                                                       phrases)
+        return cls(**config)
+
+    @classmethod
+    def get_passive_instance(cls):
+        # not worth a request every few seconds
+        engine_class = get_engine_by_slug(cls.get_config()['local'])
+        return engine_class.get_passive_instance()
+
+    @classmethod
+    def is_available(cls):
+        config = cls.get_config()
+        try:
+            for engine in ('local', 'remote'):
+                get_engine_by_slug(config[engine])
+        except ValueError:
+            return False
+        return True
+
+    @classmethod
+    def _get_pool(cls):
+        with cls._pool_lock:
+            if cls._pool is None:
+                cls._pool = ThreadPool(cls.POOL_SIZE)
+            return cls._pool
+
+    @property
+    def stats(self):
+        """
+        A dict with the wins, losses, errors and the mean and maximum
+        latency (of the last 100 utterances) of the local and the remote
+        engine.
+        """
+        stats = {}
+        with self._stats_lock:
+            for engine, counters in self._stats.items():
+                latencies = counters['latencies']
+                stats[engine] = {
+                    'wins': counters['wins'],
+                    'losses': counters['losses'],
+                    'errors': counters['errors'],
+                    'mean_latency': (sum(latencies) / len(latencies)
+                                     if latencies else None),
+                    'max_latency': max(latencies) if latencies else None}
+        return stats
+
+    def _run(self, name, engine, data, rate, cancelled, results,
+             stream=False):
+        if cancelled.is_set():
+            results.put((name, None))
+            return
+        start = time.time()
+        try:
+            if stream:
+                # a streaming transcription can be aborted while it waits
+                engine.start_stream(rate)
+                if cancelled.is_set():
+                    engine.abort()
+                    results.put((name, None))
+                    return
+                engine.feed(data)
+                result = engine.finish()
+            else:
+                result = engine.transcribe_pcm(data, rate)
+        except Exception:
+            self._logger.warning('%s STT engine failed', name.capitalize(),
+                                 exc_info=True)
+            result = None
+        if cancelled.is_set():
+            # lost, and maybe aborted, which says nothing about the engine
+            results.put((name, result))
+            return
+        with self._stats_lock:
+            self._stats[name]['latencies'].append(time.time() - start)
+            if result is None:
+                self._stats[name]['errors'] += 1
+        results.put((name, result))
+
+    def _confident(self, result):
+        if not result or not result[0]:
+            return False
+        confidence = getattr(result[0], 'confidence', None)
+        return confidence is not None and confidence >= self.min_confidence
+
+    def transcribe(self, fp):
+        wav = wave.open(fp, 'rb')
+        try:
+            data = wav.readframes(wav.getnframes())
+            return self.transcribe_pcm(data, wav.getframerate(),
+                                       wav.getsampwidth())
+        finally:
+            wav.close()
+
+    def transcribe_pcm(self, buffer, rate, width=2):
+        """
+        Transcribes in-memory audio with both engines and returns the result
+        of the one that wins.
+
+        Arguments:
+            buffer -- the audio as bytes, bytearray, memoryview or NumPy array
+            rate -- the sample rate in Hz
+            width -- (optional) the sample width in bytes (Default: 2)
+        """
+        data = pcm_to_bytes(buffer, width)
+        deadline = time.time() + self.deadline
+        pool = self._get_pool()
+        results = Queue.Queue()
+        cancelled = threading.Event()
+        # the web API engines get a copy of their own for every utterance,
+        # whose request can be aborted if it loses
+        streams = {}
+        for name, engine in (('local', self.local),
+                             ('remote', self.remote)):
+            if isinstance(engine, HTTPSTTEngine):
+                engine = streams[name] = copy.copy(engine)
+            pool.apply_async(self._run, (name, engine, data, rate, cancelled,
+                                         results, name in streams))
+        received = {}
+        winner = None
+        while winner is None:
+            # with a local result, the remote engine is only waited for
+            # until the deadline (the long timeout otherwise just keeps
+            # the wait interruptible)
+            timeout = max(0, deadline - time.time()) \
+                if 'local' in received else 3600
+            try:
+                name, result = results.get(timeout=timeout)
+            except Queue.Empty:
+                if 'local' in received:
+                    winner = 'local'
+                continue
+            received[name] = result
+            if name == 'remote' and result:
+                winner = 'remote'
+            elif name == 'local' and self._confident(result):
+                winner = 'local'
+            elif len(received) == 2:
+                winner = 'remote' if received['remote'] else 'local'
+        cancelled.set()
+        loser = 'remote' if winner == 'local' else 'local'
+        if loser in streams and loser not in received:
+            streams[loser].abort()
+        with self._stats_lock:
+            self._stats[winner]['wins'] += 1
+            self._stats[loser]['losses'] += 1
+        transcribed = received[winner] or []
+        self._logger.info('Transcribed by the %s STT engine: %r', winner,
+                          transcribed)
+        self._logger.debug('Hedged STT stats: %r', self.stats)
+        return transcribed
+
+    def close(self):
+        self.local.close()
+        self.remote.close()
+
+
 def get_engine_by_slug(slug=None):
     """
     Returns:
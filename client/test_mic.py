@@ -13,6 +13,10 @@ class Mic:
         self.idx = 0
         self.outputs = []
 
+    def view(self, active_stt_engine):
+        # views share the pre-arranged inputs
+        return self
+
     def passiveListen(self, PERSONA):
         return True, "JASPER"
 
@@ -38,6 +38,8 @@ try:
 except ImportError:
     pass
 
+import audio
+import audioprobe
 import diagnose
 import jasperpath
 import phone
@@ -76,6 +78,10 @@ class AbstractTTSEngine(object):
     def __init__(self, **kwargs):
         self._logger = logging.getLogger(__name__)
 	self.device = kwargs.get('device', 0)
+        self._playback_capabilities = None
+        # notified of every playback and able to stop it early, see
+        # bargein.BargeIn
+        self.playback_monitor = None
 
     @abstractmethod
     def say(self, phrase, *args):
@@ -85,10 +91,58 @@ class AbstractTTSEngine(object):
         # FIXME: Use platform-independent audio-output here
         # See issue jasperproject/jasper-client#188
         gruephone = phone.get_phone()
-        cmd = ['/usr/bin/aplay', '-D', 'plughw:{},0'.format(self.device), str(filename)]
+        monitor = self.playback_monitor
+        if monitor is not None and monitor.interrupted:
+            self._logger.debug("Not playing '%s', interrupted", filename)
+            return
+        cmd = ['/usr/bin/aplay', '-D', self._get_alsa_device(filename),
+               str(filename)]
         self._logger.debug('Executing %s', ' '.join([pipes.quote(arg)
                                                      for arg in cmd]))
-        run_while(gruephone.off_hook, cmd[0], cmd)
+        if monitor is None:
+            run_while(gruephone.off_hook, cmd[0], cmd)
+            return
+
+        def playing():
+            return gruephone.off_hook() and not monitor.interrupted
+
+        monitor.started(filename)
+        try:
+            # poll often, so an interruption stops the playback quickly
+            run_while(playing, cmd[0], cmd, interval=0.02)
+        finally:
+            monitor.stopped()
+
+    def _get_alsa_device(self, filename):
+        """
+        Returns:
+            The hardware device itself if it can play the WAV file without
+            conversion, else the plug device converting it
+        """
+        plug = 'plughw:{},0'.format(self.device)
+        try:
+            wav = wave.open(str(filename), 'rb')
+            try:
+                fmt = (wav.getframerate(), wav.getsampwidth(),
+                       wav.getnchannels())
+            finally:
+                wav.close()
+        except (wave.Error, EOFError, IOError):
+            return plug
+        if self._playback_capabilities is None:
+            self._playback_capabilities = {}
+            try:
+                pa = audio.AudioBackend.get_instance().pyaudio
+                index = audioprobe.find_alsa_device(pa, int(self.device))
+                if index is not None:
+                    self._playback_capabilities = \
+                        audioprobe.get_capabilities(index, audio=pa)
+            except Exception:
+                self._logger.warning('Could not probe speaker %r',
+                                     self.device, exc_info=True)
+        if audioprobe.supports_playback(self._playback_capabilities, *fmt):
+            return 'hw:{},0'.format(self.device)
+        return plug
 
 
 class AbstractMp3TTSEngine(AbstractTTSEngine):
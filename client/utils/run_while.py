@@ -5,7 +5,7 @@ import time
 
 logger = logging.getLogger(__name__)
 
-def run_while(cond, cmd, args):
+def run_while(cond, cmd, args, interval=0.1):
     exited = False
     pid = None
 
@@ -20,7 +20,7 @@ def run_while(cond, cmd, args):
             logger.info('Ran cmd "{0}" in pid {1}'.format(' '.join(args), pid))
             logger.debug(os.read(fd, 10240))
             while cond():
-                time.sleep(0.1)
+                time.sleep(interval)
                 stat_pid, status = os.waitpid(pid, os.WNOHANG)
                 if stat_pid == pid and os.WIFEXITED(status):
                     exited = True
@@ -0,0 +1,296 @@
+# -*- coding: utf-8-*-
+"""
+Spectral voice activity detection for the Mic class.
+
+The VoiceActivityDetector classifies short frames (20 ms by default) as
+speech or non-speech, using the energy in the speech band (300-3400 Hz)
+relative to a tracked noise floor plus the zero-crossing rate of the frame.
+The VADEndpointer puts a hangover state machine on top of it and has the
+same feed() interface as energy.EnergyEndpointer, so Mic can use either.
+
+Compared to the 30720-sample moving average of the energy endpointer, the
+end of an utterance is detected after the hangover time instead of after
+the average has decayed, which is usually much sooner. Run this file with
+a directory of WAV files to compare both on a corpus (see the bottom of
+this file).
+"""
+import logging
+
+import numpy as np
+
+
+class VoiceActivityDetector(object):
+    """
+    Frame-based speech/non-speech classifier for 16 bit mono PCM data.
+    """
+
+    # the speech band in Hz
+    BAND = (300, 3400)
+
+    # required band energy above the noise floor (in dB) for each
+    # aggressiveness level; more aggressive means less is considered speech
+    MARGINS = {0: 6.0, 1: 9.0, 2: 12.0, 3: 15.0}
+
+    # frames with more zero crossings than this (in crossings per second /
+    # 2, i.e. the frequency of a sine wave with the same count) look like
+    # hiss rather than voiced speech, unless they are very loud
+    ZCR_MAX = 2500.0
+
+    # how fast the noise floor follows the band energy down (per frame) and
+    # up (in dB per second, during non-speech and speech respectively)
+    FLOOR_FALL = 0.3
+    FLOOR_RISE = (3.0, 0.5)
+
+    # the noise floor never drops below 1 LSB rms, so digital silence does
+    # not make everything else look like speech
+    MIN_FLOOR = 0.0
+
+    def __init__(self, rate, frame_ms=20, aggressiveness=1, noise_rms=None):
+        """
+        Arguments:
+            rate -- the sample rate in Hz
+            frame_ms -- (optional) the frame length in milliseconds
+                        (Default: 20)
+            aggressiveness -- (optional) 0 to 3, how strictly frames are
+                              classified as speech (Default: 1)
+            noise_rms -- (optional) an initial estimate of the rms of the
+                         background noise; without it the first frame is
+                         taken as noise
+        """
+        if aggressiveness not in self.MARGINS:
+            raise ValueError("aggressiveness must be one of %s" %
+                             sorted(self.MARGINS.keys()))
+        self.rate = rate
+        self.frame_ms = frame_ms
+        self.frame_length = int(rate * frame_ms / 1000)
+        self.margin = self.MARGINS[aggressiveness]
+        self._window = np.hamming(self.frame_length)
+        freqs = np.fft.rfftfreq(self.frame_length, 1.0 / rate)
+        self._band = (freqs >= self.BAND[0]) & (freqs <= self.BAND[1])
+        # scales the summed power spectrum to the mean square of the
+        # band-limited, windowed signal
+        self._scale = 2.0 / (self.frame_length * (self._window ** 2).sum())
+        frame_seconds = self.frame_length / float(rate)
+        self._rise = tuple(r * frame_seconds for r in self.FLOOR_RISE)
+        self.noise_floor = None
+        if noise_rms is not None:
+            self.noise_floor = max(self.MIN_FLOOR,
+                                   20 * np.log10(max(noise_rms, 1)))
+
+    def features(self, frames):
+        """
+        Computes the features of a number of frames.
+
+        Arguments:
+            frames -- a (n, frame_length) array of samples
+
+        Returns:
+            A tuple of two arrays with the band energy in dB and the
+            zero-crossing frequency in Hz of every frame
+        """
+        spectrum = np.fft.rfft(frames * self._window, axis=1)
+        power = (spectrum.real ** 2 + spectrum.imag ** 2)[:, self._band]
+        energy = 10 * np.log10(power.sum(axis=1) * self._scale + 1e-10)
+        signs = np.signbit(frames)
+        crossings = (signs[:, 1:] != signs[:, :-1]).sum(axis=1)
+        zcr = crossings * self.rate / (2.0 * self.frame_length)
+        return energy, zcr
+
+    def classify(self, data):
+        """
+        Classifies every complete frame of a block of audio. Partial frames
+        at the end of the block are ignored.
+
+        Arguments:
+            data -- a byte string of 16 bit little-endian PCM data
+
+        Returns:
+            A list of booleans, True for every speech frame
+        """
+        samples = np.frombuffer(data, dtype='<i2')
+        n = len(samples) // self.frame_length
+        if not n:
+            return []
+        frames = samples[:n * self.frame_length].reshape(
+            n, self.frame_length).astype(np.float64)
+        energy, zcr = self.features(frames)
+        decisions = []
+        for e, z in zip(energy.tolist(), zcr.tolist()):
+            if self.noise_floor is None:
+                self.noise_floor = max(self.MIN_FLOOR, e)
+            snr = e - self.noise_floor
+            speech = snr > self.margin and (z < self.ZCR_MAX or
+                                            snr > 2 * self.margin)
+            if e < self.noise_floor:
+                self.noise_floor += self.FLOOR_FALL * (e - self.noise_floor)
+                self.noise_floor = max(self.MIN_FLOOR, self.noise_floor)
+            else:
+                self.noise_floor += min(e - self.noise_floor,
+                                        self._rise[bool(speech)])
+            decisions.append(speech)
+        return decisions
+
+
+class VADEndpointer(object):
+    """
+    Begin/end of utterance state machine on top of a VoiceActivityDetector.
+
+    An utterance begins after min_speech_ms of consecutive speech frames
+    and the recording ends once hangover_ms of non-speech frames have
+    followed it.
+    """
+
+    # States
+    BEFORE_UTTERANCE = 0
+    DURING_UTTERANCE = 1
+    AFTER_UTTERANCE = 2
+
+    def __init__(self, vad, hangover_ms=300, min_speech_ms=60):
+        """
+        Arguments:
+            vad -- the VoiceActivityDetector classifying the frames
+            hangover_ms -- (optional) milliseconds of non-speech that end
+                           the recording (Default: 300)
+            min_speech_ms -- (optional) milliseconds of speech that begin
+                             an utterance (Default: 60)
+        """
+        self._logger = logging.getLogger(__name__)
+        self.vad = vad
+        self.hangover_frames = max(1, int(hangover_ms / vad.frame_ms))
+        self.min_speech_frames = max(1, int(min_speech_ms / vad.frame_ms))
+        self.state = self.BEFORE_UTTERANCE
+        self.utterances = 0
+        self.speech_frames = 0
+        self.post_utterance_frames = 0
+        # samples of an incomplete frame from the previous block
+        self._pending = ''
+
+    def feed(self, data):
+        """
+        Processes a block of audio.
+
+        Returns:
+            None if more audio is needed, otherwise the number of samples
+            of this block up to (and including) the frame that ended
+            the recording
+        """
+        carried = len(self._pending) // 2
+        data = self._pending + data
+        nframes = len(data) // (2 * self.vad.frame_length)
+        self._pending = data[nframes * 2 * self.vad.frame_length:]
+        for i, speech in enumerate(self.vad.classify(data)):
+            if speech:
+                self.speech_frames += 1
+                self.post_utterance_frames = 0
+                starts = (self.state == self.AFTER_UTTERANCE or
+                          self.speech_frames >= self.min_speech_frames)
+                if self.state != self.DURING_UTTERANCE and starts:
+                    if self.state == self.BEFORE_UTTERANCE:
+                        self._logger.debug('Begin utterance')
+                        self.utterances += 1
+                    self.state = self.DURING_UTTERANCE
+            else:
+                self.speech_frames = 0
+                if self.state == self.BEFORE_UTTERANCE:
+                    continue
+                if self.state != self.AFTER_UTTERANCE:
+                    self._logger.debug('End utterance')
+                self.state = self.AFTER_UTTERANCE
+                self.post_utterance_frames += 1
+                if self.post_utterance_frames >= self.hangover_frames:
+                    self._logger.debug('Enough post-utterance silence')
+                    self._pending = ''
+                    return (i + 1) * self.vad.frame_length - carried
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import os
+    import wave
+
+    import energy
+
+    parser = argparse.ArgumentParser(
+        description='Offline endpointer evaluation. Every WAV file in the ' +
+        'corpus needs an Audacity label file next to it (same name, ' +
+        '.txt extension) marking the speech; the end of the last label ' +
+        'is taken as the true end of the utterance.')
+    parser.add_argument('corpus', help='directory with WAV and label files')
+    parser.add_argument('--frame-ms', type=int, default=20)
+    parser.add_argument('--hangover-ms', type=int, default=300)
+    parser.add_argument('--aggressiveness', type=int, default=1)
+    parser.add_argument('--tail', type=float, default=3,
+                        help='seconds of silence appended to every file')
+    parser.add_argument('--block', type=int, default=1024,
+                        help='samples per feed() call, like Mic.READ_CHUNK')
+    args = parser.parse_args()
+
+    def load(path):
+        wav = wave.open(path, 'rb')
+        if wav.getnchannels() != 1 or wav.getsampwidth() != 2:
+            raise ValueError("%s is not 16 bit mono" % path)
+        rate = wav.getframerate()
+        data = wav.readframes(wav.getnframes())
+        wav.close()
+        return rate, data
+
+    def speech_end(path):
+        end = None
+        with open(path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2:
+                    end = max(end, float(fields[1]))
+        return end
+
+    def run(endpointer, data, block):
+        for offset in range(0, len(data), block * 2):
+            end = endpointer.feed(data[offset:offset + block * 2])
+            if end is not None:
+                return offset // 2 + end
+        return None
+
+    def energy_endpointer(rate, data):
+        # the threshold Mic would have measured on the leading second
+        noise = data[:rate * 2]
+        scores = energy.frame_scores(noise, 32)
+        threshold = int(scores.mean()) * 1.8
+        return energy.EnergyEndpointer(threshold, rate, 32)
+
+    def vad_endpointer(rate, data):
+        vad = VoiceActivityDetector(rate, frame_ms=args.frame_ms,
+                                    aggressiveness=args.aggressiveness)
+        return VADEndpointer(vad, hangover_ms=args.hangover_ms)
+
+    results = dict((name, []) for name in ('energy', 'vad'))
+    files = sorted(glob.glob(os.path.join(args.corpus, '*.wav')))
+    for path in files:
+        label = os.path.splitext(path)[0] + '.txt'
+        if not os.path.exists(label):
+            print("Skipping %s, no label file" % path)
+            continue
+        rate, data = load(path)
+        truth = speech_end(label)
+        rng = np.random.RandomState(0)
+        tail = rng.normal(0, 1, int(args.tail * rate)).astype('<i2')
+        data += tail.tostring()
+        for name, factory in (('energy', energy_endpointer),
+                              ('vad', vad_endpointer)):
+            end = run(factory(rate, data), data, args.block)
+            if end is None:
+                end = len(data) // 2
+            results[name].append(end / float(rate) - truth)
+
+    if not results['vad']:
+        parser.error("no labelled WAV files in %s" % args.corpus)
+    print("%d files" % len(results['vad']))
+    for name, latencies in sorted(results.items()):
+        latencies = np.array(latencies)
+        cutoffs = (latencies < 0).sum()
+        print("%-7s latency median %6.0f ms, 90%% %6.0f ms, "
+              "false cutoffs %d (%.1f%%)" %
+              (name, 1000 * np.median(latencies),
+               1000 * np.percentile(latencies, 90), cutoffs,
+               100.0 * cutoffs / len(latencies)))
@@ -2,6 +2,9 @@
 """
 Iterates over all the WORDS variables in the modules and creates a
 vocabulary for the respective stt_engine if needed.
+
+Instead of a list of phrases, the PocketSphinx and Julius vocabularies can
+be compiled from a grammar.Grammar (see the GRAMMAR of modules).
 """
 
 import os
@@ -17,6 +20,7 @@ from abc import ABCMeta, abstractmethod, abstractproperty
 import yaml
 
 import brain
+import grammar
 import jasperpath
 
 from g2p import PhonetisaurusG2P
@@ -43,11 +47,14 @@ class AbstractVocabulary(object):
         Calculates a revision from phrases by using the SHA1 hash function.
 
         Arguments:
-            phrases -- a list of phrases
+            phrases -- a list of phrases, or a grammar.Grammar
 
         Returns:
             A revision string for given phrases.
         """
+        if isinstance(phrases, grammar.Grammar):
+            # with a prefix, so it doesn't match a list of the same lines
+            phrases = ['GRAMMAR'] + phrases.lines
         sorted_phrases = sorted(phrases)
         joined_phrases = '\n'.join(sorted_phrases)
         sha1 = hashlib.sha1()
@@ -226,17 +233,28 @@ class PocketsphinxVocabulary(AbstractVocabulary):
         """
         return os.path.join(self.path, 'dictionary')
 
+    @property
+    def grammar_file(self):
+        """
+        Returns:
+            The path of the JSGF grammar file as string, which is used
+            instead of the languagemodel if the vocabulary has been
+            compiled from a grammar
+        """
+        return os.path.join(self.path, 'grammar')
+
     @property
     def is_compiled(self):
         """
         Checks if the vocabulary is compiled by checking if the revision,
-        languagemodel and dictionary files are readable.
+        languagemodel (or grammar) and dictionary files are readable.
 
         Returns:
             True if this vocabulary has been compiled, else False
         """
         return (super(self.__class__, self).is_compiled and
-                os.access(self.languagemodel_file, os.R_OK) and
+                (os.access(self.languagemodel_file, os.R_OK) or
+                 os.access(self.grammar_file, os.R_OK)) and
                 os.access(self.dictionary_file, os.R_OK))
 
     @property
@@ -247,23 +265,39 @@ class PocketsphinxVocabulary(AbstractVocabulary):
 
         Returns:
             A dict containing kwargs for the pocketsphinx.Decoder.__init__()
-            method.
+            method, with 'jsgf' instead of 'lm' if the vocabulary has been
+            compiled from a grammar.
 
         Example:
             decoder = pocketsphinx.Decoder(**vocab_instance.decoder_kwargs,
                                            hmm='/path/to/hmm')
 
         """
+        if os.access(self.grammar_file, os.R_OK):
+            return {'jsgf': self.grammar_file, 'dict': self.dictionary_file}
         return {'lm': self.languagemodel_file, 'dict': self.dictionary_file}
 
     def _compile_vocabulary(self, phrases):
         """
         Compiles the vocabulary to the Pocketsphinx format by creating a
-        languagemodel and a dictionary.
+        languagemodel (or a JSGF grammar) and a dictionary.
 
         Arguments:
-            phrases -- a list of phrases that this vocabulary will contain
-        """
+            phrases -- a list of phrases that this vocabulary will contain,
+                       or a grammar.Grammar
+        """
+        # whichever of them is left from the last compilation would be used
+        for filename in (self.languagemodel_file, self.grammar_file):
+            if os.path.exists(filename):
+                os.remove(filename)
+        if isinstance(phrases, grammar.Grammar):
+            self._logger.debug("Creating grammar file: '%s'",
+                               self.grammar_file)
+            with open(self.grammar_file, 'w') as f:
+                f.write(phrases.to_jsgf(re.sub(r'\W', '_', self.name)))
+            self._logger.debug('Starting dictionary...')
+            self._compile_dictionary(phrases.words, self.dictionary_file)
+            return
         text = " ".join([("<s> %s </s>" % phrase) for phrase in phrases])
         self._logger.debug('Compiling languagemodel...')
         vocabulary = self._compile_languagemodel(text, self.languagemodel_file)
@@ -394,13 +428,23 @@ class JuliusVocabulary(AbstractVocabulary):
                 os.access(self.dict_file, os.R_OK))
 
     def _get_grammar(self, phrases):
+        if isinstance(phrases, grammar.Grammar):
+            return phrases.to_julius()[0]
         return {'S': [['NS_B', 'WORD_LOOP', 'NS_E']],
                 'WORD_LOOP': [['WORD_LOOP', 'WORD'], ['WORD']]}
 
     def _get_word_defs(self, lexicon, phrases):
         word_defs = {'NS_B': [('<s>', 'sil')],
-                     'NS_E': [('</s>', 'sil')],
-                     'WORD': []}
+                     'NS_E': [('</s>', 'sil')]}
+
+        if isinstance(phrases, grammar.Grammar):
+            for category, words in phrases.to_julius()[1].items():
+                word_defs[category] = [(word, phoneme) for word in words
+                                       for phoneme
+                                       in lexicon.translate_word(word)]
+            return word_defs
+
+        word_defs['WORD'] = []
 
         words = []
         for phrase in phrases:
@@ -491,6 +535,21 @@ def get_phrases_from_module(module):
 def get_instance_phrases_from_module(module):
     return module.INSTANCE_WORDS if hasattr(module, 'INSTANCE_WORDS') else get_phrases_from_module(module)
 
+
+def get_grammar_from_module(module):
+    """
+    Gets the grammar of a module.
+
+    Arguments:
+        module -- a module reference
+
+    Returns:
+        A grammar.Grammar of the GRAMMAR of the module, or None if it
+        has none.
+    """
+    return grammar.Grammar(module.GRAMMAR) if hasattr(module, 'GRAMMAR') \
+        else None
+
 def get_keyword_phrases():
     """
     Gets the keyword phrases from the keywords file in the jasper data dir.
@@ -502,13 +561,36 @@ def get_keyword_phrases():
 
     with open(jasperpath.data('keyword_phrases'), mode="r") as f:
         for line in f:
-            phrase = line.strip()
+            # without the threshold, see get_keyword_thresholds()
+            phrase = line.split('/', 1)[0].strip()
             if phrase:
                 phrases.append(phrase)
 
     return phrases
 
 
+def get_keyword_thresholds():
+    """
+    Gets the detection thresholds of the keyword phrases that have one in
+    the keywords file, which are given like in a PocketSphinx keyphrase
+    file:
+
+        JASPER /1e-20/
+
+    Returns:
+        A dict of the thresholds, by keyword phrase.
+    """
+    thresholds = {}
+
+    with open(jasperpath.data('keyword_phrases'), mode="r") as f:
+        for line in f:
+            fields = line.split('/')
+            if len(fields) >= 3 and fields[0].strip():
+                thresholds[fields[0].strip()] = float(fields[1])
+
+    return thresholds
+
+
 def get_all_instance_phrases():
     """
     Gets instance phrases for all modules.
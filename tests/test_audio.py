@@ -0,0 +1,61 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import threading
+import time
+from client import audio
+
+
+class TestDeviceArbiter(unittest.TestCase):
+
+    def testReentrant(self):
+        arbiter = audio.DeviceArbiter()
+        with arbiter.claim(audio.LISTEN, 'listen'):
+            with arbiter.claim(audio.SPEAK, 'cue'):
+                self.assertEqual(arbiter.name, 'listen')
+            self.assertEqual(arbiter.name, 'listen')
+        self.assertIsNone(arbiter.name)
+
+    def testReleaseNotHeld(self):
+        arbiter = audio.DeviceArbiter()
+        with self.assertRaises(RuntimeError):
+            arbiter.release()
+
+    def testTimeout(self):
+        arbiter = audio.DeviceArbiter()
+        arbiter.acquire(audio.SPEAK)
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(arbiter.acquire(audio.LISTEN,
+                                                         timeout=0.05)))
+        thread.start()
+        thread.join()
+        self.assertEqual(result, [False])
+        self.assertEqual(arbiter.waiting, 0)
+        arbiter.release()
+
+    def testPriorityOrder(self):
+        arbiter = audio.DeviceArbiter()
+        order = []
+
+        def worker(priority, name):
+            with arbiter.claim(priority, name):
+                order.append(name)
+
+        arbiter.acquire(audio.BACKGROUND)
+        threads = []
+        for priority, name in ((audio.BACKGROUND, 'background'),
+                               (audio.SPEAK, 'speak 1'),
+                               (audio.LISTEN, 'listen'),
+                               (audio.SPEAK, 'speak 2')):
+            thread = threading.Thread(target=worker, args=(priority, name))
+            thread.start()
+            threads.append(thread)
+            # make sure the threads queue up in this order
+            while arbiter.waiting < len(threads):
+                time.sleep(0.001)
+        arbiter.release()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(order, ['listen', 'speak 1', 'speak 2',
+                                 'background'])
@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import imp
+import os
+import shutil
+import tempfile
+from client import audioprobe
+
+
+def pyaudio_installed():
+    try:
+        imp.find_module('pyaudio')
+    except ImportError:
+        return False
+    else:
+        return True
+
+
+class FakePyAudio(object):
+    """A USB handset that captures at 16 kHz and plays at 48 kHz."""
+
+    def __init__(self):
+        self.checks = 0
+
+    def get_device_count(self):
+        return 2
+
+    def get_device_info_by_index(self, index):
+        return {'name': ['default', 'USB Handset: Audio (hw:1,0)'][index],
+                'hostApi': 0, 'maxInputChannels': 1, 'maxOutputChannels': 2,
+                'defaultSampleRate': 48000.0,
+                'defaultLowInputLatency': 0.01,
+                'defaultHighInputLatency': 0.1,
+                'defaultLowOutputLatency': 0.02,
+                'defaultHighOutputLatency': 0.2}
+
+    def get_host_api_info_by_index(self, index):
+        return {'name': 'ALSA'}
+
+    def is_format_supported(self, rate, input_device=None,
+                            output_device=None, **kwargs):
+        self.checks += 1
+        if input_device is not None:
+            if rate not in (16000, 48000):
+                raise ValueError('Invalid sample rate')
+        elif rate != 48000 or kwargs['output_channels'] != 2:
+            raise ValueError('Invalid sample rate')
+        return True
+
+    def terminate(self):
+        pass
+
+
+@unittest.skipUnless(pyaudio_installed(), "PyAudio not present")
+class TestProbe(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.cache = os.path.join(self.tempdir, 'audio_devices.yml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testProbe(self):
+        pa = FakePyAudio()
+        index = audioprobe.find_alsa_device(pa, 1)
+        self.assertEqual(index, 1)
+        caps = audioprobe.get_capabilities(index, audio=pa,
+                                           cache_path=self.cache)
+        self.assertEqual(caps['input']['rates'], [16000, 48000])
+        self.assertEqual(caps['input']['channels'], [1])
+        # a device that only plays stereo
+        self.assertEqual(caps['output']['rates'], [48000])
+        self.assertEqual(caps['output']['formats'],
+                         ['int16', 'int32', 'float32'])
+        self.assertEqual(caps['output']['channels'], [2])
+        self.assertTrue(audioprobe.supports_playback(caps, 48000, 2, 2))
+        self.assertEqual(caps['output']['latency'], [0.02, 0.2])
+        self.assertEqual(audioprobe.choose_capture_rate(caps, 16000), 16000)
+
+    def testCache(self):
+        pa = FakePyAudio()
+        caps = audioprobe.get_capabilities(1, audio=pa,
+                                           cache_path=self.cache)
+        checks = pa.checks
+        self.assertEqual(audioprobe.get_capabilities(1, audio=pa,
+                                                     cache_path=self.cache),
+                         caps)
+        self.assertEqual(pa.checks, checks)
+        audioprobe.get_capabilities(1, audio=pa, refresh=True,
+                                    cache_path=self.cache)
+        self.assertGreater(pa.checks, checks)
+
+    def testOutdatedCache(self):
+        pa = FakePyAudio()
+        identity = audioprobe.device_identity(pa, 1)
+        with open(self.cache, 'w') as f:
+            f.write("'%s': {name: old, default_rate: 48000, " % identity +
+                    "output: {rates: [], formats: [], channels: [2]}}\n")
+        caps = audioprobe.get_capabilities(1, audio=pa,
+                                           cache_path=self.cache)
+        self.assertEqual(caps['output']['rates'], [48000])
+
+
+class TestChoose(unittest.TestCase):
+
+    def testCaptureRate(self):
+        def caps(rates):
+            return {'default_rate': 44100, 'input': {'rates': rates}}
+        self.assertEqual(audioprobe.choose_capture_rate(
+            caps([16000, 44100, 48000]), 16000), 16000)
+        self.assertEqual(audioprobe.choose_capture_rate(
+            caps([22050, 44100, 48000]), 16000), 48000)
+        self.assertEqual(audioprobe.choose_capture_rate(
+            caps([8000, 22050, 44100]), 16000), 22050)
+        self.assertEqual(audioprobe.choose_capture_rate(caps([]), 16000),
+                         44100)
+
+    def testPlayback(self):
+        caps = {'output': {'rates': [44100, 48000], 'formats': ['int16'],
+                           'channels': [2]}}
+        self.assertTrue(audioprobe.supports_playback(caps, 48000, 2, 2))
+        self.assertFalse(audioprobe.supports_playback(caps, 22050, 2, 2))
+        self.assertFalse(audioprobe.supports_playback(caps, 48000, 2, 1))
+        self.assertFalse(audioprobe.supports_playback({}, 48000, 2, 2))
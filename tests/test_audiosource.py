@@ -0,0 +1,309 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import imp
+import os
+import shutil
+import tempfile
+import time
+import wave
+import mock
+import numpy as np
+from client import audiosource, capture
+
+
+def pyaudio_installed():
+    try:
+        imp.find_module('pyaudio')
+    except ImportError:
+        return False
+    else:
+        return True
+
+
+def write_wav(path, samples, rate=16000):
+    wav = wave.open(path, 'wb')
+    wav.setnchannels(1)
+    wav.setsampwidth(2)
+    wav.setframerate(rate)
+    wav.writeframes(samples.astype('<i2').tostring())
+    wav.close()
+
+
+def bursts(frames, position, rate=16000):
+    # a loud 440 Hz tone from 2 to 3 seconds, every 5 seconds
+    t = np.arange(position, position + frames) / float(rate)
+    loud = (t % 5 >= 2) & (t % 5 < 3)
+    return np.where(loud, 6000 * np.sin(2 * np.pi * 440 * t), 0)
+
+
+class TestWavSource(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.samples = np.arange(-5000, 5000, dtype=np.int16)
+        write_wav(os.path.join(self.tempdir, 'a.wav'), self.samples)
+        write_wav(os.path.join(self.tempdir, 'b.wav'), self.samples[::-1])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testReplayDirectory(self):
+        source = audiosource.WavSource(self.tempdir, realtime=False, gap=0.1)
+        self.assertEqual(source.rate, 16000)
+        self.assertEqual([(start, end) for path, start, end in source.files],
+                         [(0, 10000), (11600, 21600)])
+        stream = capture.CaptureStream(None, source.rate, source=source)
+        try:
+            # the source may already be running ahead, so read from the start
+            reader = capture.CaptureReader(stream.buffer, 0)
+            data = np.frombuffer(reader.read(25000), dtype='<i2')
+        finally:
+            stream.close()
+        self.assertTrue(np.array_equal(data[:10000], self.samples))
+        self.assertFalse(data[10000:11600].any())
+        self.assertTrue(np.array_equal(data[11600:21600], self.samples[::-1]))
+        # followed by silence
+        self.assertTrue(source.finished.is_set())
+        self.assertFalse(data[21600:].any())
+
+    def testResample(self):
+        source = audiosource.WavSource(self.tempdir, rate=8000)
+        self.assertEqual(source.files[0][2], 5000)
+
+
+class TestSyntheticSource(unittest.TestCase):
+
+    def testRealtime(self):
+        source = audiosource.SyntheticSource(16000, chunk=160)
+        stream = capture.CaptureStream(None, 16000, source=source)
+        try:
+            reader = stream.reader()
+            start = time.time()
+            reader.read(3200)
+            elapsed = time.time() - start
+        finally:
+            stream.close()
+        self.assertGreater(elapsed, 0.15)
+
+    def testFast(self):
+        source = audiosource.SyntheticSource(16000, realtime=False,
+                                             func=bursts)
+        stream = capture.CaptureStream(None, 16000, source=source)
+        try:
+            # without readers, the source only runs ahead by the lead
+            time.sleep(0.2)
+            self.assertEqual(stream.buffer.position, 16384)
+            reader = stream.reader()
+            start = time.time()
+            data = np.frombuffer(reader.read(16000 * 5), dtype='<i2')
+            elapsed = time.time() - start
+        finally:
+            stream.close()
+        self.assertLess(elapsed, 2.5)
+        # the burst from 2 to 3 seconds
+        loud = np.flatnonzero(np.abs(data) > 1000)
+        self.assertAlmostEqual(loud[0], 32000 - 16384, delta=10)
+        self.assertAlmostEqual(loud[-1], 48000 - 16384, delta=10)
+
+
+class FakeSTT(object):
+    SUPPORTS_STREAMING = False
+
+    def __init__(self, result):
+        self.result = result
+        self.received = []
+
+    def transcribe_pcm(self, data, rate, width=2):
+        self.received.append((len(data) // 2, rate))
+        return self.result
+
+
+class FakeSpotter(object):
+    """Spots JASPER in loud audio."""
+
+    def __init__(self, keyphrases):
+        self.keyphrases = keyphrases
+        self.fed = 0
+        self.spotted_at = None
+
+    def start(self, rate, width=2):
+        self.running = True
+
+    def feed(self, chunk):
+        self.fed += len(chunk) // 2
+        if np.abs(np.frombuffer(chunk, dtype='<i2')).max() > 1000:
+            self.spotted_at = self.fed
+            return 'JASPER'
+
+    def stop(self):
+        self.running = False
+
+
+class FakeSpottingSTT(FakeSTT):
+
+    def keyword_spotter(self, keyphrases):
+        self.spotter = FakeSpotter(keyphrases)
+        return self.spotter
+
+
+class FakeChoicesSTT(FakeSTT):
+
+    def get_choices_instance(self, choices):
+        self.choices.append(choices)
+        return FakeSTT([choices[-1]])
+
+
+class FakeRejectingSTT(FakeSTT):
+
+    def get_choices_instance(self, choices):
+        # heard none of the choices
+        return FakeSTT([''])
+
+
+class FakeEndpointer(object):
+    """Ends the recording after a fixed number of samples."""
+
+    def __init__(self, frames):
+        self.left = frames
+
+    def feed(self, data):
+        n = len(data) // 2
+        if n < self.left:
+            self.left -= n
+            return None
+        return self.left
+
+
+class FakeCues(object):
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def play(self, name):
+        return self.seconds
+
+
+class FakeSpeaker(object):
+
+    def play(self, filename):
+        pass
+
+    def say(self, phrase):
+        pass
+
+
+@unittest.skipUnless(pyaudio_installed(), "PyAudio not present")
+class TestMicReplay(unittest.TestCase):
+
+    def setUp(self):
+        from client import local_phone, mic
+        self.source = audiosource.SyntheticSource(16000, realtime=False,
+                                                  func=bursts)
+        self.passive = FakeSTT(['JASPER'])
+        self.active = FakeSTT(['WHAT TIME IS IT'])
+        with mock.patch('client.phone.get_phone',
+                        local_phone.Phone.get_phone):
+            self.mic = mic.Mic(FakeSpeaker(), self.passive, self.active,
+                               source=self.source)
+
+    def tearDown(self):
+        self.source.stop()
+
+    def testPassiveListen(self):
+        threshold, persona = self.mic.passiveListen('JASPER')
+        self.assertEqual(persona, 'JASPER')
+        self.assertGreater(threshold, 0)
+        # the audio from right before the disturbance, plus one second
+        self.assertEqual(self.passive.received,
+                         [(20480 * 16000 / 44100 + 16000, 16000)])
+
+    def testKeywordSpotting(self):
+        self.mic.passive_stt_engine = FakeSpottingSTT([])
+        threshold, persona = self.mic.passiveListen('JASPER')
+        self.assertEqual(persona, 'JASPER')
+        self.assertGreater(threshold, 0)
+        spotter = self.mic.passive_stt_engine.spotter
+        self.assertEqual(spotter.keyphrases, {'JASPER': 1e-20})
+        self.assertFalse(spotter.running)
+        # spotted within a block of the start of the burst, nothing
+        # transcribed
+        self.assertEqual(self.mic.passive_stt_engine.received, [])
+        self.assertLess(spotter.spotted_at - 2 * 16000,
+                        self.mic.READ_CHUNK)
+
+    def testKeywordSpottingContinues(self):
+        self.mic.passive_stt_engine = FakeSpottingSTT([])
+        self.mic.passiveListen('JASPER')
+        spotter = self.mic.passive_stt_engine.spotter
+        spotter.feed = lambda chunk: None
+        self.assertEqual(self.mic.passiveListen('JASPER'), (None, None))
+        position = self.mic._kws_reader.position
+        self.mic.passiveListen('JASPER')
+        # the next call starts shortly before where the last one stopped
+        self.assertEqual(self.mic._kws_reader.position - position,
+                         10 * 16000 - 8000)
+
+    def testActiveListen(self):
+        self.mic.passiveListen('JASPER')
+        self.mic.PREROLL = 1
+        self.assertEqual(self.mic.activeListenToAllOptions(),
+                         ['WHAT TIME IS IT'])
+        frames, rate = self.active.received[0]
+        self.assertEqual(rate, 16000)
+        # a second of preroll, the rest of the burst and the time it takes
+        # the energy average to decay
+        self.assertGreater(frames, 16000 * 1.2)
+        self.assertLess(frames, 16000 * 2.5)
+
+    def testNoNoiseFloor(self):
+        self.mic.passiveListen('JASPER')
+        # as if the capture stream had just started
+        with mock.patch.object(self.mic.noise_floor, 'wait',
+                               return_value=None):
+            self.assertEqual(self.mic.activeListenToAllOptions(),
+                             ['WHAT TIME IS IT'])
+            self.assertGreater(self.mic.fetchThreshold(), 0)
+
+    def testReleaseOnError(self):
+        self.mic.passiveListen('JASPER')
+        self.mic._cues = FakeCues(0.5)
+        with mock.patch.object(self.mic._cues, 'play',
+                               side_effect=IOError('no sound card')):
+            with self.assertRaises(IOError):
+                self.mic.activeListenToAllOptions()
+        self.assertIsNone(self.mic._arbiter.name)
+
+    def testSkipCue(self):
+        self.mic.passiveListen('JASPER')
+        self.mic._cues = FakeCues(0.5)
+        self.mic._get_endpointer = lambda threshold: FakeEndpointer(8000)
+        self.mic.activeListenToAllOptions()
+        # neither the preroll nor the beep is transcribed, just what the
+        # endpointer heard after it
+        self.assertEqual(self.active.received, [(8000, 16000)])
+
+    def testActiveListenChoices(self):
+        self.mic.passiveListen('JASPER')
+        # engines that can't narrow down their vocabulary, filtered
+        self.assertEqual(self.mic.activeListenToAllOptions(
+            choices=['YES', 'NO']), [])
+        self.assertEqual(self.mic.activeListen(
+            choices=['what time is it', 'NO']), 'WHAT TIME IS IT')
+
+        self.mic.active_stt_engine = FakeChoicesSTT(['WHAT TIME IS IT'])
+        self.mic.active_stt_engine.choices = []
+        for i in range(2):
+            self.mic.passiveListen('JASPER')
+            self.assertEqual(self.mic.activeListen(choices=['YES', 'NO']),
+                             'YES')
+        # compiled once, and the full vocabulary isn't used
+        self.assertEqual(self.mic.active_stt_engine.choices, [('NO', 'YES')])
+        self.assertEqual(self.mic.active_stt_engine.received, [])
+        self.mic.passiveListen('JASPER')
+        self.assertEqual(self.mic.activeListen(), 'WHAT TIME IS IT')
+
+        # the caller is asked again
+        self.mic.active_stt_engine = FakeRejectingSTT(['YES'])
+        self.mic.passiveListen('JASPER')
+        self.assertIsNone(self.mic.activeListen(choices=['YES', 'NO']))
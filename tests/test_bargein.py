@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import os
+import tempfile
+import time
+import wave
+import numpy as np
+from client import audiosource, bargein, capture
+
+RATE = 16000
+
+
+def speech(frames, position, amplitude=8000):
+    # a 300 Hz tone, switched on and off four times a second like syllables
+    t = np.arange(position, position + frames) / float(RATE)
+    on = (t * 4) % 1 < 0.6
+    return np.where(on, amplitude * np.sin(2 * np.pi * 300 * t), 0)
+
+
+def pcm(samples):
+    return np.clip(np.round(samples), -32768, 32767).astype('<i2').tostring()
+
+
+class TestBargeInDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.reference = speech(3 * RATE, 0)
+        self.rng = np.random.RandomState(0)
+
+    def run_detector(self, mic, block=640, **kwargs):
+        detector = bargein.BargeInDetector(RATE, **kwargs)
+        detector.noise_rms = 90
+        detector.start(self.reference, RATE, 0)
+        data = pcm(mic)
+        for offset in range(0, len(mic), block):
+            onset = detector.feed(data[offset * 2:(offset + block) * 2],
+                                  offset)
+            if onset is not None:
+                return detector, onset
+        return detector, None
+
+    def echo(self, gain=0.1, delay=2400):
+        mic = self.rng.normal(0, 30, len(self.reference) + RATE)
+        mic[delay:delay + len(self.reference)] += gain * self.reference
+        return mic
+
+    def testEchoDoesNotTrigger(self):
+        detector, onset = self.run_detector(self.echo())
+        self.assertIsNone(onset)
+        # the echo gain is being learned
+        self.assertLess(detector.echo_gain, 0.5)
+        detector, onset = self.run_detector(self.echo(), echo_gain=0.05)
+        self.assertIsNone(onset)
+        self.assertAlmostEqual(detector.echo_gain, 0.1, delta=0.03)
+
+    def testCallerTriggers(self):
+        mic = self.echo()
+        start = int(1.6 * RATE)
+        mic[start:] += 3000 * np.sin(2 * np.pi * 1000 *
+                                     np.arange(len(mic) - start) /
+                                     float(RATE))
+        detector, onset = self.run_detector(mic, echo_gain=0.1)
+        self.assertIsNotNone(onset)
+        self.assertLessEqual(abs(onset - start), 160)
+
+    def testDelayTooLong(self):
+        # an echo later than max_delay_ms looks like the caller
+        detector, onset = self.run_detector(self.echo(gain=0.5, delay=RATE),
+                                            echo_gain=0.1)
+        self.assertIsNotNone(onset)
+
+
+class FakeSpeaker(object):
+
+    def __init__(self, reference):
+        self.reference = reference
+        self.playback_monitor = None
+
+    def say(self, phrase):
+        monitor = self.playback_monitor
+        monitor.started(self.reference)
+        start = time.time()
+        while not monitor.interrupted and time.time() - start < 5:
+            time.sleep(0.01)
+        monitor.stopped()
+
+
+class TestBargeIn(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.reference = tempfile.mkstemp(suffix='.wav')
+        os.close(fd)
+        wav = wave.open(self.reference, 'wb')
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(RATE)
+        wav.writeframes(pcm(np.zeros(3 * RATE)))
+        wav.close()
+
+    def tearDown(self):
+        os.remove(self.reference)
+
+    def testInterrupt(self):
+        # the caller starts talking 2 seconds into the capture
+        source = audiosource.SyntheticSource(
+            RATE, chunk=160, realtime=False,
+            func=lambda frames, position: speech(frames, position - 2 * RATE)
+            * (np.arange(position, position + frames) >= 2 * RATE))
+        stream = capture.CaptureStream(None, RATE, source=source)
+        try:
+            barge_in = bargein.BargeIn(stream, bargein.BargeInDetector(RATE))
+            speaker = FakeSpeaker(self.reference)
+            with barge_in.monitoring(speaker, noise_rms=90):
+                speaker.say('hello')
+            self.assertIsNone(speaker.playback_monitor)
+            self.assertTrue(barge_in.interrupted)
+            onset = barge_in.take()
+            self.assertLessEqual(abs(onset - 2 * RATE), 160)
+            self.assertFalse(barge_in.interrupted)
+            self.assertIsNone(barge_in.take())
+        finally:
+            stream.close()
+        self.assertEqual((barge_in.playbacks, barge_in.triggers), (1, 1))
+        barge_in.record(False)
+        self.assertEqual(barge_in.false_triggers, 1)
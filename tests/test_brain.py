@@ -2,7 +2,7 @@
 # -*- coding: utf-8-*-
 import unittest
 import mock
-from client import brain, test_mic
+from client import brain, stt, test_mic
 
 
 DEFAULT_PROFILE = {
@@ -47,3 +47,26 @@ class TestBrain(unittest.TestCase):
         with mock.patch.object(hn, 'handle') as mocked_handle:
             my_brain.query(["hacker news"])
             self.assertTrue(mocked_handle.called)
+
+    def testCandidatesInScoreOrder(self):
+        """Does Brain try less likely transcriptions before giving up?"""
+        my_brain = TestBrain._emptyBrain()
+        time = mock.Mock(__name__='Time', PRIORITY=0,
+                         isValid=lambda text: 'TIME' in text)
+        hello = mock.Mock(__name__='Hello', PRIORITY=100,
+                          isValid=lambda text: 'HELLO' in text)
+        unclear = mock.Mock(__name__='Unclear', PRIORITY=-100,
+                            isValid=lambda text: True)
+        my_brain.modules = [hello, time, unclear]
+
+        my_brain.query([stt.Hypothesis('WHAT DIME', 0.5),
+                        stt.Hypothesis('HELLO', 0.2),
+                        stt.Hypothesis('WHAT TIME', 0.3)])
+        self.assertFalse(unclear.handle.called)
+        self.assertFalse(hello.handle.called)
+        time.handle.assert_called_once_with('WHAT TIME', my_brain.mic,
+                                            my_brain.profile)
+
+        my_brain.query([stt.Hypothesis('WHAT DIME', 0.9)])
+        unclear.handle.assert_called_once_with('WHAT DIME', my_brain.mic,
+                                               my_brain.profile)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import multiprocessing
+import threading
+import time
+import numpy as np
+from client import audiosource, capture
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def testWriteRead(self):
+        ring = capture.RingBuffer(8, width=2)
+        ring.write('aabbcc')
+        self.assertEqual(ring.position, 3)
+        self.assertEqual(ring.read(0, 3), 'aabbcc')
+        self.assertEqual(ring.read(1, 1), 'bb')
+
+    def testWrapAround(self):
+        ring = capture.RingBuffer(4, width=2)
+        ring.write('aabbcc')
+        ring.write('ddeeff')
+        self.assertEqual(ring.position, 6)
+        self.assertEqual(ring.oldest, 2)
+        self.assertEqual(ring.read(2, 4), 'ccddeeff')
+        with self.assertRaises(ValueError):
+            ring.read(1, 2)
+        with self.assertRaises(ValueError):
+            ring.read(5, 2)
+
+    def testWaitFor(self):
+        ring = capture.RingBuffer(16, width=2)
+        self.assertFalse(ring.wait_for(1, timeout=0.01))
+        timer = threading.Timer(0.05, ring.write, args=('xx',))
+        timer.start()
+        self.assertTrue(ring.wait_for(1, timeout=2))
+        timer.join()
+
+
+class TestCaptureReader(unittest.TestCase):
+
+    def testPreroll(self):
+        ring = capture.RingBuffer(16, width=2)
+        ring.write('00112233')
+        reader = capture.CaptureReader(ring, ring.position - 2)
+        self.assertEqual(reader.available, 2)
+        self.assertEqual(reader.read(2), '2233')
+        self.assertEqual(reader.available, 0)
+
+    def testBlockingRead(self):
+        ring = capture.RingBuffer(16, width=2)
+        reader = capture.CaptureReader(ring, 0)
+
+        def writer():
+            for chunk in ('aa', 'bb', 'cc'):
+                time.sleep(0.01)
+                ring.write(chunk)
+        thread = threading.Thread(target=writer)
+        thread.start()
+        self.assertEqual(reader.read(3), 'aabbcc')
+        thread.join()
+
+    def testTimeout(self):
+        ring = capture.RingBuffer(16, width=2)
+        reader = capture.CaptureReader(ring, 0, timeout=0.01)
+        with self.assertRaises(IOError):
+            reader.read(1)
+
+    def testOverrun(self):
+        ring = capture.RingBuffer(4, width=2)
+        reader = capture.CaptureReader(ring, 0)
+        ring.write('aabbccddeeff')
+        self.assertEqual(reader.read(2), 'ccdd')
+        self.assertEqual(reader.overruns, 1)
+
+    def testOverrunWhileReading(self):
+        ring = RacingRingBuffer(4, width=2)
+        reader = capture.CaptureReader(ring, 0)
+        ring.write('aabbcc')
+        # the writer wraps around between the check and the read
+        ring.racing = 'ddeeff'
+        self.assertEqual(reader.read(2), 'ccdd')
+        self.assertEqual(reader.overruns, 1)
+        self.assertEqual(reader.position, 4)
+
+
+class RacingRingBuffer(capture.RingBuffer):
+    """A RingBuffer written to right before the next read."""
+
+    racing = None
+
+    def read(self, start, frames):
+        if self.racing is not None:
+            data, self.racing = self.racing, None
+            self.write(data)
+        return super(RacingRingBuffer, self).read(start, frames)
+
+
+def _write_in_child(ring, chunks):
+    for chunk in chunks:
+        ring.write(chunk)
+    ring.lost += 5
+
+
+class TestSharedRingBuffer(unittest.TestCase):
+
+    def testWriteRead(self):
+        ring = capture.SharedRingBuffer(4, width=2)
+        ring.write('aabbcc')
+        ring.write('ddeeff')
+        self.assertEqual(ring.position, 6)
+        self.assertEqual(ring.read(2, 4), 'ccddeeff')
+        with self.assertRaises(ValueError):
+            ring.read(1, 2)
+
+    def testView(self):
+        ring = capture.SharedRingBuffer(4, width=2)
+        ring.write(np.arange(6, dtype='<i2').tostring())
+        views = ring.view(2, 4)
+        self.assertEqual([v.tolist() for v in views], [[2, 3], [4, 5]])
+        self.assertTrue(ring.valid(2))
+        # the views point into the ring, so later writes overwrite them
+        ring.write(np.array([6], dtype='<i2').tostring())
+        self.assertEqual(views[0].tolist(), [6, 3])
+        self.assertFalse(ring.valid(2))
+
+    def testReadSamples(self):
+        ring = capture.SharedRingBuffer(4, width=2)
+        reader = capture.CaptureReader(ring, 0)
+        ring.write(np.arange(3, dtype='<i2').tostring())
+        samples = reader.read_samples(2)
+        self.assertEqual(samples.tolist(), [0, 1])
+        # points into the ring instead of being a copy
+        self.assertTrue(np.may_share_memory(samples, ring._samples))
+        self.assertTrue(reader.intact())
+        ring.write(np.arange(3, 5, dtype='<i2').tostring())
+        self.assertFalse(reader.intact())
+        # wraps around, so this one has to be copied
+        self.assertEqual(reader.read_samples(3).tolist(), [2, 3, 4])
+        self.assertTrue(reader.intact())
+
+    def testOtherProcess(self):
+        ring = capture.SharedRingBuffer(16, width=2)
+        reader = capture.CaptureReader(ring, 0)
+        child = multiprocessing.Process(target=_write_in_child,
+                                        args=(ring, ['aa', 'bb', 'cc']))
+        child.start()
+        self.assertEqual(reader.read(3), 'aabbcc')
+        child.join()
+        self.assertEqual(ring.lost, 5)
+
+
+class TestLossCounter(unittest.TestCase):
+
+    def testTimestamps(self):
+        count = audiosource._LossCounter(1000)
+        self.assertEqual(count(100, {'input_buffer_adc_time': 1.0}, 0), 0)
+        self.assertEqual(count(100, {'input_buffer_adc_time': 1.1}, 0), 0)
+        # the callback for 1.2 never happened
+        self.assertEqual(count(100, {'input_buffer_adc_time': 1.3}, 0), 100)
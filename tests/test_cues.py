@@ -0,0 +1,55 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import mock
+from client import cues
+
+
+class TestCuePlayer(unittest.TestCase):
+
+    def setUp(self):
+        self.backend = mock.Mock()
+        self.player = cues.CuePlayer(self.backend, 3)
+
+    def testLoad(self):
+        cue = self.player.cues['beep_hi']
+        self.assertEqual((cue.rate, cue.width, cue.channels), (44100, 2, 2))
+        self.assertAlmostEqual(cues.duration(cue), 9403 / 44100.0)
+
+    def testPlay(self):
+        seconds = self.player.play('beep_hi')
+        self.assertAlmostEqual(seconds, 9403 / 44100.0 +
+                               cues.CuePlayer.LATENCY)
+        self.player.play('beep_lo')
+        self.player.close()
+        # both on the same stream, which is closed at the end
+        self.backend.open_output.assert_called_once_with(
+            3, 44100, width=2, channels=2, start=False)
+        stream = self.backend.open_output.return_value
+        self.assertEqual([args[0] for args, kwargs in
+                          stream.write.call_args_list],
+                         [self.player.cues['beep_hi'].data,
+                          self.player.cues['beep_lo'].data])
+        self.assertEqual(stream.stop_stream.call_count, 2)
+        stream.close.assert_called_once_with()
+
+    def testPrepare(self):
+        self.player.prepare()
+        self.player.prepare()
+        self.player.close()
+        self.assertEqual(self.backend.open_output.call_count, 1)
+        self.player.play('beep_hi')
+        self.player.close()
+        self.assertEqual(self.backend.open_output.call_count, 2)
+
+    def testFailure(self):
+        stream = self.backend.open_output.return_value
+        stream.write.side_effect = IOError('device gone')
+        self.player.play('beep_hi')
+        self.player.close()
+        # the broken stream is closed and a new one opened next time
+        stream.close.assert_called_once_with()
+        stream.write.side_effect = None
+        self.player.play('beep_hi')
+        self.player.close()
+        self.assertEqual(self.backend.open_output.call_count, 2)
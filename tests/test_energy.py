@@ -0,0 +1,90 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import audioop
+import numpy as np
+from client import energy
+
+
+def make_audio(seconds, rate=16000, seed=0):
+    """Noise with a loud burst in the middle, as 16 bit PCM."""
+    rng = np.random.RandomState(seed)
+    samples = rng.normal(0, 200, int(seconds * rate))
+    start, end = int(0.3 * len(samples)), int(0.6 * len(samples))
+    samples[start:end] *= 20
+    return np.clip(samples, -32768, 32767).astype('<i2').tostring()
+
+
+class TestFrameScores(unittest.TestCase):
+
+    def testMatchesAudioop(self):
+        chunk = 32
+        data = make_audio(0.5)
+        expected = [audioop.rms(data[i:i + 2 * chunk], 2) / 3
+                    for i in range(0, len(data) - 2 * chunk + 1, 2 * chunk)]
+        scores = energy.frame_scores(data, chunk)
+        self.assertEqual(expected, scores.tolist())
+
+    def testIncompleteFrameIsIgnored(self):
+        self.assertEqual(len(energy.frame_scores('\x00\x01' * 40, 32)), 1)
+
+
+class TestMovingAverage(unittest.TestCase):
+
+    def testMatchesListImplementation(self):
+        rng = np.random.RandomState(1)
+        values = rng.randint(0, 1000, 500)
+        lastN = range(64)
+        average = energy.MovingAverage(range(64), dtype=np.int64)
+        sums = []
+        for start in range(0, len(values), 37):
+            sums.extend(average.push(values[start:start + 37]).tolist())
+        expected = []
+        for value in values:
+            lastN.pop(0)
+            lastN.append(value)
+            expected.append(sum(lastN))
+        self.assertEqual(expected, sums)
+        self.assertEqual(average.sum, sum(lastN))
+
+
+class TestEnergyEndpointer(unittest.TestCase):
+
+    def legacy_endpoint(self, data, threshold, rate, chunk):
+        """The original per-chunk loop from Mic.activeListenToAllOptions."""
+        lastN = [threshold * 1.2 for i in range(int(30720 / chunk))]
+        state = 0
+        post_utterance_frames = 0
+        silence_frames_threshold = int(0.25 * rate / chunk)
+        for i in range(len(data) / (2 * chunk)):
+            score = audioop.rms(data[2 * chunk * i:2 * chunk * (i + 1)], 2) / 3
+            lastN.pop(0)
+            lastN.append(score)
+            average = sum(lastN) / float(len(lastN))
+            if average > threshold * 1.25:
+                state = 1
+            elif state > 0 and average < threshold * 0.8:
+                post_utterance_frames += 1
+                state = 2
+            if (state == 2 and
+               post_utterance_frames >= silence_frames_threshold):
+                return (i + 1) * chunk
+        return None
+
+    def testMatchesLegacyLoop(self):
+        rate, chunk, threshold = 16000, 32, 120.0
+        data = make_audio(8, rate=rate)
+        expected = self.legacy_endpoint(data, threshold, rate, chunk)
+        self.assertIsNotNone(expected)
+
+        endpointer = energy.EnergyEndpointer(threshold, rate, chunk)
+        consumed = 0
+        block = 2 * 1024
+        for offset in range(0, len(data), block):
+            end = endpointer.feed(data[offset:offset + block])
+            if end is not None:
+                consumed += end
+                break
+            consumed += block / 2
+        self.assertEqual(expected, consumed)
+        self.assertEqual(endpointer.utterances, 1)
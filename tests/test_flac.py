@@ -0,0 +1,219 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import hashlib
+import numpy as np
+from client import flac, httpsession, mockspeech, stt
+
+
+class BitReader(object):
+
+    def __init__(self, data):
+        self.data = bytearray(data)
+        self.position = 0
+
+    def read(self, count):
+        value = 0
+        for i in range(count):
+            byte = self.data[self.position >> 3]
+            value = (value << 1) | ((byte >> (7 - (self.position & 7))) & 1)
+            self.position += 1
+        return value
+
+    def signed(self, count):
+        value = self.read(count)
+        return value - (1 << count) if value & (1 << (count - 1)) else value
+
+    def unary(self):
+        count = 0
+        while not self.read(1):
+            count += 1
+        return count
+
+    def align(self):
+        self.position = (self.position + 7) & ~7
+
+    @property
+    def byte(self):
+        return self.position >> 3
+
+
+def decode(data):
+    """A minimal decoder for what the encoder writes."""
+    assert data[:4] == 'fLaC'
+    reader = BitReader(data[4:])
+    assert reader.read(1) == 1 and reader.read(7) == 0
+    assert reader.read(24) == 34
+    info = {'min_block_size': reader.read(16),
+            'max_block_size': reader.read(16)}
+    reader.read(48)
+    info['rate'] = reader.read(20)
+    info['channels'] = reader.read(3) + 1
+    info['bits'] = reader.read(5) + 1
+    info['total_samples'] = reader.read(36)
+    info['md5'] = str(reader.data[reader.byte:reader.byte + 16])
+    reader.position += 128
+    samples = []
+    frame_number = 0
+    while reader.byte < len(reader.data):
+        start = reader.byte
+        assert reader.read(14) == 0x3FFE
+        reader.read(2)
+        block_size_code = reader.read(4)
+        rate_code = reader.read(4)
+        assert reader.read(4) == 0 and reader.read(3) == 4
+        reader.read(1)
+        # the frame number
+        head = reader.read(8)
+        count = 0
+        while head & (0x80 >> count):
+            count += 1
+        number = head & (0xFF >> (count + 1))
+        for i in range(max(0, count - 1)):
+            number = (number << 6) | (reader.read(8) & 0x3F)
+        assert number == frame_number
+        frame_number += 1
+        if block_size_code == 6:
+            block_size = reader.read(8) + 1
+        elif block_size_code == 7:
+            block_size = reader.read(16) + 1
+        elif block_size_code >= 8:
+            block_size = 256 << (block_size_code - 8)
+        else:
+            block_size = {1: 192, 2: 576, 3: 1152, 4: 2304,
+                          5: 4608}[block_size_code]
+        if rate_code == 13:
+            assert reader.read(16) == info['rate']
+        elif rate_code == 5:
+            assert info['rate'] == 16000
+        assert reader.read(8) == flac.crc8(
+            str(reader.data[start:reader.byte - 1]))
+        # the subframe
+        assert reader.read(1) == 0
+        kind = reader.read(6)
+        assert reader.read(1) == 0
+        if kind == 0:
+            block = [reader.signed(16)] * block_size
+        elif kind == 1:
+            block = [reader.signed(16) for i in range(block_size)]
+        else:
+            assert kind & 0x38 == 0x08
+            order = kind & 0x07
+            block = [reader.signed(16) for i in range(order)]
+            assert reader.read(2) == 0
+            partition_order = reader.read(4)
+            partitions = 1 << partition_order
+            residual = []
+            for partition in range(partitions):
+                parameter = reader.read(4)
+                assert parameter != 15
+                count = block_size >> partition_order
+                if partition == 0:
+                    count -= order
+                for i in range(count):
+                    folded = (reader.unary() << parameter) | \
+                        reader.read(parameter)
+                    residual.append(folded >> 1 if not folded & 1
+                                    else -((folded + 1) >> 1))
+            coefficients = {0: [], 1: [1], 2: [2, -1], 3: [3, -3, 1],
+                            4: [4, -6, 4, -1]}[order]
+            for value in residual:
+                prediction = sum(c * block[-1 - i]
+                                 for i, c in enumerate(coefficients))
+                block.append(prediction + value)
+        samples.extend(block)
+        reader.align()
+        crc = reader.read(16)
+        assert crc == flac.crc16(str(reader.data[start:reader.byte - 2]))
+    return info, np.array(samples, dtype='<i2')
+
+
+def speech(seconds, rate=16000, seed=0):
+    # a tone switched on and off like syllables, in some noise
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * rate)) / float(rate)
+    samples = 3000 * np.sin(2 * np.pi * 200 * t) * \
+        (np.sin(2 * np.pi * 2 * t) > 0) + rng.normal(0, 50, len(t))
+    return np.round(samples).astype('<i2')
+
+
+class TestFLAC(unittest.TestCase):
+
+    def testRoundTrip(self):
+        samples = speech(1.1)
+        data = flac.encode(samples.tostring(), 16000)
+        info, decoded = decode(data)
+        self.assertTrue(np.array_equal(decoded, samples))
+        self.assertEqual((info['rate'], info['channels'], info['bits']),
+                         (16000, 1, 16))
+        self.assertEqual(info['total_samples'], len(samples))
+        self.assertEqual(info['md5'],
+                         hashlib.md5(samples.tostring()).digest())
+        # speech in a bit of noise compresses to about half
+        self.assertLess(len(data), 0.65 * len(samples) * 2)
+
+    def testEdgeCases(self):
+        rng = np.random.RandomState(1)
+        cases = [np.zeros(5000, dtype='<i2'),
+                 # white noise at full scale is stored verbatim
+                 rng.randint(-32768, 32768, 5000).astype('<i2'),
+                 np.array([-32768, 32767] * 1000, dtype='<i2'),
+                 np.array([7], dtype='<i2')]
+        for samples in cases:
+            # an odd rate, spelled out in every frame header
+            info, decoded = decode(flac.encode(samples.tostring(), 11025,
+                                               block_size=1000))
+            self.assertTrue(np.array_equal(decoded, samples))
+
+    def testIncremental(self):
+        samples = speech(1).tostring()
+        encoder = flac.Encoder(16000)
+        data = encoder.header()
+        for i in range(0, len(samples), 3000):
+            data += encoder.encode(samples[i:i + 3000])
+        data += encoder.flush()
+        info, decoded = decode(data)
+        self.assertEqual(decoded.tostring(), samples)
+        # unknown while streaming
+        self.assertEqual(info['total_samples'], 0)
+        self.assertEqual(encoder.output_bytes, len(data))
+        self.assertAlmostEqual(encoder.ratio, len(data) / 32000.0)
+
+
+class TestFLACUpload(unittest.TestCase):
+
+    def setUp(self):
+        self.server = mockspeech.MockSpeechServer()
+        self.session = httpsession.Session()
+        self.engine = self.server.point(stt.GoogleSTT(api_key='secret'))
+        self.engine._http = self.session
+        self.audio = speech(1).tostring()
+
+    def tearDown(self):
+        self.session.close()
+        self.server.close()
+
+    def testUpload(self):
+        self.assertEqual(self.engine.encoding, 'flac')
+        self.assertEqual(self.engine.transcribe_pcm(self.audio, 16000),
+                         ('WHAT TIME IS IT',))
+        self.assertEqual(self.server.received[-1][2],
+                         len(flac.encode(self.audio, 16000)))
+
+        self.engine.start_stream(16000)
+        for i in range(0, len(self.audio), 3200):
+            self.engine.feed(self.audio[i:i + 3200])
+        self.assertEqual(self.engine.finish(), ('WHAT TIME IS IT',))
+        path, chunked, size = self.server.received[-1]
+        self.assertTrue(chunked)
+        self.assertLess(size, 0.65 * len(self.audio))
+
+        self.engine.encoding = 'pcm'
+        self.engine.transcribe_pcm(self.audio, 16000)
+        self.assertEqual(self.server.received[-1][2], len(self.audio))
+
+    def testUnsupported(self):
+        with self.assertRaises(ValueError):
+            self.engine.encoding = 'mp3'
+        with self.assertRaises(ValueError):
+            stt.WitAiSTT('secret', encoding='flac')
@@ -0,0 +1,246 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import os
+import shutil
+import tempfile
+import mock
+from client import grammar, stt, vocabcompiler
+from client.utils import text2int
+
+GRAMMAR = {
+    'S': ['<verb> [THE] <object>', 'LOOK [AROUND]', 'GO <direction>'],
+    'verb': ['TAKE', 'DROP'],
+    'object': ['LAMP', 'BRASS LANTERN'],
+    'direction': ['NORTH', 'SOUTH'],
+}
+
+
+def number_words(n):
+    # how a number is said, the way text2int reads it
+    units = [u.upper() for u in text2int.units]
+    tens = [t.upper() for t in text2int.tens]
+
+    def below_thousand(n):
+        words = []
+        if n >= 100:
+            words += [units[n // 100], 'HUNDRED']
+            n %= 100
+        if n >= 20:
+            words.append(tens[n // 10 - 2])
+            if n % 10:
+                words.append(units[n % 10])
+        elif n or not words:
+            words.append(units[n])
+        return words
+
+    if n >= 1000:
+        words = below_thousand(n // 1000) + ['THOUSAND']
+        if n % 1000:
+            words += below_thousand(n % 1000)
+        return ' '.join(words)
+    return ' '.join(below_thousand(n))
+
+
+class DummyG2P(object):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def get_config(self, *args, **kwargs):
+        return {}
+
+    def translate(self, words):
+        return dict((word, [' '.join(word.lower())]) for word in words)
+
+
+class FakeLexicon(object):
+
+    def translate_word(self, word):
+        return [' '.join(word.lower())]
+
+
+class TestGrammar(unittest.TestCase):
+
+    def testParse(self):
+        g = grammar.Grammar(GRAMMAR)
+        self.assertEqual(g.words, ['AROUND', 'BRASS', 'DROP', 'GO',
+                                   'LAMP', 'LANTERN', 'LOOK', 'NORTH',
+                                   'SOUTH', 'TAKE', 'THE'])
+        self.assertTrue(g.matches('TAKE THE BRASS LANTERN'))
+        self.assertTrue(g.matches('DROP LAMP'))
+        self.assertTrue(g.matches('LOOK'))
+        self.assertFalse(g.matches('LAMP TAKE'))
+        self.assertFalse(g.matches('TAKE THE'))
+        self.assertFalse(g.matches('GO NORTH SOUTH'))
+
+    def testInvalid(self):
+        for rules in [{'verb': ['TAKE']},
+                      {'S': 'TAKE'},
+                      {'S': []},
+                      {'S': ['<verb>']},
+                      {'S': ['[TAKE]']},
+                      {'S': ['[TAKE [IT]]']},
+                      {'S': ['TAKE ]']},
+                      {'S': ['TAKE [IT']},
+                      {'S': ['<a>'], 'a': ['<b>'], 'b': ['X <a>']},
+                      {'S': ['X'], 'a b': ['X']}]:
+            with self.assertRaises(ValueError):
+                grammar.Grammar(rules)
+
+    def testJSGF(self):
+        self.assertEqual(grammar.Grammar(GRAMMAR).to_jsgf('zork'),
+                         '#JSGF V1.0;\n' +
+                         'grammar zork;\n' +
+                         'public <S> = <verb> [THE] <object> | ' +
+                         'LOOK [AROUND] | GO <direction>;\n' +
+                         '<direction> = NORTH | SOUTH;\n' +
+                         '<object> = LAMP | BRASS LANTERN;\n' +
+                         '<verb> = TAKE | DROP;\n')
+
+    def testJulius(self):
+        rules, categories = grammar.Grammar(GRAMMAR).to_julius()
+        self.assertEqual(rules['S'], [['NS_B', 'R_S', 'NS_E']])
+        # optional parts are expanded
+        self.assertEqual(sorted(rules['R_S']),
+                         [['C_VERB', 'R_OBJECT'],
+                          ['C_VERB', 'W_THE', 'R_OBJECT'],
+                          ['W_GO', 'C_DIRECTION'],
+                          ['W_LOOK'],
+                          ['W_LOOK', 'W_AROUND']])
+        self.assertEqual(sorted(rules['R_OBJECT']),
+                         [['W_BRASS', 'W_LANTERN'], ['W_LAMP']])
+        self.assertEqual(categories['C_VERB'], ['DROP', 'TAKE'])
+        self.assertEqual(categories['W_THE'], ['THE'])
+        self.assertNotIn('C_S', categories)
+
+    def testRevision(self):
+        revision = vocabcompiler.AbstractVocabulary.phrases_to_revision
+        g = grammar.Grammar(GRAMMAR)
+        self.assertEqual(revision(g), revision(grammar.Grammar(GRAMMAR)))
+        changed = dict(GRAMMAR, direction=['NORTH', 'SOUTH', 'EAST'])
+        self.assertNotEqual(revision(g), revision(grammar.Grammar(changed)))
+        self.assertNotEqual(revision(g), revision(g.lines))
+
+    def testModuleGrammars(self):
+        from client.modules import Cribbage, Hammurabi, Zork
+        for module in (Cribbage, Hammurabi, Zork):
+            grammar.Grammar(module.GRAMMAR)
+
+        cards = grammar.Grammar(Cribbage.GRAMMAR)
+        for sentence in ['FIVE', 'THE FIVE OF HEARTS', 'ACE OF SPADES',
+                         'CLUBS']:
+            self.assertTrue(cards.matches(sentence))
+        self.assertFalse(cards.matches('OF HEARTS'))
+
+        numbers = grammar.Grammar(Hammurabi.GRAMMAR)
+        for n in [0, 7, 13, 40, 99, 100, 305, 999, 1000, 2048, 12345,
+                  99999]:
+            words = number_words(n)
+            self.assertTrue(numbers.matches(words), words)
+            self.assertEqual(text2int.text2int(words), n)
+        self.assertTrue(numbers.matches('TWO HUNDRED AND FIVE'))
+        self.assertTrue(numbers.matches('NONE'))
+        self.assertFalse(numbers.matches('HUNDRED FIVE'))
+
+        commands = grammar.Grammar(Zork.GRAMMAR)
+        for sentence in ['NORTH', 'GO SOUTHWEST', 'OPEN THE MAILBOX',
+                         'TAKE ALL', 'PICK UP THE LANTERN',
+                         'PUT THE EGG IN THE NEST', 'INVENTORY',
+                         'KILL THE THIEF WITH THE ELVISH SWORD']:
+            self.assertTrue(commands.matches(sentence), sentence)
+        self.assertFalse(commands.matches('MAILBOX OPEN'))
+
+
+class TestGrammarVocabularies(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def testPocketsphinxVocabulary(self):
+        g = grammar.Grammar(GRAMMAR)
+        vocabulary = vocabcompiler.PocketsphinxVocabulary(
+            'instance-zork', path=self.tempdir)
+        with mock.patch('client.vocabcompiler.PhonetisaurusG2P', DummyG2P):
+            vocabulary.compile(g)
+        self.assertTrue(vocabulary.is_compiled)
+        self.assertTrue(vocabulary.matches_phrases(g))
+        self.assertEqual(vocabulary.decoder_kwargs,
+                         {'jsgf': vocabulary.grammar_file,
+                          'dict': vocabulary.dictionary_file})
+        with open(vocabulary.grammar_file, 'r') as f:
+            self.assertEqual(f.read(), g.to_jsgf('instance_zork'))
+        with open(vocabulary.dictionary_file, 'r') as f:
+            self.assertEqual(sorted(line.split('\t')[0] for line in f),
+                             g.words)
+
+        # compiled with a language model again, the grammar is gone
+        def write_test_lm(text, output_file, **kwargs):
+            with open(output_file, 'w') as f:
+                f.write('TEST')
+
+        def write_test_vocab(text, output_file):
+            with open(output_file, 'w') as f:
+                f.write('TAKE\nLAMP\n')
+
+        with mock.patch('client.vocabcompiler.cmuclmtk',
+                        create=True) as cmuclmtk:
+            cmuclmtk.text2vocab = write_test_vocab
+            cmuclmtk.text2lm = write_test_lm
+            with mock.patch('client.vocabcompiler.PhonetisaurusG2P',
+                            DummyG2P):
+                vocabulary.compile(['TAKE', 'LAMP'])
+        self.assertFalse(vocabulary.matches_phrases(g))
+        self.assertIn('lm', vocabulary.decoder_kwargs)
+        self.assertFalse(os.path.exists(vocabulary.grammar_file))
+
+    def testJuliusVocabulary(self):
+        g = grammar.Grammar(GRAMMAR)
+        vocabulary = vocabcompiler.JuliusVocabulary(path=self.tempdir)
+        self.assertEqual(vocabulary._get_grammar(g), g.to_julius()[0])
+        word_defs = vocabulary._get_word_defs(FakeLexicon(), g)
+        self.assertEqual(word_defs['C_DIRECTION'],
+                         [('NORTH', 'n o r t h'), ('SOUTH', 's o u t h')])
+        self.assertEqual(word_defs['NS_B'], [('<s>', 'sil')])
+        self.assertNotIn('WORD', word_defs)
+        # without a grammar, all words are in a loop
+        self.assertEqual(sorted(vocabulary._get_grammar(['TAKE LAMP'])),
+                         ['S', 'WORD_LOOP'])
+
+    def testModuleInstance(self):
+        module = mock.Mock(GRAMMAR=GRAMMAR, INSTANCE_WORDS=['TAKE'])
+        module.__name__ = 'Zork'
+        with mock.patch.object(stt.PocketSphinxSTT, 'get_instance') as get:
+            stt.PocketSphinxSTT.get_module_instance(module)
+        name, phrases = get.call_args[0]
+        self.assertEqual(name, 'instance-Zork')
+        self.assertEqual(phrases.lines, grammar.Grammar(GRAMMAR).lines)
+
+        del module.GRAMMAR
+        with mock.patch.object(stt.PocketSphinxSTT, 'get_instance') as get:
+            stt.PocketSphinxSTT.get_module_instance(module)
+        self.assertEqual(get.call_args[0], ('instance-Zork', ['TAKE']))
+
+    def testChoicesInstance(self):
+        with mock.patch.object(stt.PocketSphinxSTT, 'get_instance') as get:
+            get.return_value.min_confidence = 0.05
+            instance = stt.PocketSphinxSTT.get_choices_instance(
+                ['YES', 'NO', 'YES'])
+            # a forced choice has to be more certain
+            self.assertEqual(instance.min_confidence, 0.5)
+            name, phrases = get.call_args[0]
+            self.assertEqual(phrases.lines, ['S: NO', 'S: YES'])
+            self.assertTrue(phrases.matches('YES'))
+            self.assertFalse(phrases.matches('YES NO'))
+            # the same choices get the same vocabulary, others another one
+            stt.PocketSphinxSTT.get_choices_instance(['NO', 'YES'])
+            self.assertEqual(get.call_args[0][0], name)
+            stt.PocketSphinxSTT.get_choices_instance(['ONE', 'TWO'])
+            self.assertNotEqual(get.call_args[0][0], name)
+        self.assertTrue(name.startswith('choices-'))
+        # engines that can't reject keep their vocabulary
+        self.assertIsNone(stt.GoogleSTT.get_choices_instance(['YES', 'NO']))
+        self.assertIsNone(stt.JuliusSTT.get_choices_instance(['YES', 'NO']))
@@ -0,0 +1,234 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import BaseHTTPServer
+import json
+import os
+import shutil
+import SocketServer
+import tempfile
+import threading
+import time
+import mock
+import requests
+from client import httpsession, mockspeech, stt
+
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers like the AT&T and Wit.ai speech APIs."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def read_body(self):
+        if self.headers.get('transfer-encoding') != 'chunked':
+            return self.rfile.read(int(self.headers['content-length']))
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+            if not size:
+                return ''.join(chunks)
+
+    def do_POST(self):
+        server = self.server
+        body = self.read_body()
+        server.requests.append((self.path, self.client_address,
+                                self.headers.get('authorization'), body))
+        if server.delay:
+            time.sleep(server.delay)
+        if self.path == '/token':
+            server.tokens += 1
+            response = {'access_token': 'TOKEN%d' % server.tokens,
+                        'expires_in': server.expires_in}
+        elif server.failures:
+            server.failures -= 1
+            self.send_response(503)
+            self.send_header('content-length', '0')
+            self.end_headers()
+            return
+        elif self.path == '/att':
+            response = {'Recognition': {'Status': 'OK', 'NBest': [
+                {'Hypothesis': 'what time is it', 'Confidence': 0.9}]}}
+        else:
+            response = {'_text': 'what time is it'}
+        data = json.dumps(response)
+        self.send_response(200)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StandInServer(SocketServer.ThreadingMixIn,
+                    BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0),
+                                           StandInHandler)
+        self.requests = []
+        self.tokens = 0
+        self.expires_in = 3600
+        self.delay = 0
+        self.failures = 0
+
+    def handle_error(self, request, client_address):
+        # the client hung up on a delayed response
+        pass
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+
+class TestHTTPSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StandInServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.tempdir = tempfile.mkdtemp()
+        self.session = httpsession.Session(read_timeout=0.5, retries=2)
+        self.tokens = httpsession.TokenCache(os.path.join(self.tempdir,
+                                                          'tokens.yml'))
+
+    def tearDown(self):
+        self.session.close()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def att(self):
+        engine = stt.AttSTT('key', 'secret')
+        engine._http = self.session
+        engine._tokens = self.tokens
+        engine.TOKEN_URL = self.server.url + '/token'
+        engine.SPEECH_URL = self.server.url + '/att'
+        return engine
+
+    def witai(self):
+        engine = stt.WitAiSTT('secret')
+        engine._http = self.session
+        engine.SPEECH_URL = self.server.url + '/speech'
+        return engine
+
+    def testKeepAlive(self):
+        engine = self.witai()
+        for i in range(3):
+            self.assertEqual(engine.transcribe_pcm('\0\0' * 100, 16000),
+                             ['WHAT TIME IS IT'])
+        # all over the same connection
+        self.assertEqual(len(set(r[1] for r in self.server.requests)), 1)
+
+    def testReadTimeout(self):
+        self.server.delay = 1
+        start = time.time()
+        # (requests of this age report it as a ConnectionError)
+        with self.assertRaises(requests.exceptions.RequestException):
+            self.session.post(self.server.url + '/speech', data='')
+        self.assertLess(time.time() - start, 0.9)
+        # the engines give up on the utterance
+        self.assertEqual(self.witai().transcribe_pcm('\0\0', 16000), [])
+
+    def testRetries(self):
+        self.server.failures = 2
+        self.assertEqual(self.witai().transcribe_pcm('\0\0', 16000),
+                         ['WHAT TIME IS IT'])
+        self.assertEqual(len(self.server.requests), 3)
+        self.server.failures = 3
+        self.assertEqual(self.witai().transcribe_pcm('\0\0', 16000), [])
+
+    def testNoStreamedRetries(self):
+        # a streamed body is gone once it has been sent
+        self.server.failures = 1
+        adapter = self.session.get_adapter(self.server.url)
+        with mock.patch.object(adapter._once, 'send',
+                               wraps=adapter._once.send) as send:
+            r = self.session.post(self.server.url + '/speech',
+                                  data=iter(['\0\0']))
+        self.assertTrue(send.called)
+        self.assertEqual(r.status_code, 503)
+        self.assertEqual([req[3] for req in self.server.requests], ['\0\0'])
+
+    def testTokenPersisted(self):
+        self.assertEqual(self.att().transcribe_pcm('\0\0', 16000),
+                         ['WHAT TIME IS IT'])
+        # another process start reads the token from the config dir
+        self.tokens = httpsession.TokenCache(self.tokens.path)
+        self.assertEqual(self.att().transcribe_pcm('\0\0', 16000),
+                         ['WHAT TIME IS IT'])
+        self.assertEqual(self.server.tokens, 1)
+        self.assertEqual([r[2] for r in self.server.requests],
+                         [None, 'Bearer TOKEN1', 'Bearer TOKEN1'])
+        self.assertEqual(os.stat(self.tokens.path).st_mode & 0o777, 0o600)
+
+    def testTokenRefresh(self):
+        # a token expiring within REFRESH_MARGIN is renewed before use
+        self.server.expires_in = self.tokens.REFRESH_MARGIN + 1
+        engine = self.att()
+        self.assertEqual(engine.token, 'TOKEN1')
+        self.assertEqual(engine.token, 'TOKEN1')
+        self.tokens.REFRESH_MARGIN += 2
+        self.assertEqual(engine.token, 'TOKEN2')
+
+
+class TestStreamingUpload(unittest.TestCase):
+
+    def setUp(self):
+        # a second of audio takes half a second to upload
+        self.server = mockspeech.MockSpeechServer(bandwidth=64000,
+                                                  latency=0.05)
+        self.session = httpsession.Session()
+        self.engine = self.server.point(stt.WitAiSTT('secret'))
+        self.engine._http = self.session
+        self.audio = '\0\0' * 16000
+
+    def tearDown(self):
+        self.session.close()
+        self.server.close()
+
+    def testStreaming(self):
+        self.engine.start_stream(16000)
+        for i in range(0, len(self.audio), 3200):
+            # like a caller talking, only ten times as fast
+            time.sleep(0.01)
+            self.engine.feed(self.audio[i:i + 3200])
+        # the audio is still arriving, but most has been sent
+        time.sleep(0.4)
+        start = time.time()
+        self.assertEqual(self.engine.finish(), ['WHAT TIME IS IT'])
+        self.assertLess(time.time() - start, 0.3)
+        self.assertEqual(self.server.received,
+                         [('/speech', True, len(self.audio))])
+
+        start = time.time()
+        self.assertEqual(self.engine.transcribe_pcm(self.audio, 16000),
+                         ['WHAT TIME IS IT'])
+        self.assertGreater(time.time() - start, 0.5)
+        self.assertEqual(self.server.received[-1],
+                         ('/speech', False, len(self.audio)))
+
+    def testFallback(self):
+        # the streamed request fails, so the audio is posted in one piece
+        self.server.close()
+        server = mockspeech.MockSpeechServer()
+        self.addCleanup(server.close)
+        self.engine.start_stream(16000)
+        self.engine.feed(self.audio)
+        server.point(self.engine)
+        self.assertEqual(self.engine.finish(), ['WHAT TIME IS IT'])
+        self.assertEqual(server.received,
+                         [('/speech', False, len(self.audio))])
+
+    def testAbort(self):
+        self.engine.start_stream(16000)
+        self.engine.feed(self.audio[:3200])
+        self.engine.abort()
+        time.sleep(0.2)
+        self.assertEqual(self.server.received, [])
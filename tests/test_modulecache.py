@@ -0,0 +1,121 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import types
+import mock
+from client import modulecache
+
+
+def make_module(name):
+    return types.ModuleType(name)
+
+
+class TestModuleCache(unittest.TestCase):
+
+    def setUp(self):
+        self.modules = [make_module(name) for name in ('A', 'B', 'C')]
+        self.evicted = []
+
+    def cache(self, **kwargs):
+        return modulecache.ModuleCache(lambda module: module.__name__.lower(),
+                                       evict=self.evicted.append, **kwargs)
+
+    def testHitsAndMisses(self):
+        cache = self.cache()
+        a, b, c = self.modules
+        self.assertEqual(cache.get(a), 'a')
+        self.assertEqual(cache.get(a), 'a')
+        self.assertEqual(cache.get(b), 'b')
+        self.assertIn('A', cache)
+        stats = cache.stats
+        self.assertEqual((stats['entries'], stats['hits'], stats['misses'],
+                          stats['evictions']), (2, 1, 2, 0))
+
+    def testEvictLeastRecentlyUsed(self):
+        cache = self.cache(max_entries=2)
+        a, b, c = self.modules
+        cache.get(a)
+        cache.get(b)
+        # A is now more recently used than B
+        cache.get(a)
+        cache.get(c)
+        self.assertEqual(self.evicted, ['b'])
+        self.assertEqual(len(cache), 2)
+        self.assertNotIn('B', cache)
+        self.assertEqual(cache.evictions, 1)
+
+    def testMemoryLimit(self):
+        sizes = iter([0, 100, 100, 250, 250, 550])
+        with mock.patch.object(modulecache, 'resident_bytes',
+                               lambda: next(sizes)):
+            cache = self.cache(max_bytes=200)
+            a, b, c = self.modules
+            cache.get(a)
+            cache.get(b)
+            self.assertEqual(self.evicted, ['a'])
+            self.assertEqual(cache.resident_bytes, 150)
+            # the newest entry is kept even if it alone is over the limit
+            cache.get(c)
+        self.assertEqual(self.evicted, ['a', 'b'])
+        self.assertEqual(cache.resident_bytes, 300)
+
+    def testPrewarm(self):
+        cache = self.cache(max_entries=2)
+        a, b, c = self.modules
+        # the most popular first, as far as they fit
+        cache.prewarm([a, b, c])
+        self.assertEqual(self.evicted, [])
+        self.assertNotIn('C', cache)
+        cache.get(a)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        cache.get(c)
+        self.assertEqual(self.evicted, ['b'])
+
+    def testPrewarmNeverEvicts(self):
+        cache = self.cache(max_entries=2)
+        a, b, c = self.modules
+        # in use on another thread
+        cache.get(c)
+        cache.prewarm([a, b])
+        self.assertEqual(self.evicted, [])
+        self.assertNotIn('B', cache)
+        # and prewarmed modules are the first to go
+        cache.get(b)
+        self.assertEqual(self.evicted, ['a'])
+
+        sizes = {'a': 150, 'b': 100, 'c': 100}
+        cache = self.cache(max_bytes=200, size=sizes.get)
+        cache.get(c)
+        cache.prewarm([a, b])
+        # A doesn't fit and is freed again, B isn't even tried
+        self.assertEqual(self.evicted, ['a', 'a'])
+        self.assertEqual(len(cache), 1)
+
+    def testSize(self):
+        sizes = {'a': 150, 'b': 100, 'c': None}
+        with mock.patch.object(modulecache, 'resident_bytes',
+                               mock.Mock(side_effect=[0, 1000, 0, 1000,
+                                                      0, 70])):
+            cache = self.cache(max_bytes=200, size=sizes.get)
+            a, b, c = self.modules
+            cache.get(a)
+            cache.get(b)
+            # what the values report, not how the process grew
+            self.assertEqual(self.evicted, ['a'])
+            self.assertEqual(cache.resident_bytes, 100)
+            # unless they can't tell
+            cache.get(c)
+        self.assertEqual(cache.resident_bytes, 170)
+
+    def testClear(self):
+        cache = self.cache()
+        for module in self.modules:
+            cache.get(module)
+        cache.clear()
+        self.assertEqual(self.evicted, ['a', 'b', 'c'])
+        self.assertEqual(len(cache), 0)
+
+    def testResidentBytes(self):
+        size = modulecache.resident_bytes()
+        if size is not None:
+            self.assertGreater(size, 0)
@@ -0,0 +1,72 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import numpy as np
+from client import energy, noisefloor
+
+RATE = 16000
+
+
+def pcm(samples):
+    return samples.astype('<i2').tostring()
+
+
+class TestNoiseFloorTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def feed(self, tracker, data, block=1000):
+        for offset in range(0, len(data), block * 2):
+            tracker.push(data[offset:offset + block * 2])
+
+    def testNoEstimateYet(self):
+        tracker = noisefloor.NoiseFloorTracker(RATE)
+        self.feed(tracker, pcm(self.rng.normal(0, 300, RATE / 2)))
+        self.assertIsNone(tracker.estimate)
+        self.assertIsNone(tracker.wait(0.01))
+        self.assertEqual(tracker.history, [])
+
+    def testSteadyNoise(self):
+        tracker = noisefloor.NoiseFloorTracker(RATE)
+        data = pcm(self.rng.normal(0, 300, 5 * RATE))
+        self.feed(tracker, data)
+        # matches the average score of the same audio
+        average = energy.frame_scores(data, 32).mean()
+        self.assertAlmostEqual(tracker.estimate, average, delta=average * 0.05)
+        self.assertEqual(len(tracker.history), 1)
+
+    def testSamples(self):
+        data = pcm(self.rng.normal(0, 300, 2 * RATE))
+        tracker = noisefloor.NoiseFloorTracker(RATE)
+        self.feed(tracker, data)
+        samples = np.frombuffer(data, dtype='<i2')
+        other = noisefloor.NoiseFloorTracker(RATE)
+        for offset in range(0, len(samples), 1000):
+            other.push(samples[offset:offset + 1000])
+        self.assertEqual(other.estimate, tracker.estimate)
+
+    def testIgnoresSpeech(self):
+        tracker = noisefloor.NoiseFloorTracker(RATE)
+        quiet = self.rng.normal(0, 300, 3 * RATE)
+        self.feed(tracker, pcm(quiet))
+        before = tracker.estimate
+        # two seconds of loud audio hardly move the floor
+        self.feed(tracker, pcm(self.rng.normal(0, 5000, 2 * RATE)))
+        self.assertAlmostEqual(tracker.estimate, before, delta=before * 0.1)
+
+    def testFollowsNoise(self):
+        tracker = noisefloor.NoiseFloorTracker(RATE, window_seconds=10)
+        self.feed(tracker, pcm(self.rng.normal(0, 300, 3 * RATE)))
+        before = tracker.estimate
+        self.feed(tracker, pcm(self.rng.normal(0, 3000, 10 * RATE)))
+        self.assertGreater(tracker.estimate, before * 5)
+
+    def testOddBlocks(self):
+        data = pcm(self.rng.normal(0, 300, 2 * RATE))
+        estimates = set()
+        for block in (7, 1000, 1024):
+            tracker = noisefloor.NoiseFloorTracker(RATE)
+            self.feed(tracker, data, block)
+            estimates.add(tracker.estimate)
+        self.assertEqual(len(estimates), 1)
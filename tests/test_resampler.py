@@ -0,0 +1,62 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import numpy as np
+from client import resampler
+
+
+def sine(frequency, rate, seconds, amplitude=10000):
+    t = np.arange(int(rate * seconds)) / float(rate)
+    return amplitude * np.sin(2 * np.pi * frequency * t)
+
+
+def to_pcm(samples):
+    return np.round(samples).astype('<i2').tostring()
+
+
+def from_pcm(data):
+    return np.frombuffer(data, dtype='<i2').astype(np.float64)
+
+
+class TestResampler(unittest.TestCase):
+
+    def assertAccurate(self, from_rate, to_rate, frequency=1000):
+        data = resampler.resample(to_pcm(sine(frequency, from_rate, 1)),
+                                  from_rate, to_rate)
+        reference = sine(frequency, to_rate, 1)
+        output = from_pcm(data)
+        self.assertEqual(len(output), len(reference))
+        # ignore the edges, where the input was cut off
+        inner = slice(100, -100)
+        error = output[inner] - reference[inner]
+        snr = 10 * np.log10(np.mean(reference[inner] ** 2) /
+                            np.mean(error ** 2))
+        self.assertGreater(snr, 60)
+
+    def testDownsample(self):
+        self.assertAccurate(44100, 16000)
+
+    def testUpsample(self):
+        self.assertAccurate(16000, 44100)
+
+    def testArbitraryRatio(self):
+        self.assertAccurate(48000, 44100)
+        self.assertAccurate(8000, 11025, frequency=440)
+
+    def testAliasingIsFiltered(self):
+        # 10 kHz is above the 8 kHz Nyquist frequency of the output
+        data = resampler.resample(to_pcm(sine(10000, 44100, 1)), 44100, 16000)
+        self.assertLess(np.abs(from_pcm(data)[100:-100]).max(), 50)
+
+    def testStreamingMatchesOneShot(self):
+        data = to_pcm(sine(700, 44100, 0.5))
+        expected = resampler.resample(data, 44100, 16000)
+        stream = resampler.Resampler(44100, 16000)
+        blocks = [stream.process(data[i:i + 2 * 1000])
+                  for i in range(0, len(data), 2 * 1000)]
+        blocks.append(stream.flush())
+        self.assertEqual(expected, ''.join(blocks))
+
+    def testSameRate(self):
+        data = to_pcm(sine(700, 16000, 0.1))
+        self.assertEqual(data, resampler.resample(data, 16000, 16000))
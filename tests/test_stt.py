@@ -1,8 +1,19 @@
 #!/usr/bin/env python2
 # -*- coding: utf-8-*-
 import unittest
+import math
 import imp
-from client import stt, jasperpath
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+import wave
+import mock
+import numpy as np
+from client import httpsession, jasperpath, mockspeech, stt
 
 
 def cmuclmtk_installed():
@@ -49,3 +60,671 @@ class TestSTT(unittest.TestCase):
         with open(self.time_clip, mode="rb") as f:
             transcription = self.active_stt_engine.transcribe(f)
         self.assertIn("TIME", transcription)
+
+    def testTranscribePCM(self):
+        """
+        Does Jasper recognize 'time' from audio in memory?
+        """
+        wav = wave.open(self.time_clip, 'rb')
+        data = wav.readframes(wav.getnframes())
+        rate = wav.getframerate()
+        wav.close()
+        samples = np.frombuffer(data, dtype='<i2')
+        transcription = self.active_stt_engine.transcribe_pcm(samples, rate)
+        self.assertIn("TIME", transcription)
+
+
+class FileOnlySTT(stt.AbstractSTTEngine):
+    """An engine that only implements the file based transcribe()."""
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def transcribe(self, fp):
+        wav = wave.open(fp, 'rb')
+        self.received = (wav.getframerate(), wav.getsampwidth(),
+                         wav.readframes(wav.getnframes()))
+        wav.close()
+        return ['RECEIVED']
+
+
+class NoParseSTT(stt.HTTPSTTEngine):
+    """An HTTP engine that forgot to implement _parse_response()."""
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def _request(self, rate):
+        return None
+
+
+class TestTranscribePCM(unittest.TestCase):
+
+    def testFileAdapter(self):
+        engine = FileOnlySTT()
+        samples = np.arange(-100, 100, dtype='<i2')
+        self.assertEqual(engine.transcribe_pcm(samples, 8000), ['RECEIVED'])
+        self.assertEqual(engine.received,
+                         (8000, 2, samples.tostring()))
+
+    def testHTTPHooks(self):
+        with self.assertRaises(TypeError):
+            NoParseSTT()
+
+    def testPCMToBytes(self):
+        samples = np.arange(-100, 100, dtype='<i2')
+        data = samples.tostring()
+        self.assertEqual(stt.pcm_to_bytes(data), data)
+        self.assertEqual(stt.pcm_to_bytes(bytearray(data)), data)
+        self.assertEqual(stt.pcm_to_bytes(memoryview(data)), data)
+        self.assertEqual(stt.pcm_to_bytes(samples), data)
+        # 8 bit audio is converted to 16 bit
+        self.assertEqual(stt.pcm_to_bytes('\x01\xff', width=1),
+                         '\x00\x01\x00\xff')
+
+    def testStreamFallback(self):
+        engine = FileOnlySTT()
+        samples = np.arange(-100, 100, dtype='<i2')
+        engine.start_stream(8000)
+        for i in range(0, len(samples), 64):
+            engine.feed(samples[i:i + 64])
+            self.assertIsNone(engine.partial())
+        self.assertEqual(engine.finish(), ['RECEIVED'])
+        self.assertEqual(engine.received,
+                         (8000, 2, samples.tostring()))
+
+
+class FakeHypothesis(object):
+
+    def __init__(self, hypstr, prob=None):
+        self.hypstr = hypstr
+        if prob is not None:
+            self.prob = prob
+
+
+class FakeConfig(dict):
+
+    def set_string(self, key, value):
+        self[key] = value
+
+
+class FakeDecoder(object):
+    """A pocketsphinx.Decoder with named searches, recording its calls."""
+
+    instances = []
+
+    def __init__(self, config):
+        FakeDecoder.instances.append(self)
+        self.words = {}
+        with open(config['-dict'], 'r') as f:
+            for line in f:
+                word, phones = line.split(None, 1)
+                self.words[word] = phones.strip()
+        self.searches = {}
+        self.search = None
+        self.utterances = []
+
+    @staticmethod
+    def default_config():
+        return FakeConfig()
+
+    def lookup_word(self, word):
+        return self.words.get(word)
+
+    def add_word(self, word, phones, update):
+        self.words[word] = phones
+
+    def set_lm_file(self, name, lm):
+        self.searches[name] = lm
+
+    def set_jsgf_file(self, name, jsgf):
+        self.searches[name] = jsgf
+
+    def set_kws(self, name, kws):
+        with open(kws, 'r') as f:
+            self.searches[name] = f.read()
+
+    def set_search(self, name):
+        self.search = name
+
+    def start_utt(self):
+        self.utterances.append([self.search, 0])
+
+    def process_raw(self, data, no_search, full_utt):
+        self.utterances[-1][1] += len(data)
+
+    def end_utt(self):
+        pass
+
+    def hyp(self):
+        return FakeHypothesis(self.search.upper())
+
+
+class FakeNBest(object):
+
+    def __init__(self, hypstr, score):
+        self.hypstr = hypstr
+        self.score = score
+
+
+class FakeNBestDecoder(FakeDecoder):
+    """A FakeDecoder with an N-best list."""
+
+    # the posterior of the best hypothesis, 0.9 in log base 1.0001
+    prob = int(round(math.log(0.9) / math.log(1.0001)))
+
+    def hyp(self):
+        return FakeHypothesis('WHAT TIME', self.prob)
+
+    def nbest(self):
+        # a score 6932 lower in log base 1.0001 is half as likely
+        for hypstr, score in [('WHAT TIME', -1000), ('WHAT TIME', -1500),
+                              ('WHAT DIME', -7932), ('WHAT', -100000),
+                              ('', -110000)]:
+            yield FakeNBest(hypstr, score)
+
+
+class FakeRemovingDecoder(FakeDecoder):
+    """A FakeDecoder of a version that can remove named searches."""
+
+    def remove_search(self, name):
+        del self.searches[name]
+
+
+class FakeKWSDecoder(FakeDecoder):
+    """A FakeDecoder spotting its keyphrase after a second of audio."""
+
+    def hyp(self):
+        if self.search.endswith('-keyphrases') and \
+           self.utterances[-1][1] >= 32000:
+            return FakeHypothesis('JASPER')
+        return None
+
+
+class TestPocketSphinxDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        FakeDecoder.instances = []
+        module = types.ModuleType('pocketsphinx')
+        module.Decoder = FakeDecoder
+        patches = [mock.patch.dict('sys.modules', {'pocketsphinx': module}),
+                   mock.patch.dict(stt.PocketSphinxDecoder._instances,
+                                   clear=True)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def vocabulary(self, name, words):
+        dictionary = os.path.join(self.tempdir, name + '.dict')
+        with open(dictionary, 'w') as f:
+            for word, phones in words:
+                f.write('%s %s\n' % (word, phones))
+        vocabulary = mock.Mock()
+        vocabulary.name = name
+        vocabulary.decoder_kwargs = {'lm': name + '.lm', 'dict': dictionary}
+        return vocabulary
+
+    def testSharedDecoder(self):
+        keyword = stt.PocketSphinxSTT(
+            self.vocabulary('keyword', [('JASPER', 'JH AE S P ER')]),
+            hmm_dir=self.tempdir)
+        zork = stt.PocketSphinxSTT(
+            self.vocabulary('zork', [('JASPER', 'JH AE S P ER'),
+                                     ('NORTH', 'N AO R TH')]),
+            hmm_dir=self.tempdir)
+        # a single decoder with the words of both vocabularies
+        self.assertEqual(len(FakeDecoder.instances), 1)
+        decoder = FakeDecoder.instances[0]
+        self.assertEqual(sorted(decoder.words), ['JASPER', 'NORTH'])
+        self.assertEqual(decoder.searches,
+                         {'keyword': 'keyword.lm', 'zork': 'zork.lm'})
+
+        self.assertEqual(zork.transcribe_pcm('\0\0' * 100, 16000),
+                         ['ZORK'])
+        self.assertEqual(keyword.transcribe_pcm('\0\0' * 50, 16000),
+                         ['KEYWORD'])
+        zork.start_stream(16000)
+        zork.feed('\0\0' * 10)
+        self.assertEqual(zork.partial(), 'ZORK')
+        self.assertEqual(zork.finish(), ['ZORK'])
+        self.assertEqual(decoder.utterances,
+                         [['zork', 200], ['keyword', 100], ['zork', 20]])
+
+    def testRemoveSearch(self):
+        zork = stt.PocketSphinxSTT(self.vocabulary('zork', []),
+                                   hmm_dir=self.tempdir)
+        decoder = FakeDecoder.instances[0]
+        # this version can't remove it, so it doesn't count
+        self.assertEqual(zork.resident_bytes, 0)
+        zork.close()
+        self.assertIn('zork', decoder.searches)
+
+        stt.PocketSphinxDecoder._instances.clear()
+        sys.modules['pocketsphinx'].Decoder = FakeRemovingDecoder
+        sizes = iter([1000, 1000, 1000, 1500])
+        with mock.patch('client.modulecache.resident_bytes',
+                        lambda: next(sizes)):
+            keyword = stt.PocketSphinxSTT(self.vocabulary('keyword', []),
+                                          hmm_dir=self.tempdir)
+            zork = stt.PocketSphinxSTT(self.vocabulary('zork', []),
+                                       hmm_dir=self.tempdir)
+        decoder = FakeDecoder.instances[-1]
+        self.assertEqual(zork.resident_bytes, 500)
+        zork.transcribe_pcm('\0\0', 16000)
+        zork.close()
+        self.assertEqual(decoder.searches, {'keyword': 'keyword.lm'})
+        self.assertEqual(keyword.transcribe_pcm('\0\0', 16000),
+                         ['KEYWORD'])
+
+    def testGrammarSearch(self):
+        vocabulary = self.vocabulary('instance-Zork', [('TAKE', 'T EY K')])
+        vocabulary.decoder_kwargs = {'jsgf': 'zork.jsgf',
+                                     'dict': vocabulary.decoder_kwargs['dict']}
+        zork = stt.PocketSphinxSTT(vocabulary, hmm_dir=self.tempdir)
+        decoder = FakeDecoder.instances[0]
+        self.assertEqual(decoder.searches, {'instance-Zork': 'zork.jsgf'})
+        self.assertEqual(zork.transcribe_pcm('\0\0', 16000),
+                         ['INSTANCE-ZORK'])
+
+    def testNBest(self):
+        sys.modules['pocketsphinx'].Decoder = FakeNBestDecoder
+        engine = stt.PocketSphinxSTT(self.vocabulary('default', []),
+                                     hmm_dir=self.tempdir)
+        transcribed = engine.transcribe_pcm('\0\0' * 10, 16000)
+        self.assertEqual(transcribed, ['WHAT TIME', 'WHAT DIME'])
+        # the posterior of the best, and half of that
+        self.assertAlmostEqual(transcribed[0].confidence, 0.9, places=3)
+        self.assertAlmostEqual(transcribed[1].confidence, 0.45, places=3)
+
+        engine.nbest = 1
+        transcribed = engine.transcribe_pcm('\0\0' * 10, 16000)
+        self.assertEqual(transcribed, ['WHAT TIME'])
+        self.assertAlmostEqual(transcribed[0].confidence, 0.9, places=3)
+        engine.nbest = 5
+        engine.min_confidence = 0.5
+        self.assertEqual(engine.transcribe_pcm('\0\0' * 10, 16000),
+                         ['WHAT TIME'])
+
+    def testRejectBest(self):
+        sys.modules['pocketsphinx'].Decoder = FakeNBestDecoder
+        engine = stt.PocketSphinxSTT(self.vocabulary('default', []),
+                                     hmm_dir=self.tempdir)
+        decoder = FakeNBestDecoder.instances[0]
+        # the decoder isn't sure of anything, however it ranks the N-best
+        decoder.prob = int(round(math.log(0.01) / math.log(1.0001)))
+        transcribed = engine.transcribe_pcm('\0\0' * 10, 16000)
+        self.assertEqual(transcribed, [''])
+        engine.nbest = 1
+        self.assertEqual(engine.transcribe_pcm('\0\0' * 10, 16000), [''])
+        # without a posterior, there is nothing to reject with
+        decoder.hyp = lambda: FakeHypothesis('WHAT TIME')
+        transcribed = engine.transcribe_pcm('\0\0' * 10, 16000)
+        self.assertEqual(transcribed, ['WHAT TIME'])
+        self.assertIsNone(transcribed[0].confidence)
+
+    def testChoices(self):
+        sys.modules['pocketsphinx'].Decoder = FakeNBestDecoder
+        vocabulary = self.vocabulary('choices', [])
+        vocabulary.decoder_kwargs = {'jsgf': 'choices.jsgf',
+                                     'dict': vocabulary.decoder_kwargs['dict']}
+        with mock.patch.object(stt.PocketSphinxSTT, 'get_instance') as get:
+            get.side_effect = lambda name, phrases: stt.PocketSphinxSTT(
+                vocabulary, hmm_dir=self.tempdir)
+            engine = stt.PocketSphinxSTT.get_choices_instance(
+                ['WHAT TIME', 'WHAT DIME'])
+        decoder = FakeNBestDecoder.instances[0]
+        self.assertEqual(engine.transcribe_pcm('\0\0' * 10, 16000),
+                         ['WHAT TIME'])
+        # a choice the decoder isn't sure of is none of them
+        decoder.prob = int(round(math.log(0.3) / math.log(1.0001)))
+        self.assertEqual(engine.transcribe_pcm('\0\0' * 10, 16000), [''])
+
+    def testKeywordSpotter(self):
+        sys.modules['pocketsphinx'].Decoder = FakeKWSDecoder
+        engine = stt.PocketSphinxSTT(
+            self.vocabulary('keyword', [('JASPER', 'JH AE S P ER')]),
+            hmm_dir=self.tempdir)
+        spotter = engine.keyword_spotter({'JASPER': 1e-20})
+        decoder = FakeKWSDecoder.instances[0]
+        self.assertEqual(decoder.searches['keyword-keyphrases'],
+                         'JASPER /1e-20/\n')
+        spotter.start(16000)
+        spotted = [spotter.feed('\0\0' * 1600) for i in range(12)]
+        spotter.stop()
+        # spotted once, after a second, and then searched anew
+        self.assertEqual(spotted, [None] * 9 + ['JASPER', None, None])
+        self.assertEqual(decoder.utterances,
+                         [['keyword-keyphrases', 32000],
+                          ['keyword-keyphrases', 6400]])
+        self.assertTrue(stt.PocketSphinxDecoder.get_instance(
+            self.tempdir).lock.acquire(False))
+
+    def testSearchHeldDuringStream(self):
+        keyword = stt.PocketSphinxSTT(self.vocabulary('keyword', []),
+                                      hmm_dir=self.tempdir)
+        shared = stt.PocketSphinxDecoder.get_instance(self.tempdir)
+
+        def try_lock(result):
+            result.append(shared.lock.acquire(False))
+            if result[-1]:
+                shared.lock.release()
+
+        def locked_elsewhere():
+            result = []
+            thread = threading.Thread(target=try_lock, args=(result,))
+            thread.start()
+            thread.join()
+            return not result[0]
+
+        keyword.start_stream(16000)
+        # another thread can't switch the search in the middle
+        self.assertTrue(locked_elsewhere())
+        keyword.abort()
+        self.assertFalse(locked_elsewhere())
+
+
+FAKE_JULIUS = r'''
+import select
+import socket
+import struct
+import sys
+
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+sys.stdout.write('STAT: fake julius started\n')
+sys.stdout.flush()
+
+
+def listen(port):
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    s.bind(('127.0.0.1', int(port)))
+    s.listen(1)
+    return s.accept()[0]
+
+module = listen(args['-module'])
+adin = listen(args['-adport'])
+# the grammar from the command line has no name
+grammars = {'': open(args['-dfa']).read().strip()}
+active = set([''])
+commands = ''
+audio = ''
+utterance = ''
+
+
+def handle_commands():
+    global commands
+    while True:
+        line, sep, rest = commands.partition('\n')
+        if not sep:
+            return
+        command, _, name = line.partition(' ')
+        if command in ('CHANGEGRAM', 'ADDGRAM'):
+            if 'DICEND\n' not in rest:
+                return
+            dfa, rest = rest.split('DFAEND\n', 1)
+            rest = rest.split('DICEND\n', 1)[1]
+            if command == 'CHANGEGRAM':
+                grammars.clear()
+                active.clear()
+            grammars[name] = dfa.strip()
+            active.add(name)
+        elif command == 'ACTIVATEGRAM':
+            active.add(name)
+        elif command == 'DEACTIVATEGRAM':
+            active.discard(name)
+        commands = rest
+
+
+def recognize(data):
+    if data.startswith('CRASH'):
+        sys.exit(3)
+    words = ['<s>'] + sorted(grammars[name] for name in active) + \
+        [str(len(data)), '</s>']
+    message = '<RECOGOUT>\n  <SHYPO RANK="1" SCORE="-100.0">\n'
+    for word in words:
+        message += '    <WHYPO WORD="%s" CLASSID="0"/>\n' % word
+    module.sendall(message + '  </SHYPO>\n</RECOGOUT>\n.\n')
+
+while True:
+    readable = select.select([module, adin], [], [])[0]
+    # grammar changes are sent before the audio they apply to
+    if module in readable:
+        data = module.recv(4096)
+        if not data:
+            break
+        commands += data
+        handle_commands()
+        continue
+    data = adin.recv(4096)
+    if not data:
+        break
+    audio += data
+    while len(audio) >= 4:
+        size = struct.unpack('<i', audio[:4])[0]
+        if len(audio) < 4 + size:
+            break
+        utterance += audio[4:4 + size]
+        audio = audio[4 + size:]
+        if size == 0:
+            recognize(utterance)
+            utterance = ''
+'''
+
+
+class TestPocketSphinxLog(unittest.TestCase):
+
+    def wait_for(self, log, count):
+        deadline = time.time() + 5
+        while len(log.messages) < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    @unittest.skipUnless(os.path.isdir('/dev/fd'), "No /dev/fd")
+    def testRing(self):
+        log = stt.PocketSphinxLog(max_messages=3)
+        with mock.patch.object(log, '_logger') as logger:
+            logger.isEnabledFor.return_value = False
+            # like PocketSphinx, which opens the log file by name
+            with open(log.path, 'a') as f:
+                for i in range(5):
+                    f.write('INFO: message %d\n\n' % i)
+                    f.flush()
+                self.wait_for(log, 3)
+                self.assertEqual(log.messages, ['INFO: message 2',
+                                                'INFO: message 3',
+                                                'INFO: message 4'])
+                # nothing is formatted unless debug logging is enabled
+                self.assertFalse(logger.debug.called)
+                logger.isEnabledFor.return_value = True
+                f.write('INFO: message 5\n')
+                f.flush()
+                deadline = time.time() + 5
+                while not logger.debug.called and time.time() < deadline:
+                    time.sleep(0.01)
+        logger.debug.assert_called_once_with('pocketsphinx: %s',
+                                             'INFO: message 5')
+        self.assertEqual(log.messages[-1], 'INFO: message 5')
+
+
+class TestJuliusWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.julius = os.path.join(self.tempdir, 'julius')
+        with open(self.julius, 'w') as f:
+            f.write('#!%s\n' % sys.executable + FAKE_JULIUS)
+        os.chmod(self.julius, 0o755)
+        self.worker = stt.JuliusWorker('hmmdefs', 'tiedlist',
+                                       executable=self.julius)
+        self.worker.STARTUP_TIMEOUT = 10
+        self.worker.RECOGNITION_TIMEOUT = 10
+
+    def tearDown(self):
+        self.worker.close()
+        shutil.rmtree(self.tempdir)
+
+    def vocabulary(self, name):
+        vocabulary = mock.Mock()
+        vocabulary.name = name
+        vocabulary.dfa_file = os.path.join(self.tempdir, name + '.dfa')
+        vocabulary.dict_file = os.path.join(self.tempdir, name + '.dict')
+        # the fake julius "recognizes" the contents of the active DFAs
+        with open(vocabulary.dfa_file, 'w') as f:
+            f.write(name.upper())
+        with open(vocabulary.dict_file, 'w') as f:
+            f.write('0\t[%s] %s\n' % (name.upper(), name))
+        return vocabulary
+
+    def testParseResult(self):
+        message = ('<RECOGOUT>\n'
+                   '  <SHYPO RANK="2" SCORE="-200.0">\n'
+                   '    <WHYPO WORD="<s>"/><WHYPO WORD="WHAT"/>\n'
+                   '    <WHYPO WORD="TIME"/><WHYPO WORD="</s>"/>\n'
+                   '  </SHYPO>\n'
+                   '  <SHYPO RANK="1" SCORE="-100.0">\n'
+                   '    <WHYPO WORD="<s>"/><WHYPO WORD="TIME"/>\n'
+                   '    <WHYPO WORD="</s>"/>\n'
+                   '  </SHYPO>\n'
+                   '</RECOGOUT>\n')
+        self.assertEqual(stt.JuliusWorker.parse_result(message),
+                         ['TIME', 'WHAT TIME'])
+        self.assertEqual(stt.JuliusWorker.parse_result('<RECOGOUT>\n' +
+                                                       '</RECOGOUT>\n'),
+                         [''])
+
+    def testGrammarSwap(self):
+        keyword = self.vocabulary('keyword')
+        default = self.vocabulary('default')
+        recognize = self.worker.recognize
+        self.assertEqual(recognize('\0\0' * 5000, 'keyword', keyword),
+                         ['KEYWORD 10000'])
+        process = self.worker._proc
+        self.assertEqual(recognize('\0\0' * 10, 'default', default),
+                         ['DEFAULT 20'])
+        self.assertEqual(recognize('\0\0' * 10, 'keyword', keyword),
+                         ['KEYWORD 20'])
+        self.assertEqual(recognize('\0\0' * 10, 'keyword', keyword),
+                         ['KEYWORD 20'])
+        # all without restarting julius
+        self.assertIs(self.worker._proc, process)
+        self.assertEqual(self.worker.restarts, 0)
+
+    def testRestart(self):
+        keyword = self.vocabulary('keyword')
+        default = self.vocabulary('default')
+        self.assertEqual(self.worker.recognize('\0\0', 'default', default),
+                         ['DEFAULT 2'])
+        process = self.worker._proc
+        # an utterance that crashes julius twice is given up on
+        with self.assertRaises(IOError):
+            self.worker.recognize('CRASH', 'default', default)
+        # the next one gets a new julius, with the grammar loaded again
+        self.assertEqual(self.worker.recognize('\0\0', 'keyword', keyword),
+                         ['KEYWORD 2'])
+        self.assertIsNot(self.worker._proc, process)
+        self.assertEqual(self.worker.restarts, 1)
+
+
+class FakeEngine(stt.AbstractSTTEngine):
+    """An engine that takes a while to return a fixed result."""
+
+    def __init__(self, result, delay=0, error=None):
+        self.result = result
+        self.delay = delay
+        self.error = error
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def transcribe(self, fp):
+        pass
+
+    def transcribe_pcm(self, buffer, rate, width=2):
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class TestHedgedSTT(unittest.TestCase):
+
+    def hedged(self, local, remote):
+        return stt.HedgedSTT(local, remote, deadline=0.3, min_confidence=0.8)
+
+    def transcribe(self, engine):
+        start = time.time()
+        result = engine.transcribe_pcm('\0\0' * 100, 16000)
+        return result, time.time() - start
+
+    def testRemoteInTime(self):
+        engine = self.hedged(FakeEngine([stt.Hypothesis('LOCAL', 0.5)]),
+                             FakeEngine(['REMOTE'], delay=0.1))
+        self.assertEqual(self.transcribe(engine)[0], ['REMOTE'])
+        stats = engine.stats
+        self.assertEqual((stats['remote']['wins'], stats['local']['losses']),
+                         (1, 1))
+
+    def testConfidentLocal(self):
+        engine = self.hedged(FakeEngine([stt.Hypothesis('LOCAL', 0.9)]),
+                             FakeEngine(['REMOTE'], delay=1))
+        result, elapsed = self.transcribe(engine)
+        self.assertEqual(result, ['LOCAL'])
+        self.assertLess(elapsed, 0.2)
+        self.assertEqual(engine.stats['local']['wins'], 1)
+
+    def testDeadline(self):
+        engine = self.hedged(FakeEngine([stt.Hypothesis('LOCAL', 0.5)]),
+                             FakeEngine(['REMOTE'], delay=1))
+        result, elapsed = self.transcribe(engine)
+        self.assertEqual(result, ['LOCAL'])
+        self.assertGreaterEqual(elapsed, 0.3)
+        self.assertLess(elapsed, 0.6)
+        self.assertEqual(engine.stats['remote']['losses'], 1)
+
+    def testRemoteFails(self):
+        engine = self.hedged(FakeEngine(['LOCAL'], delay=0.1),
+                             FakeEngine([], error=IOError('no network')))
+        self.assertEqual(self.transcribe(engine)[0], ['LOCAL'])
+        stats = engine.stats
+        self.assertEqual((stats['local']['wins'], stats['remote']['errors']),
+                         (1, 1))
+        self.assertGreaterEqual(stats['local']['mean_latency'], 0.1)
+
+    def testUnsureLocal(self):
+        # without a confidence, or with nothing heard, the local engine
+        # doesn't win before the deadline
+        for local in (['LOCAL'], [stt.Hypothesis('', 0.95)]):
+            engine = self.hedged(FakeEngine(local),
+                                 FakeEngine(['REMOTE'], delay=1))
+            result, elapsed = self.transcribe(engine)
+            self.assertEqual(result, local)
+            self.assertGreaterEqual(elapsed, 0.3)
+
+    def testAbortRemote(self):
+        server = mockspeech.MockSpeechServer(latency=3)
+        session = httpsession.Session()
+        try:
+            remote = server.point(stt.GoogleSTT(api_key='secret'))
+            remote._http = session
+            # the remote requests are under way by the time they lose
+            engine = self.hedged(FakeEngine([stt.Hypothesis('LOCAL', 0.9)],
+                                            delay=0.1), remote)
+            start = time.time()
+            # more utterances than the pool has threads, which only works
+            # if the remote requests that lost don't hold on to theirs
+            for i in range(stt.HedgedSTT.POOL_SIZE + 2):
+                self.assertEqual(self.transcribe(engine)[0], ['LOCAL'])
+            self.assertLess(time.time() - start, 1.5)
+            stats = engine.stats
+            self.assertEqual((stats['remote']['losses'],
+                              stats['remote']['errors']),
+                             (stt.HedgedSTT.POOL_SIZE + 2, 0))
+        finally:
+            session.close()
+            server.close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8-*-
+import unittest
+import numpy as np
+from client import vad
+
+RATE = 16000
+
+
+def noise(seconds, rng, level=30):
+    return rng.normal(0, level, int(seconds * RATE))
+
+
+def vowel(seconds, level=3000):
+    # a harmonic complex with a 150 Hz fundamental, roughly like voiced
+    # speech
+    t = np.arange(int(seconds * RATE)) / float(RATE)
+    signal = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 12))
+    return level * signal / np.abs(signal).max()
+
+
+def to_pcm(*parts):
+    return np.concatenate(parts).astype('<i2').tostring()
+
+
+def run(endpointer, data, block):
+    for offset in range(0, len(data), block * 2):
+        end = endpointer.feed(data[offset:offset + block * 2])
+        if end is not None:
+            return offset // 2 + end
+    return None
+
+
+class TestVoiceActivityDetector(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = np.random.RandomState(0)
+
+    def testClassify(self):
+        detector = vad.VoiceActivityDetector(RATE, frame_ms=20)
+        decisions = detector.classify(to_pcm(noise(1, self.rng),
+                                             vowel(0.5)))
+        self.assertEqual(len(decisions), 75)
+        self.assertFalse(any(decisions[:50]))
+        self.assertTrue(all(decisions[51:]))
+
+    def testHiss(self):
+        # loud white noise has the band energy of speech, but far too many
+        # zero crossings
+        detector = vad.VoiceActivityDetector(RATE, frame_ms=20)
+        decisions = detector.classify(to_pcm(noise(1, self.rng),
+                                             noise(0.5, self.rng, 150)))
+        self.assertFalse(any(decisions))
+
+    def testAggressiveness(self):
+        with self.assertRaises(ValueError):
+            vad.VoiceActivityDetector(RATE, aggressiveness=4)
+
+
+class TestVADEndpointer(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.data = to_pcm(noise(1, rng), vowel(0.3), noise(0.1, rng),
+                           vowel(0.4), noise(2, rng))
+        self.speech_end = int(1.8 * RATE)
+
+    def testEndpoint(self):
+        detector = vad.VoiceActivityDetector(RATE, frame_ms=20)
+        endpointer = vad.VADEndpointer(detector, hangover_ms=200)
+        end = run(endpointer, self.data, 1024)
+        self.assertEqual(endpointer.utterances, 1)
+        # the short pause doesn't end the recording, and the end is found
+        # within the hangover time (plus a frame) after speech stops
+        self.assertGreater(end, self.speech_end)
+        self.assertLessEqual(end - self.speech_end, int(0.22 * RATE))
+
+    def testBlockSize(self):
+        ends = set()
+        for block in (160, 333, 1024, 4096):
+            detector = vad.VoiceActivityDetector(RATE, frame_ms=20)
+            endpointer = vad.VADEndpointer(detector, hangover_ms=200)
+            ends.add(run(endpointer, self.data, block))
+        self.assertEqual(len(ends), 1)
+
+    def testNoSpeech(self):
+        rng = np.random.RandomState(1)
+        detector = vad.VoiceActivityDetector(RATE, noise_rms=30)
+        endpointer = vad.VADEndpointer(detector)
+        self.assertIsNone(run(endpointer, to_pcm(noise(3, rng)), 1024))
+        self.assertEqual(endpointer.utterances, 0)
@@ -35,6 +35,20 @@ class TestVocabCompiler(unittest.TestCase):
                 extracted_phrases = vocabcompiler.get_keyword_phrases()
         self.assertEqual(expected_phrases, extracted_phrases)
 
+    def testKeywordThresholds(self):
+        def keywords_file(*args, **kwargs):
+            f = tempfile.TemporaryFile()
+            f.write("MOCK /1e-20/\nOTHER\nMOCK PHRASE /1e-30/\n")
+            f.seek(0)
+            return f
+
+        with mock.patch('%s.open' % vocabcompiler.__name__,
+                        side_effect=keywords_file, create=True):
+            thresholds = vocabcompiler.get_keyword_thresholds()
+            phrases = vocabcompiler.get_keyword_phrases()
+        self.assertEqual(thresholds, {'MOCK': 1e-20, 'MOCK PHRASE': 1e-30})
+        self.assertEqual(phrases, ['MOCK', 'OTHER', 'MOCK PHRASE'])
+
 
 class TestVocabulary(unittest.TestCase):
     VOCABULARY = vocabcompiler.DummyVocabulary